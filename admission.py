@@ -0,0 +1,394 @@
+"""Admission control in front of the analysis pipeline.
+
+Two gates, both keyed on a client id (hashed API key, else remote IP):
+
+* a token bucket per client, checked when a request arrives, so one client
+  cannot spend the whole provider quota; and
+* a global cap on concurrent model calls, sized to the provider's rate
+  limits. When every slot is taken, waiters are served round-robin across
+  clients, so a client with twenty queued uploads does not starve one with
+  a single upload. A request that would wait longer than ``max_wait`` is
+  rejected up front with a Retry-After estimate instead of timing out.
+
+Bucket and slot state lives in ``MemoryState`` (one process) or
+``RedisState`` (shared by every gunicorn/uvicorn worker through any
+Redis-compatible server, via ADMISSION_REDIS_URL and the optional ``redis``
+package). Only the fair queue itself is per process; waiters poll the shared
+state so slots freed by other workers are picked up.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import REGISTRY
+
+
+ADMISSION_DECISIONS = REGISTRY.counter(
+    "neurospace_admission_total", "Admission decisions by outcome", ("outcome",))
+ADMISSION_WAIT = REGISTRY.histogram(
+    "neurospace_admission_wait_seconds", "Time spent queued for a model slot")
+
+
+class Rejected(Exception):
+    """Request refused by admission control; maps to 429 with Retry-After."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Too many requests ({reason}); retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def client_key(api_key: str = None, address: str = None) -> str:
+    """Stable client id; API keys are hashed so they never reach logs or /health."""
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return f"ip:{address or 'unknown'}"
+
+
+class MemoryState:
+    """Buckets and slot leases for a single process."""
+
+    blocking = False
+
+    def __init__(self):
+        self._buckets = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        """Spend cost tokens. Returns 0 on success, else seconds until they would be available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+    def acquire_slot(self, limit: int, ttl: float):
+        """Lease id if a slot was free, else None. Leases expire after ttl seconds."""
+        now = time.monotonic()
+        with self._lock:
+            for lease in [k for k, expires in self._leases.items() if expires <= now]:
+                del self._leases[lease]
+            if len(self._leases) >= limit:
+                return None
+            lease = uuid.uuid4().hex
+            self._leases[lease] = now + ttl
+            return lease
+
+    def release_slot(self, lease: str) -> None:
+        with self._lock:
+            self._leases.pop(lease, None)
+
+    def slots_in_use(self) -> int:
+        with self._lock:
+            return len(self._leases)
+
+
+_TAKE_SCRIPT = """
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+_ACQUIRE_SCRIPT = """
+local limit, now, ttl, lease = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4]
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then return 0 end
+redis.call('ZADD', KEYS[1], now + ttl, lease)
+return 1
+"""
+
+
+class RedisState:
+    """Buckets and slot leases shared through a Redis-compatible server."""
+
+    # Every call is a network round trip; async callers make them off the loop
+    blocking = True
+
+    def __init__(self, url: str, prefix: str = "neurospace:admission"):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._slots_key = f"{prefix}:slots"
+        self._take = self._redis.register_script(_TAKE_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+
+    def _now(self) -> float:
+        # Server time, so workers on different hosts agree on bucket refills
+        seconds, micros = self._redis.time()
+        return seconds + micros / 1e6
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        return float(self._take(keys=[f"{self._prefix}:bucket:{key}"],
+                                args=[rate, burst, cost, self._now()]))
+
+    def acquire_slot(self, limit: int, ttl: float):
+        lease = uuid.uuid4().hex
+        ok = self._acquire(keys=[self._slots_key], args=[limit, self._now(), ttl, lease])
+        return lease if ok else None
+
+    def release_slot(self, lease: str) -> None:
+        self._redis.zrem(self._slots_key, lease)
+
+    def slots_in_use(self) -> int:
+        return self._redis.zcount(self._slots_key, self._now(), "+inf")
+
+
+class _Waiter:
+    __slots__ = ("client", "lease", "notify")
+
+    def __init__(self, client: str, notify):
+        self.client = client
+        self.lease = None
+        self.notify = notify
+
+
+class AdmissionController:
+    def __init__(self, state=None, rate_per_minute: float = 30, burst: float = 10,
+                 max_concurrent: int = 16, max_wait: float = 20.0, max_queued_per_client: int = 8,
+                 lease_seconds: float = 180.0, poll_interval: float = 0.05):
+        self.state = state or MemoryState()
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.max_queued_per_client = max_queued_per_client
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        self._waiting = OrderedDict()
+        self._lock = threading.Lock()
+        # EWMA of how long a slot is held, for wait estimates
+        self._hold_seconds = 5.0
+        self._stats = {"admitted": 0, "queued": 0, "rateLimited": 0, "rejectedBusy": 0, "timedOut": 0}
+
+    @classmethod
+    def from_env(cls, default_concurrency: int = 16) -> "AdmissionController":
+        """Configure from ADMISSION_* env vars.
+
+        The concurrency cap defaults to what PROVIDER_RPM allows at the
+        expected call length (Little's law), else to default_concurrency.
+        """
+        concurrency = os.getenv("ADMISSION_MAX_CONCURRENT")
+        if concurrency is None and os.getenv("PROVIDER_RPM"):
+            call_seconds = float(os.getenv("ADMISSION_CALL_SECONDS", 8))
+            concurrency = math.ceil(float(os.getenv("PROVIDER_RPM")) / 60 * call_seconds)
+
+        redis_url = os.getenv("ADMISSION_REDIS_URL")
+        return cls(
+            state=RedisState(redis_url) if redis_url else MemoryState(),
+            rate_per_minute=float(os.getenv("ADMISSION_RATE_PER_MINUTE", 30)),
+            burst=float(os.getenv("ADMISSION_BURST", 10)),
+            max_concurrent=int(concurrency or default_concurrency),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 20)),
+            max_queued_per_client=int(os.getenv("ADMISSION_MAX_QUEUED_PER_CLIENT", 8)),
+            lease_seconds=float(os.getenv("ADMISSION_LEASE_SECONDS", 180)),
+        )
+
+    # --- Rate limit ---
+
+    def check_rate(self, client: str, cost: float = 1) -> None:
+        """Spend cost tokens from the client's bucket or raise Rejected."""
+        if self.rate <= 0:
+            return
+        wait = self.state.take(client, self.rate, max(self.burst, cost), cost)
+        if wait > 0:
+            self._count("rateLimited", "rate_limited")
+            raise Rejected("rate limit", wait)
+
+    # --- Concurrency slots ---
+
+    def _count(self, stat: str, outcome: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+        ADMISSION_DECISIONS.inc(outcome=outcome)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting clients in round-robin order. Caller holds _lock."""
+        while self._waiting:
+            client, waiters = next(iter(self._waiting.items()))
+            lease = self.state.acquire_slot(self.max_concurrent, self.lease_seconds)
+            if lease is None:
+                return
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            waiter.lease = lease
+            waiter.notify()
+
+    def _enqueue(self, client: str, max_wait, notify):
+        """Take a slot now, or queue a waiter. Returns (lease, waiter)."""
+        with self._lock:
+            self._dispatch()
+            if not self._waiting:
+                lease = self.state.acquire_slot(self.max_concurrent, self.lease_seconds)
+                if lease is not None:
+                    return lease, None
+
+            queued = len(self._waiting.get(client, ()))
+            total = sum(len(w) for w in self._waiting.values())
+            estimate = math.ceil((total + 1) / self.max_concurrent) * self._hold_seconds
+            if max_wait is not None and (queued >= self.max_queued_per_client or estimate > max_wait):
+                self._stats["rejectedBusy"] += 1
+                ADMISSION_DECISIONS.inc(outcome="rejected_busy")
+                raise Rejected("server busy", estimate)
+
+            waiter = _Waiter(client, notify)
+            self._waiting.setdefault(client, deque()).append(waiter)
+            self._stats["queued"] += 1
+            return None, waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Drop a waiter that gave up. False if it was granted a slot meanwhile."""
+        with self._lock:
+            if waiter.lease is not None:
+                return False
+            waiters = self._waiting.get(waiter.client)
+            if waiters is not None:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiting[waiter.client]
+            self._stats["timedOut"] += 1
+        ADMISSION_DECISIONS.inc(outcome="timed_out")
+        return True
+
+    def _poll(self, waiter: _Waiter, deadline) -> None:
+        """Pick up slots freed by other processes; raise Rejected once past the deadline."""
+        with self._lock:
+            self._dispatch()
+        if waiter.lease is None and deadline is not None and time.monotonic() >= deadline:
+            if self._abandon(waiter):
+                raise Rejected("queue timeout", self._hold_seconds)
+
+    def acquire(self, client: str, background: bool = False) -> str:
+        """Block until a model slot is free; returns its lease.
+
+        Interactive requests wait at most max_wait and are rejected early when
+        that is clearly not enough; background work (batches, async jobs)
+        waits as long as it takes, still in its client's fair share.
+        """
+        max_wait = None if background else self.max_wait
+        start = time.monotonic()
+        event = threading.Event()
+        lease, waiter = self._enqueue(client, max_wait, event.set)
+        if waiter is not None:
+            deadline = start + max_wait if max_wait is not None else None
+            while not event.wait(self.poll_interval):
+                self._poll(waiter, deadline)
+            lease = waiter.lease
+        return self._admitted(lease, start)
+
+    async def _off_loop(self, fn, *args):
+        """fn(*args) in a worker thread when the state makes network calls, inline otherwise."""
+        if not self.state.blocking:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def aacquire(self, client: str, background: bool = False) -> str:
+        """acquire() for the event loop: waiting never blocks it, and neither do
+        RedisState round trips, which run in worker threads."""
+        max_wait = None if background else self.max_wait
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        enqueue = asyncio.ensure_future(
+            self._off_loop(self._enqueue, client, max_wait, lambda: loop.call_soon_threadsafe(granted.set)))
+        try:
+            lease, waiter = await asyncio.shield(enqueue)
+        except asyncio.CancelledError:
+            # The thread may still take a slot or queue a waiter; undo that when it does
+            def undo(task):
+                if not task.cancelled() and task.exception() is None:
+                    loop.create_task(self._aundo(*task.result()))
+            enqueue.add_done_callback(undo)
+            raise
+        if waiter is not None:
+            deadline = start + max_wait if max_wait is not None else None
+            try:
+                while waiter.lease is None:
+                    try:
+                        await asyncio.wait_for(granted.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        await self._off_loop(self._poll, waiter, deadline)
+            except asyncio.CancelledError:
+                await self._aundo(None, waiter)
+                raise
+            lease = waiter.lease
+        # _admitted and _abandon take the lock dispatching threads hold across state calls
+        return await self._off_loop(self._admitted, lease, start)
+
+    async def _aundo(self, lease, waiter) -> None:
+        """Give back what a cancelled aacquire() obtained: a lease, or a queued waiter."""
+        if waiter is not None and not await self._off_loop(self._abandon, waiter):
+            lease = waiter.lease
+        if lease is not None:
+            await self._off_loop(self.release, lease)
+
+    def _admitted(self, lease: str, start: float) -> str:
+        ADMISSION_WAIT.observe(time.monotonic() - start)
+        self._count("admitted", "admitted")
+        return lease
+
+    def release(self, lease: str, held: float = None) -> None:
+        self.state.release_slot(lease)
+        with self._lock:
+            if held is not None:
+                self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, client: str, background: bool = False):
+        lease = self.acquire(client, background)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(lease, time.monotonic() - start)
+
+    @asynccontextmanager
+    async def aslot(self, client: str, background: bool = False):
+        lease = await self.aacquire(client, background)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            # A release cut short by cancellation still completes in its thread
+            await self._off_loop(self.release, lease, time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            queues = {client: len(w) for client, w in self._waiting.items()}
+            stats = dict(self._stats)
+            hold = self._hold_seconds
+        return {
+            "state": type(self.state).__name__,
+            "ratePerMinute": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "maxConcurrent": self.max_concurrent,
+            "inUse": self.state.slots_in_use(),
+            "queued": sum(queues.values()),
+            "queuedClients": len(queues),
+            "longestQueue": max(queues.values(), default=0),
+            "avgHoldSeconds": round(hold, 2),
+            **stats,
+        }
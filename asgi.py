@@ -0,0 +1,404 @@
+"""ASGI serving mode: /analyze, /analyze/quick, /health, /ready and /meta on a single event loop.
+
+With Flask and sync gunicorn every in-flight analysis pins a worker thread
+for the seconds it spends waiting on the model. Here each request is a
+coroutine: the model call goes through ``AsyncOpenAI``, Pillow preprocessing
+runs in a thread (or process) pool so it never blocks the loop, and a single
+process can hold hundreds of analyses open at once.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 [--workers N]
+
+Caching, normalization, metrics and error mapping are shared with server.py,
+so responses are identical to the Flask app's.
+
+Environment knobs:
+    ASGI_MAX_INFLIGHT         concurrent model calls per process (default 512); also the
+                              default admission cap (ADMISSION_MAX_CONCURRENT overrides)
+    ASGI_HTTP_POOL_SIZE       keep-alive connections to OpenAI (default ASGI_MAX_INFLIGHT)
+    ASGI_PREPROCESS_EXECUTOR  "thread" or "process" (default thread)
+    ASGI_PREPROCESS_WORKERS   preprocessing pool size (default cpu count)
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartParser
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import server
+from admission import AdmissionController, Rejected, client_key
+from budgets import attribute
+from http_encoding import COMPRESS_MIN_BYTES, GZIP_LEVEL
+from metrics import (
+    REGISTRY, REQUESTS, begin_spans, end_memory, end_spans, log, log_event, note_memory, observe_stage,
+    server_timing, stage,
+)
+from preprocess import preprocess_image
+from similarity import image_hashes
+from transport import make_async_openai_http_client
+
+
+ASGI_MAX_INFLIGHT = int(os.getenv("ASGI_MAX_INFLIGHT", 512))
+ASGI_HTTP_POOL_SIZE = int(os.getenv("ASGI_HTTP_POOL_SIZE", ASGI_MAX_INFLIGHT))
+PREPROCESS_EXECUTOR = os.getenv("ASGI_PREPROCESS_EXECUTOR", "thread")
+PREPROCESS_WORKERS = int(os.getenv("ASGI_PREPROCESS_WORKERS", os.cpu_count() or 2))
+
+# Same spill-to-disk threshold for file parts as the Flask app
+MultiPartParser.spool_max_size = server.UPLOAD_SPOOL_BYTES
+
+# server.admission is sized for a thread per model call; a waiting coroutine
+# costs next to nothing, so cap this process at ASGI_MAX_INFLIGHT instead
+server.admission = AdmissionController.from_env(default_concurrency=ASGI_MAX_INFLIGHT)
+
+
+def create_async_openai_client():
+    """AsyncOpenAI client for this worker; built at startup so the import stays cheap."""
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=make_async_openai_http_client(ASGI_HTTP_POOL_SIZE, server.MODEL_TIMEOUT_SECONDS),
+        # Retries are handled by transport.Guard so they share one deadline
+        max_retries=0,
+    )
+
+
+_model_slots = asyncio.Semaphore(ASGI_MAX_INFLIGHT)
+_inflight = 0
+_preprocess_pool = None
+
+
+REGISTRY.gauge("neurospace_asgi_inflight", "Analyses currently in progress in this ASGI process",
+               lambda: _inflight)
+
+
+def get_preprocess_pool():
+    """Lazily create the pool Pillow work is pushed to, off the event loop."""
+    global _preprocess_pool
+    if _preprocess_pool is None:
+        if PREPROCESS_EXECUTOR == "process":
+            _preprocess_pool = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+        else:
+            _preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS,
+                                                  thread_name_prefix="preprocess")
+    return _preprocess_pool
+
+
+async def compress_image(upload, max_size_mb: int = 4) -> bytes:
+    """Preprocess an UploadFile off the loop; threads decode straight from its spooled file."""
+    if PREPROCESS_EXECUTOR == "process":
+        # File handles cannot cross the process boundary
+        source = await upload.read()
+        note_memory(len(source))
+    else:
+        source = upload.file
+
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    output, info = await loop.run_in_executor(
+        get_preprocess_pool(), preprocess_image, source, max_size_mb, server.ANALYSIS_PROMPT.detail)
+    # Time spent waiting for a pool slot: the signal that preprocessing is CPU bound
+    waited = time.perf_counter() - start - info["timings"]["total_ms"] / 1000
+    observe_stage("preprocess_queue", max(0.0, waited))
+    server.record_preprocess(info)
+    return output
+
+
+async def analyze_compressed(image_bytes: bytes, client: str = None) -> tuple:
+    """Async server.analyze_compressed. Returns (result, cache_hit).
+
+    Cache, history, usage and Redis calls block (SQLite, sockets), so they run
+    in the thread pool; run_in_threadpool copies the context, which keeps
+    stage timings and budget attribution with the request.
+    """
+    mode = await run_in_threadpool(server.budget_mode, client)
+    if mode == "local":
+        return await run_in_threadpool(server.analyze_locally, image_bytes)
+    if server.analysis_flights is None:
+        return await analyze_uncoalesced(image_bytes, server.analysis_key(image_bytes, mode), client, mode)
+
+    key = server.analysis_key(image_bytes, mode)
+    (result, cache_hit), coalesced = await server.analysis_flights.ado(
+        key, lambda: analyze_uncoalesced(image_bytes, key, client, mode))
+    if coalesced:
+        log_event(logging.INFO, "joined an in-flight analysis of the same image", key=key)
+    return result, cache_hit or coalesced
+
+
+async def analyze_uncoalesced(image_bytes: bytes, key: str = None, client: str = None, mode: str = "full") -> tuple:
+    key, cached = await run_in_threadpool(server.cache_lookup, image_bytes, key)
+    if cached is None and mode != "full":
+        cached = await run_in_threadpool(server.analysis_cache.get, server.analysis_key(image_bytes))
+    if cached is not None:
+        return cached, True
+
+    hashes = None
+    if server.similar_images is not None:
+        with stage("phash"):
+            hashes = await asyncio.get_running_loop().run_in_executor(
+                get_preprocess_pool(), image_hashes, image_bytes)
+    match = await run_in_threadpool(server.near_duplicate, hashes) if hashes is not None else None
+    if match is not None and server.NEAR_DUP_MODE == "reuse":
+        return await run_in_threadpool(server.reuse_near_duplicate, key, hashes, *match), True
+
+    measured = await measure_locally(image_bytes)
+    prompt = server.seeded_prompt(match, measured)
+    if mode != "full":
+        prompt = server.budgets.degrade(prompt, mode)
+
+    note_memory(server.request_footprint(image_bytes))
+    async with server.admission.aslot(client):
+        with attribute(client or "internal", mode):
+            async with _model_slots:
+                with stage("model_call"):
+                    reply = await server.vision_router.acomplete(image_bytes, prompt)
+
+            analysis, repaired = server.parse_reply(reply)
+            notes = {"repaired": repaired}
+            if mode == "full":
+                analysis = await fill_gaps(image_bytes, analysis, notes)
+    if mode != "full":
+        notes["budgetMode"] = mode
+        hashes = None
+    return await run_in_threadpool(server.finish_analysis, key, analysis, notes, hashes, measured), False
+
+
+async def measure_locally(image_bytes: bytes):
+    """Async server.measure_locally: the NumPy work runs in the preprocess pool."""
+    if not server.LOCAL_METRICS:
+        return None
+    from local_metrics import measure_image
+
+    try:
+        with stage("local_metrics"):
+            return await asyncio.get_running_loop().run_in_executor(
+                get_preprocess_pool(), measure_image, image_bytes)
+    except Exception as e:
+        log_event(logging.WARNING, "local metrics failed", error=str(e), type=type(e).__name__)
+        return None
+
+
+async def fill_gaps(image_bytes: bytes, analysis, notes: dict):
+    """Async server.fill_gaps: re-ask for only the missing sections."""
+    gaps, prompt = server.plan_reask(analysis)
+    if gaps is None:
+        return analysis
+
+    try:
+        async with _model_slots:
+            with stage("model_reask"):
+                reply = await server.vision_router.acomplete(image_bytes, prompt)
+        return server.apply_reask(analysis, gaps, reply, notes)
+    except Exception as e:
+        log.exception("re-ask for missing sections failed",
+                      extra={"fields": {"sections": gaps["sections"], "error": type(e).__name__}})
+        return analysis
+
+
+async def run_analysis(upload, client: str = None) -> tuple:
+    global _inflight
+    _inflight += 1
+    try:
+        image_bytes = await compress_image(upload, max_size_mb=4)
+        return await analyze_compressed(image_bytes, client)
+    finally:
+        _inflight -= 1
+
+
+def finish(response: Response, endpoint: str) -> Response:
+    """Count the request and attach its Server-Timing header."""
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    spans = end_spans()
+    if spans:
+        response.headers['Server-Timing'] = server_timing(spans)
+    peak = end_memory()
+    if peak:
+        response.headers['X-Peak-Memory'] = str(peak)
+    return response
+
+
+def request_client(request) -> str:
+    """Starlette counterpart of server.request_client."""
+    auth = request.headers.get('authorization', '')
+    api_key = request.headers.get('x-api-key') or (auth[7:] if auth.startswith('Bearer ') else None)
+    forwarded = request.headers.get('x-forwarded-for')
+    if server.ADMISSION_TRUST_PROXY and forwarded:
+        address = forwarded.split(',')[0].strip()
+    else:
+        address = request.client.host if request.client else None
+    return client_key(api_key, address)
+
+
+def check_upload(form) -> tuple:
+    """Validate the single 'file' upload. Returns (UploadFile, error_response)."""
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        log_event(logging.WARNING, "no file part in request")
+        return None, JSONResponse({"error": "No file part"}, 400)
+
+    if not file.filename:
+        log_event(logging.WARNING, "no file selected")
+        return None, JSONResponse({"error": "No selected file"}, 400)
+
+    if not server.allowed_file(file.filename):
+        log_event(logging.WARNING, "invalid file type", filename=file.filename)
+        return None, JSONResponse({"error": "Invalid file type"}, 400)
+
+    log_event(logging.INFO, "upload received", filename=file.filename, bytes=file.size,
+              spooled=(file.size or 0) > server.UPLOAD_SPOOL_BYTES)
+
+    if not file.size:
+        return None, JSONResponse({"error": "Empty file uploaded"}, 400)
+
+    return file, None
+
+
+async def analyze(request):
+    begin_spans()
+    start = time.perf_counter()
+
+    length = request.headers.get('content-length')
+    if length:
+        try:
+            length = int(length)
+        except ValueError:
+            return finish(JSONResponse({"error": "Invalid Content-Length"}, 400), "analyze")
+        if length > server.app.config['MAX_CONTENT_LENGTH']:
+            return finish(JSONResponse({"error": "File too large"}, 413), "analyze")
+
+    client = request_client(request)
+    try:
+        # A Redis-backed bucket is a network round trip
+        await run_in_threadpool(server.admission.check_rate, client)
+    except Rejected as e:
+        body, status, headers = server.analysis_error(e)
+        return finish(JSONResponse(body, status, headers), "analyze")
+
+    # The form (and its spooled temp file) stays open until the analysis is done
+    with stage("upload_read"):
+        form = await request.form(max_files=1, max_fields=10)
+    try:
+        upload, error = check_upload(form)
+        if error is not None:
+            return finish(error, "analyze")
+        venue = (form.get('venue') or '').strip() or None
+        label = (form.get('label') or '').strip() or None
+
+        try:
+            result, cache_hit = await run_analysis(upload, client)
+            # SQLite write: keep it off the loop
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, server.record_history, result, venue, label)
+        except Exception as e:
+            body, status, headers = server.analysis_error(e)
+            return finish(JSONResponse(body, status, headers), "analyze")
+    finally:
+        await form.close()
+
+    observe_stage("total", time.perf_counter() - start)
+    log_event(logging.INFO, "analysis complete", cache_hit=cache_hit,
+              ms=round((time.perf_counter() - start) * 1000, 1))
+    return finish(JSONResponse(result, headers={'X-Cache': 'HIT' if cache_hit else 'MISS'}), "analyze")
+
+
+async def analyze_quick(request):
+    """Local pixel metrics only, like the Flask app's /analyze/quick."""
+    begin_spans()
+    if not server.LOCAL_METRICS:
+        return finish(JSONResponse({"error": "Local metrics are disabled"}, 404), "analyze_quick")
+
+    with stage("upload_read"):
+        form = await request.form(max_files=1, max_fields=10)
+    try:
+        upload, error = check_upload(form)
+        if error is not None:
+            return finish(error, "analyze_quick")
+        image_bytes = await upload.read()
+    finally:
+        await form.close()
+
+    from local_metrics import measure_image
+    try:
+        with stage("local_metrics"):
+            measured = await asyncio.get_running_loop().run_in_executor(
+                get_preprocess_pool(), measure_image, image_bytes)
+    except Exception as e:
+        body, status, headers = server.analysis_error(e)
+        return finish(JSONResponse(body, status, headers), "analyze_quick")
+    return finish(JSONResponse(measured), "analyze_quick")
+
+
+async def health(request):
+    # The cache, budget and history stats may query Redis or SQLite.
+    body = await run_in_threadpool(server.health_status)
+    body["asgi"] = {"inflight": _inflight, "maxInflight": ASGI_MAX_INFLIGHT,
+                    "preprocessExecutor": PREPROCESS_EXECUTOR}
+    return finish(JSONResponse(body), "health")
+
+
+async def ready(request):
+    server.start_warm_up()
+    status = server.readiness()
+    return finish(JSONResponse(status, 200 if status["ready"] else 503), "ready")
+
+
+async def meta(request):
+    return finish(JSONResponse(server.frontend_meta(),
+                               headers={'Cache-Control': f'public, max-age={server.META_MAX_AGE}'}), "meta")
+
+
+async def metrics(request):
+    return finish(Response(REGISTRY.render(), media_type='text/plain; version=0.0.4'), "metrics")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    log_event(logging.INFO, "NeuroSpace AI ASGI server running", max_inflight=ASGI_MAX_INFLIGHT,
+              preprocess=PREPROCESS_EXECUTOR)
+    # Each uvicorn worker runs its own lifespan, so the client is created post-fork
+    if server.async_openai_client is None and any(b.name == "openai" for b in server.vision_router.backends):
+        server.async_openai_client = create_async_openai_client()
+    server.start_warm_up()
+    yield
+    if _preprocess_pool is not None:
+        _preprocess_pool.shutdown(wait=False, cancel_futures=True)
+    client = server.async_openai_client
+    if client is not None and hasattr(client, "close"):
+        await client.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/analyze', analyze, methods=['POST']),
+        Route('/analyze/quick', analyze_quick, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/ready', ready, methods=['GET']),
+        Route('/meta', meta, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST", "OPTIONS"],
+                   allow_headers=["Content-Type", "Authorization", "X-API-Key"],
+                   expose_headers=["Retry-After", "X-Cache"]),
+    ] + ([
+        # gzip only; brotli and ETags are the Flask app's (http_encoding)
+        Middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES, compresslevel=GZIP_LEVEL),
+    ] if COMPRESS_MIN_BYTES > 0 else []),
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level="warning")
@@ -0,0 +1,555 @@
+"""Vision model backends and a latency-aware router with hedged requests.
+
+Each backend turns (image bytes, prompts.Prompt) into raw model text plus
+token usage. ``VisionRouter`` keeps a rolling latency window per
+backend, sends each request to the backend that has been fastest lately, and
+if that call has not returned by the primary's p95 latency it fires the same
+request at the next backend and takes whichever answers first.
+
+``acomplete`` is the asyncio flavour used by the ASGI app: backends with an
+async client await it directly, the rest run ``complete`` in a thread.
+``stream`` serves /analyze/stream; streams are not hedged, but a backend
+that fails to open one fails over to the next.
+"""
+import asyncio
+import base64
+import contextvars
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import REGISTRY, stage
+from transport import Guard
+
+
+BackendReply = namedtuple("BackendReply", "text usage backend latency")
+
+BACKEND_CALLS = REGISTRY.counter(
+    "neurospace_backend_calls_total", "Vision backend calls by backend and outcome", ("backend", "outcome"))
+HEDGES = REGISTRY.counter(
+    "neurospace_hedged_requests_total", "Requests where a second backend was fired", ("winner",))
+
+
+def image_data_url(image_bytes: bytes) -> str:
+    """JPEG data: URL, built without keeping a separate base64 str alive."""
+    with stage("base64_encode"):
+        return "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("ascii")
+
+
+def request_footprint(image_bytes: bytes) -> int:
+    """Estimated peak bytes while a request carrying the image is built and sent.
+
+    The raw JPEG, the data: URL and the SDK's serialized JSON body are all
+    alive at the same time; each of the last two is ~4/3 of the JPEG.
+    """
+    return len(image_bytes) + 2 * 4 * ((len(image_bytes) + 2) // 3)
+
+
+class BackendError(Exception):
+    """Raised when every backend tried for a request failed."""
+
+
+class VisionBackend:
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+        self.guard = Guard.from_env(self.name)
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    def complete(self, image_bytes: bytes, prompt, timeout: float = None) -> tuple:
+        """Return (raw_text, usage) where usage is a token-count dict or None."""
+        raise NotImplementedError
+
+    async def acomplete(self, image_bytes: bytes, prompt, timeout: float = None) -> tuple:
+        """Async complete(); backends without an async client block a worker thread instead."""
+        return await asyncio.to_thread(self.complete, image_bytes, prompt, timeout=timeout)
+
+    def open_stream(self, image_bytes: bytes, prompt, timeout: float = None):
+        """Start a streamed completion; returns an iterator of (text_delta, usage) pairs,
+        usage set only on the last. Backends that can't stream return the whole
+        reply as one delta."""
+        text, usage = self.complete(image_bytes, prompt, timeout=timeout)
+        return iter([(text, None), (None, usage)])
+
+    def warm(self, ping: bool = False, timeout: float = 5.0) -> None:
+        """Build the client ahead of the first request; ``ping`` also makes a cheap API call
+        so a keep-alive connection is already open."""
+
+
+class OpenAIBackend(VisionBackend):
+    name = "openai"
+
+    def __init__(self, get_client, model: str = "gpt-4o-mini", get_async_client=None):
+        super().__init__(model)
+        # Getters rather than clients so tests/benchmarks can swap the client
+        self.get_client = get_client
+        self.get_async_client = get_async_client or (lambda: None)
+
+    def _request(self, image_bytes, prompt, timeout) -> dict:
+        return dict(
+            model=self.model,
+            response_format=prompt.response_format,
+            messages=[
+                {"role": "system", "content": prompt.system},
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt.user_text},
+                        {"type": "image_url",
+                         "image_url": {"url": image_data_url(image_bytes), "detail": prompt.detail}},
+                    ],
+                },
+            ],
+            temperature=prompt.temperature,
+            max_tokens=prompt.max_tokens,
+            timeout=timeout,
+        )
+
+    @staticmethod
+    def _reply(response) -> tuple:
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            usage = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+        return response.choices[0].message.content, usage
+
+    def complete(self, image_bytes, prompt, timeout=None):
+        request = self._request(image_bytes, prompt, timeout)
+        return self._reply(self.get_client().chat.completions.create(**request))
+
+    def open_stream(self, image_bytes, prompt, timeout=None):
+        request = self._request(image_bytes, prompt, timeout)
+        stream = self.get_client().chat.completions.create(
+            **request, stream=True, stream_options={"include_usage": True})
+
+        def deltas():
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content, None
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    yield None, {"prompt_tokens": usage.prompt_tokens,
+                                 "completion_tokens": usage.completion_tokens}
+        return deltas()
+
+    def warm(self, ping=False, timeout=5.0):
+        client = self.get_client()
+        if ping:
+            client.models.retrieve(self.model, timeout=timeout)
+
+    async def acomplete(self, image_bytes, prompt, timeout=None):
+        client = self.get_async_client()
+        if client is None:
+            return await super().acomplete(image_bytes, prompt, timeout=timeout)
+        request = self._request(image_bytes, prompt, timeout)
+        return self._reply(await client.chat.completions.create(**request))
+
+
+class GeminiBackend(VisionBackend):
+    name = "gemini"
+
+    def __init__(self, model: str = "gemini-1.5-flash", api_key: str = None):
+        super().__init__(model)
+        self.api_key = api_key
+        self._genai = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        with self._lock:
+            if self._genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._genai = genai
+        return self._genai
+
+    def warm(self, ping=False, timeout=5.0):
+        genai = self._client()
+        if ping:
+            genai.get_model(f"models/{self.model}", request_options={"timeout": timeout})
+
+    def _generate(self, image_bytes, prompt, timeout, stream=False):
+        genai = self._client()
+        model = genai.GenerativeModel(
+            self.model,
+            # Gemini's response_schema dialect differs from OpenAI's, so the schema travels as text
+            system_instruction=prompt.system_with_schema(),
+            generation_config={
+                "response_mime_type": "application/json",
+                "temperature": prompt.temperature,
+                "max_output_tokens": prompt.max_tokens,
+            },
+        )
+        return model.generate_content(
+            [prompt.user_text, {"mime_type": "image/jpeg", "data": image_bytes}],
+            stream=stream,
+            request_options={"timeout": timeout} if timeout else None,
+        )
+
+    @staticmethod
+    def _usage(response):
+        meta = getattr(response, "usage_metadata", None)
+        if meta is None:
+            return None
+        return {"prompt_tokens": meta.prompt_token_count, "completion_tokens": meta.candidates_token_count}
+
+    def complete(self, image_bytes, prompt, timeout=None):
+        response = self._generate(image_bytes, prompt, timeout)
+        return response.text, self._usage(response)
+
+    def open_stream(self, image_bytes, prompt, timeout=None):
+        response = self._generate(image_bytes, prompt, timeout, stream=True)
+
+        def deltas():
+            for chunk in response:
+                if chunk.parts:
+                    yield chunk.text, None
+            # Totals arrive with the last chunk
+            yield None, self._usage(response)
+        return deltas()
+
+
+class StubBackend(OpenAIBackend):
+    """Local canned-response backend (see benchmarks/stub_openai.py)."""
+    name = "stub"
+
+    def __init__(self, model: str = "stub"):
+        from benchmarks.stub_openai import AsyncStubOpenAI, StubOpenAI
+        client, async_client = StubOpenAI(), AsyncStubOpenAI()
+        super().__init__(lambda: client, model, get_async_client=lambda: async_client)
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies plus recent error rate.
+
+    Outcomes older than error_window seconds stop counting, so a backend that
+    was demoted for failing (and so gets no traffic) is tried again later.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 10, error_window: float = 60.0):
+        self.min_samples = min_samples
+        self.error_window = error_window
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._outcomes.append((time.monotonic(), ok))
+            if ok:
+                self._latencies.append(seconds)
+
+    def percentile(self, pct: float):
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def _recent(self) -> list:
+        cutoff = time.monotonic() - self.error_window
+        with self._lock:
+            return [ok for at, ok in self._outcomes if at >= cutoff]
+
+    def error_rate(self) -> float:
+        recent = self._recent()
+        if not recent:
+            return 0.0
+        return 1 - sum(recent) / len(recent)
+
+    def stats(self) -> dict:
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            "samples": len(self._latencies),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "errorRate": round(self.error_rate(), 3),
+        }
+
+
+class VisionRouter:
+    def __init__(self, backends: list, hedge: bool = True, default_hedge_delay: float = 8.0,
+                 min_hedge_delay: float = 1.0, max_workers: int = 32, max_error_rate: float = 0.5):
+        if not backends:
+            raise ValueError("VisionRouter needs at least one backend")
+        self.backends = backends
+        self.hedge = hedge and len(backends) > 1
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_error_rate = max_error_rate
+        # Called with (reply, estimated) for hedge losers, whose tokens are billed
+        # too; runs in the caller's context, after complete() may have returned
+        self.on_discarded = None
+        self.trackers = {b.name: LatencyTracker() for b in backends}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vision")
+
+    @property
+    def tag(self) -> str:
+        """Identifies the backend set, for cache keys and response metadata."""
+        return "+".join(b.tag for b in self.backends)
+
+    def warm(self, ping: bool = False) -> dict:
+        """Warm every backend. Returns {name: {"ms": ...}} or {name: {"error": ...}}."""
+        results = {}
+        for backend in self.backends:
+            start = time.perf_counter()
+            try:
+                backend.warm(ping=ping)
+                results[backend.name] = {"ms": round((time.perf_counter() - start) * 1000, 1)}
+            except Exception as e:
+                results[backend.name] = {"error": f"{type(e).__name__}: {e}"}
+        return results
+
+    def ranked(self) -> list:
+        """Backends ordered by expected latency; configured order until warmed up.
+
+        A backend failing at least max_error_rate of its recent calls goes
+        behind all the others, whether or not it has latency samples (one that
+        fails every call never gets any).
+        """
+        def score(item):
+            index, backend = item
+            tracker = self.trackers[backend.name]
+            errors = tracker.error_rate()
+            failing = errors >= self.max_error_rate
+            p50 = tracker.percentile(50)
+            if p50 is None:
+                return (failing, 0, errors, index)
+            # Each 10% of recent errors costs as much as doubling latency
+            return (failing, 1, p50 * (1 + 10 * errors), index)
+        return [b for _, b in sorted(enumerate(self.backends), key=score)]
+
+    def hedge_delay(self, backend: VisionBackend) -> float:
+        p95 = self.trackers[backend.name].percentile(95)
+        if p95 is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, p95)
+
+    def _call(self, backend: VisionBackend, image_bytes, prompt) -> BackendReply:
+        start = time.perf_counter()
+        try:
+            text, usage = backend.guard.call(backend.complete, image_bytes, prompt)
+        except Exception:
+            self.trackers[backend.name].record(time.perf_counter() - start, ok=False)
+            BACKEND_CALLS.inc(backend=backend.name, outcome="error")
+            raise
+        latency = time.perf_counter() - start
+        self.trackers[backend.name].record(latency, ok=True)
+        BACKEND_CALLS.inc(backend=backend.name, outcome="ok")
+        return BackendReply(text, usage, backend.name, latency)
+
+    def complete(self, image_bytes: bytes, prompt) -> BackendReply:
+        ranked = self.ranked()
+
+        if not self.hedge:
+            last_error = None
+            for backend in ranked:
+                try:
+                    return self._call(backend, image_bytes, prompt)
+                except Exception as e:
+                    last_error = e
+            raise BackendError(f"All vision backends failed: {last_error}") from last_error
+
+        pending = {}
+        errors = []
+        remaining = list(ranked)
+
+        def launch():
+            backend = remaining.pop(0)
+            future = self._executor.submit(self._call, backend, image_bytes, prompt)
+            pending[future] = backend
+
+        def discarded(future, ctx):
+            if not future.cancelled() and future.exception() is None:
+                ctx.run(self.on_discarded, future.result(), False)
+
+        launch()
+        deadline = self.hedge_delay(ranked[0])
+
+        while pending:
+            done, _ = wait(list(pending), timeout=deadline if remaining else None,
+                           return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Primary is slower than its p95: hedge with the next backend
+                launch()
+                deadline = self.hedge_delay(pending[next(reversed(pending))])
+                continue
+
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    reply = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    if remaining:
+                        launch()
+                    continue
+                if len(ranked) - len(remaining) > 1:
+                    HEDGES.inc(winner=backend.name)
+                if self.on_discarded is not None:
+                    # Losing threads can't be stopped, so their real usage is charged as they finish
+                    for loser in [*done, *pending]:
+                        if loser is not future:
+                            loser.add_done_callback(lambda f, ctx=contextvars.copy_context(): discarded(f, ctx))
+                return reply
+
+        raise BackendError(f"All vision backends failed: {errors[-1]}") from errors[-1]
+
+    async def _acall(self, backend: VisionBackend, image_bytes, prompt) -> BackendReply:
+        start = time.perf_counter()
+        try:
+            text, usage = await backend.guard.acall(backend.acomplete, image_bytes, prompt)
+        except Exception:
+            self.trackers[backend.name].record(time.perf_counter() - start, ok=False)
+            BACKEND_CALLS.inc(backend=backend.name, outcome="error")
+            raise
+        latency = time.perf_counter() - start
+        self.trackers[backend.name].record(latency, ok=True)
+        BACKEND_CALLS.inc(backend=backend.name, outcome="ok")
+        return BackendReply(text, usage, backend.name, latency)
+
+    async def acomplete(self, image_bytes: bytes, prompt) -> BackendReply:
+        """Same policy as complete(), on the event loop; hedge losers are cancelled."""
+        ranked = self.ranked()
+
+        if not self.hedge:
+            last_error = None
+            for backend in ranked:
+                try:
+                    return await self._acall(backend, image_bytes, prompt)
+                except Exception as e:
+                    last_error = e
+            raise BackendError(f"All vision backends failed: {last_error}") from last_error
+
+        pending = {}
+        errors = []
+        remaining = list(ranked)
+
+        started = {}
+
+        def launch():
+            backend = remaining.pop(0)
+            task = asyncio.ensure_future(self._acall(backend, image_bytes, prompt))
+            pending[task] = backend
+            started[task] = time.perf_counter()
+
+        launch()
+        deadline = self.hedge_delay(ranked[0])
+        reply = None
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(list(pending), timeout=deadline if remaining else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    launch()
+                    deadline = self.hedge_delay(pending[next(reversed(pending))])
+                    continue
+
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        reply = task.result()
+                    except Exception as e:
+                        errors.append(e)
+                        if remaining:
+                            launch()
+                        continue
+                    if len(ranked) - len(remaining) > 1:
+                        HEDGES.inc(winner=backend.name)
+                    return reply
+        finally:
+            for task, backend in pending.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    loser = task.result()
+                    estimated = False
+                else:
+                    task.cancel()
+                    # The provider already has the request, so bill the loser for what
+                    # the winner used on the same prompt and image
+                    loser = BackendReply(None, reply.usage if reply is not None else None, backend.name,
+                                         time.perf_counter() - started[task])
+                    estimated = True
+                if self.on_discarded is not None and reply is not None and loser.usage:
+                    self.on_discarded(loser, estimated)
+
+        raise BackendError(f"All vision backends failed: {errors[-1]}") from errors[-1]
+
+    def stream(self, image_bytes: bytes, prompt, on_usage=None):
+        """Yield text deltas from the fastest backend that opens a stream.
+
+        Only opening is retried or failed over; once text is flowing a failure
+        is raised, since the caller may already have sent it on. on_usage is
+        called with (usage, backend_name, latency_seconds) when the stream ends.
+        """
+        last_error = None
+        for backend in self.ranked():
+            start = time.perf_counter()
+            try:
+                deltas = backend.guard.call(backend.open_stream, image_bytes, prompt)
+            except Exception as e:
+                self.trackers[backend.name].record(time.perf_counter() - start, ok=False)
+                BACKEND_CALLS.inc(backend=backend.name, outcome="error")
+                last_error = e
+                continue
+
+            usage = None
+            try:
+                for text, chunk_usage in deltas:
+                    if text:
+                        yield text
+                    if chunk_usage is not None:
+                        usage = chunk_usage
+            except Exception:
+                self.trackers[backend.name].record(time.perf_counter() - start, ok=False)
+                BACKEND_CALLS.inc(backend=backend.name, outcome="error")
+                raise
+            latency = time.perf_counter() - start
+            self.trackers[backend.name].record(latency, ok=True)
+            BACKEND_CALLS.inc(backend=backend.name, outcome="ok")
+            if on_usage is not None:
+                on_usage(usage, backend.name, latency)
+            return
+        raise BackendError(f"All vision backends failed: {last_error}") from last_error
+
+    def stats(self) -> dict:
+        return {
+            "hedging": self.hedge,
+            "backends": [
+                dict(name=b.name, model=b.model, hedgeDelay_ms=round(self.hedge_delay(b) * 1000),
+                     **self.trackers[b.name].stats(), **b.guard.stats())
+                for b in self.ranked()
+            ],
+        }
+
+
+def build_router(get_openai_client, openai_model: str, get_async_openai_client=None) -> VisionRouter:
+    """Create the router described by VISION_BACKENDS (e.g. "openai,gemini")."""
+    backends = []
+    for name in os.getenv("VISION_BACKENDS", "openai").split(","):
+        name = name.strip().lower()
+        if name == "openai":
+            backends.append(OpenAIBackend(get_openai_client, openai_model, get_async_openai_client))
+        elif name == "gemini":
+            backends.append(GeminiBackend(
+                os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+                api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"),
+            ))
+        elif name == "stub":
+            backends.append(StubBackend())
+        elif name:
+            raise ValueError(f"Unknown vision backend: {name}")
+
+    return VisionRouter(
+        backends,
+        hedge=os.getenv("VISION_HEDGE", "1") in ("1", "true"),
+        default_hedge_delay=float(os.getenv("HEDGE_DEFAULT_DELAY_MS", 8000)) / 1000,
+        min_hedge_delay=float(os.getenv("HEDGE_MIN_DELAY_MS", 1000)) / 1000,
+        max_error_rate=float(os.getenv("VISION_MAX_ERROR_RATE", 0.5)),
+    )
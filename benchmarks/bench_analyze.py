@@ -0,0 +1,318 @@
+"""Throughput/latency benchmark for /analyze against the stub vision backend.
+
+Generates a corpus of synthetic interior-like images in several sizes and
+formats, fires them at /analyze with a fixed concurrency and reports req/s,
+latency percentiles and a per-stage breakdown taken from each response's
+Server-Timing header (so it works across gunicorn workers too).
+
+Examples:
+    # Flask dev server vs. two gunicorn layouts, 200 requests at concurrency 16
+    python -m benchmarks.bench_analyze -n 200 -c 16 \\
+        --server flask --server gunicorn:4x1 --server gunicorn:2x8
+
+    # Sync gunicorn vs. the ASGI app (asgi.py) under uvicorn, 256 clients
+    python -m benchmarks.bench_analyze -n 1024 -c 256 \\
+        --server gunicorn:4x8 --server asgi:1 --server asgi:4
+
+    # An already running server (e.g. the real app)
+    python -m benchmarks.bench_analyze --url http://127.0.0.1:5000 -n 50 -c 4
+
+gunicorn layouts are written WORKERSxTHREADS and uvicorn ones asgi:WORKERS.
+Each summary includes the server's peak resident memory summed over all its
+processes, which is where thread-per-request serving pays, and the per-request
+peak buffer estimate the server reports in X-Peak-Memory. Stub latency and reply mix are
+controlled with the STUB_* variables documented in benchmarks/stub_openai.py.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = "640x480,1920x1080,4032x3024"
+DEFAULT_FORMATS = "jpeg,png,webp"
+REPORT_STAGES = ("upload_read", "preprocess_queue", "preprocess", "base64_encode", "model_call",
+                 "json_parse", "normalize", "transform", "total")
+
+
+# --- Corpus ---
+
+def synthetic_image(width: int, height: int, fmt: str, seed: int) -> bytes:
+    """Noisy warm-toned gradient, so encoders see realistic entropy."""
+    rng = random.Random(seed)
+    base = Image.effect_noise((max(8, width // 8), max(8, height // 8)), rng.uniform(20, 60))
+    tint = (rng.randint(150, 255), rng.randint(90, 180), rng.randint(40, 120))
+    img = Image.merge("RGB", [base.point(lambda v, c=c: v * c // 255) for c in tint])
+    img = img.resize((width, height), Image.Resampling.BILINEAR)
+
+    output = io.BytesIO()
+    save_format = {"jpeg": "JPEG", "jpg": "JPEG", "png": "PNG", "webp": "WEBP"}[fmt]
+    options = {} if save_format == "PNG" else {"quality": 90}
+    img.save(output, format=save_format, **options)
+    return output.getvalue()
+
+
+def build_corpus(sizes: str, formats: str, per_variant: int, seed: int) -> list:
+    corpus = []
+    for size in sizes.split(","):
+        width, height = (int(v) for v in size.lower().split("x"))
+        for fmt in formats.split(","):
+            for i in range(per_variant):
+                data = synthetic_image(width, height, fmt, seed + len(corpus))
+                corpus.append((f"{size}-{i}.{fmt}", data))
+    return corpus
+
+
+# --- HTTP ---
+
+def multipart(filename: str, data: bytes) -> tuple:
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    body = head + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def parse_server_timing(header: str) -> dict:
+    spans = {}
+    for part in (header or "").split(","):
+        name, _, dur = part.strip().partition(";dur=")
+        if name and dur:
+            spans[name] = float(dur)
+    return spans
+
+
+def post_analyze(url: str, filename: str, data: bytes, timeout: float) -> dict:
+    body, content_type = multipart(filename, data)
+    req = urllib.request.Request(f"{url}/analyze", data=body, method="POST",
+                                 headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status, headers = resp.status, resp.headers
+    except urllib.error.HTTPError as e:
+        e.read()
+        status, headers = e.code, e.headers
+    except Exception as e:
+        return {"status": type(e).__name__, "latency": time.perf_counter() - start, "spans": {}, "peak": None}
+    peak = headers.get("X-Peak-Memory")
+    return {
+        "status": status,
+        "latency": time.perf_counter() - start,
+        "spans": parse_server_timing(headers.get("Server-Timing")),
+        "peak": int(peak) if peak else None,
+    }
+
+
+# --- Server lifecycle ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(spec: str) -> tuple:
+    """Launch the stub app for 'flask', 'gunicorn:WxT' or 'asgi:W'. Returns (process, url)."""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=REPO_ROOT, LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    # Keep history and usage out of the repo root
+    env.setdefault("HISTORY_DB", "")
+    env.setdefault("USAGE_DB", "")
+
+    if spec == "flask":
+        cmd = [sys.executable, "-m", "benchmarks.stub_app"]
+    elif spec.startswith("gunicorn"):
+        layout = spec.partition(":")[2] or "4x1"
+        workers, threads = (int(v) for v in layout.lower().split("x"))
+        cmd = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}",
+               "-w", str(workers), "--threads", str(threads), "--timeout", "120",
+               "--log-level", "warning", "benchmarks.stub_app:app"]
+    elif spec.startswith("asgi"):
+        workers = spec.partition(":")[2] or "1"
+        cmd = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", workers, "--log-level", "warning", "--no-access-log",
+               "benchmarks.stub_asgi:app"]
+    else:
+        raise ValueError(f"Unknown server spec: {spec}")
+
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env)
+    url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=1):
+                return proc, url
+        except Exception:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{spec} exited with code {proc.returncode}")
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"{spec} did not become healthy within 30s")
+
+
+def process_tree_peak_rss_mb(pid: int):
+    """Summed peak resident memory of pid and its descendants in MB (Linux /proc only)."""
+    try:
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        parents[int(entry)] = int(f.read().rpartition(")")[2].split()[1])
+                except OSError:
+                    continue
+    except OSError:
+        return None
+
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        for child, ppid in parents.items():
+            if ppid == parent and child not in tree:
+                tree.add(child)
+                frontier.append(child)
+
+    total_kb = 0
+    for member in tree:
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+# --- Reporting ---
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(label: str, outcomes: list, wall: float) -> dict:
+    latencies = [o["latency"] * 1000 for o in outcomes]
+    statuses = {}
+    for o in outcomes:
+        statuses[str(o["status"])] = statuses.get(str(o["status"]), 0) + 1
+
+    stages = {}
+    for name in REPORT_STAGES:
+        values = [o["spans"][name] for o in outcomes if name in o["spans"]]
+        if values:
+            stages[name] = {"mean_ms": round(statistics.mean(values), 2),
+                            "p95_ms": round(percentile(values, 95), 2)}
+
+    peaks = [o["peak"] / 1024 / 1024 for o in outcomes if o.get("peak")]
+    memory = None
+    if peaks:
+        memory = {"mean_mb": round(statistics.mean(peaks), 1), "max_mb": round(max(peaks), 1)}
+
+    return {
+        "target": label,
+        "requests": len(outcomes),
+        "wall_s": round(wall, 2),
+        "req_per_s": round(len(outcomes) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "statuses": statuses,
+        "stages": stages,
+        "request_peak_memory": memory,
+    }
+
+
+def print_summary(summary: dict) -> None:
+    print(f"\n== {summary['target']} ==")
+    print(f"  {summary['requests']} requests in {summary['wall_s']}s -> {summary['req_per_s']} req/s")
+    print(f"  latency p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  p99 {summary['p99_ms']}ms")
+    print(f"  statuses {summary['statuses']}")
+    if summary["request_peak_memory"]:
+        memory = summary["request_peak_memory"]
+        print(f"  per-request peak buffers mean {memory['mean_mb']}MB  max {memory['max_mb']}MB")
+    if summary.get("server_peak_rss_mb") is not None:
+        print(f"  server peak RSS {summary['server_peak_rss_mb']}MB")
+    for name, s in summary["stages"].items():
+        print(f"  {name:<16} mean {s['mean_ms']:>9.2f}ms  p95 {s['p95_ms']:>9.2f}ms")
+
+
+def run(url: str, label: str, corpus: list, requests: int, concurrency: int, timeout: float) -> dict:
+    jobs = [corpus[i % len(corpus)] for i in range(requests)]
+
+    # Warm up each worker/connection path before timing
+    for filename, data in corpus[:min(len(corpus), concurrency)]:
+        post_analyze(url, filename, data, timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda job: post_analyze(url, job[0], job[1], timeout), jobs))
+    return summarize(label, outcomes, time.perf_counter() - start)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark an already running server instead of launching one")
+    parser.add_argument("--server", action="append",
+                        help="flask, gunicorn:WORKERSxTHREADS or asgi:WORKERS (repeatable; default flask)")
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--formats", default=DEFAULT_FORMATS)
+    parser.add_argument("--per-variant", type=int, default=2, help="distinct images per size/format")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", action="store_true", help="print summaries as JSON")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.sizes, args.formats, args.per_variant, args.seed)
+    print(f"Corpus: {len(corpus)} images, {sum(len(d) for _, d in corpus) / 1024 / 1024:.1f}MB total",
+          file=sys.stderr)
+
+    summaries = []
+    if args.url:
+        summaries.append(run(args.url, args.url, corpus, args.requests, args.concurrency, args.timeout))
+    else:
+        for spec in args.server or ["flask"]:
+            proc, url = start_server(spec)
+            try:
+                summary = run(url, spec, corpus, args.requests, args.concurrency, args.timeout)
+                summary["server_peak_rss_mb"] = process_tree_peak_rss_mb(proc.pid)
+                summaries.append(summary)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        for summary in summaries:
+            print_summary(summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
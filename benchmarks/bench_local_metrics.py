@@ -0,0 +1,81 @@
+"""Latency of the local pixel-metrics stage.
+
+Encodes synthetic room-like images (gradients, coloured blocks and noise) at
+the sizes preprocessing hands to the model, then times
+local_metrics.measure_image() on the JPEG bytes, the same call the server
+makes, and local_metrics.measure() on an already-decoded image.
+
+Example:
+    python -m benchmarks.bench_local_metrics -n 200 --size 1024x768
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+from benchmarks.bench_analyze import percentile
+from local_metrics import measure, measure_image
+
+
+def room_image(width: int, height: int, rng: random.Random) -> Image.Image:
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(5, 40)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randint(10, width // 3), rng.randint(10, height // 3)
+        draw.rectangle([x, y, x + w, y + h], fill=tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise((width, height), rng.uniform(5, 40)).convert('RGB')
+    return Image.blend(img, noise, 0.2)
+
+
+def time_calls(fn, items: list) -> list:
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--images", type=int, default=100)
+    parser.add_argument("--size", default="1024x768", help="WIDTHxHEIGHT of the compressed upload")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.size.split("x"))
+    rng = random.Random(args.seed)
+    images = [room_image(width, height, rng) for _ in range(args.images)]
+    encoded = []
+    for img in images:
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=85)
+        encoded.append(output.getvalue())
+
+    # Warm up NumPy and Pillow's codecs before timing
+    measure_image(encoded[0])
+
+    print(json.dumps({
+        "images": args.images,
+        "size": args.size,
+        "fromJpeg": summarize(time_calls(measure_image, encoded)),
+        "decoded": summarize(time_calls(measure, images)),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Size and encode cost of an /analyze response body.
+
+Runs the stub's canned reply through the server's normalize/transform path,
+then serializes the result as:
+
+* pretty     - indented JSON with sorted keys
+* inline     - compact JSON still carrying icon/color/idealImage
+               (INLINE_DECORATIONS=1, the previous response shape)
+* lean       - compact JSON without them (now the default; /meta serves them)
+
+each as identity, gzip and (when the ``brotli`` package is installed) br,
+with the median time to compress. --local-metrics adds the localMetrics
+block for a synthetic room image, as LOCAL_METRICS=1 responses carry.
+
+Example:
+    python -m benchmarks.bench_payload -n 200 --local-metrics
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("HISTORY_DB", "")
+os.environ.setdefault("USAGE_DB", "")
+
+import server
+from benchmarks.stub_openai import CANNED_ANALYSIS
+from http_encoding import available_encodings, compress
+
+
+def build_result(inline: bool, measured: dict = None) -> dict:
+    saved = server.INLINE_DECORATIONS
+    server.INLINE_DECORATIONS = inline
+    try:
+        analysis, validation = server.normalize_analysis(copy.deepcopy(CANNED_ANALYSIS), {}, measured)
+        return server.transform_for_frontend(analysis, validation, measured)
+    finally:
+        server.INLINE_DECORATIONS = saved
+
+
+def synthetic_measurement() -> dict:
+    from benchmarks.bench_local_metrics import room_image
+    from local_metrics import measure_image
+
+    output = io.BytesIO()
+    room_image(1024, 768, random.Random(7)).save(output, format='JPEG', quality=85)
+    return measure_image(output.getvalue())
+
+
+def encodings_of(body: bytes, runs: int) -> dict:
+    sizes = {"identity": {"bytes": len(body)}}
+    for encoding in available_encodings():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            encoded = compress(body, encoding)
+            timings.append((time.perf_counter() - start) * 1000)
+        sizes[encoding] = {"bytes": len(encoded), "ratio": round(len(body) / len(encoded), 2),
+                           "median_ms": round(statistics.median(timings), 3)}
+    return sizes
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=100, help="compressions timed per encoding")
+    parser.add_argument("--local-metrics", action="store_true", help="include a localMetrics block")
+    args = parser.parse_args(argv)
+
+    measured = synthetic_measurement() if args.local_metrics else None
+    inline = build_result(True, measured)
+    lean = build_result(False, measured)
+
+    bodies = {
+        "pretty": json.dumps(inline, indent=2, sort_keys=True).encode(),
+        "inline": json.dumps(inline, separators=(",", ":")).encode(),
+        "lean": server.app.json.dumps(lean).encode(),
+    }
+    report = {name: encodings_of(body, args.runs) for name, body in bodies.items()}
+    report["meta"] = {"bytes": len(server.app.json.dumps(server.frontend_meta()).encode())}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
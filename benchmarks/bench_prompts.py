@@ -0,0 +1,133 @@
+"""Compare prompt versions and image detail levels on tokens, latency and fallbacks.
+
+Each variant (a registered prompt version at one detail level) analyzes the
+same synthetic corpus through server.vision_router in-process. The report
+shows the static text-token budget per call, billed image tokens, prompt and
+completion tokens as reported by the backend, model latency, how often the
+JSON needed repair or could not be parsed at all, and how often
+normalize_analysis had to fall back to defaults. Re-asks are not issued here,
+so the fallback rate is what a targeted re-ask would have to make up.
+
+Examples:
+    # Offline against the stub backend (token accounting only; latency is simulated)
+    python -m benchmarks.bench_prompts -n 20
+
+    # Against the real API
+    VISION_BACKENDS=openai OPENAI_API_KEY=sk-... python -m benchmarks.bench_prompts \\
+        -n 10 --variants neuro-v1@high,neuro-v2-schema@high,neuro-v2-schema@low
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("VISION_BACKENDS", "stub")
+
+import server
+from benchmarks.bench_analyze import build_corpus, percentile
+from preprocess import preprocess_image
+from prompts import PROMPTS, get_prompt, image_tokens
+from validation import repair_json
+
+
+def default_variants() -> str:
+    return ",".join(f"{version}@{detail}" for version in PROMPTS for detail in ("high", "low"))
+
+
+def analyze_once(prompt, image_bytes: bytes, size: list) -> dict:
+    start = time.perf_counter()
+    try:
+        reply = server.vision_router.complete(image_bytes, prompt)
+    except Exception as e:
+        return {"ok": False, "error": type(e).__name__, "latency": time.perf_counter() - start}
+    latency = time.perf_counter() - start
+
+    outcome = {"ok": True, "latency": latency, "usage": reply.usage,
+               "imageTokens": image_tokens(*size, prompt.detail)}
+    try:
+        analysis, repaired = repair_json(reply.text)
+    except json.JSONDecodeError:
+        outcome.update(parsed=False, fallbacks=None)
+        return outcome
+    outcome.update(parsed=True, repaired=repaired, fallbacks=server.fallback_fields(analysis))
+    return outcome
+
+
+def run_variant(tag: str, corpus: list, requests: int, concurrency: int) -> dict:
+    version, _, detail = tag.partition("@")
+    prompt = get_prompt(version, detail or "high")
+
+    # Preprocess once per variant; detail changes the target resolution
+    images = []
+    for _, data in corpus:
+        output, info = preprocess_image(data, 4, prompt.detail)
+        images.append((output, info["outputSize"]))
+
+    jobs = [images[i % len(images)] for i in range(requests)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(lambda job: analyze_once(prompt, *job), jobs))
+
+    ok = [o for o in outcomes if o["ok"]]
+    parsed = [o for o in ok if o["parsed"]]
+    usage = [o["usage"] for o in ok if o["usage"]]
+    latencies = [o["latency"] * 1000 for o in ok]
+
+    def mean(values):
+        return round(statistics.mean(values), 1) if values else None
+
+    return {
+        "variant": prompt.tag,
+        "requests": len(outcomes),
+        "errors": len(outcomes) - len(ok),
+        "textTokens": prompt.token_counts()["total"],
+        "imageTokens": mean([o["imageTokens"] for o in ok]),
+        "maxTokens": prompt.max_tokens,
+        "promptTokens": mean([u["prompt_tokens"] for u in usage]),
+        "completionTokens": mean([u["completion_tokens"] for u in usage]),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "parseFailureRate": round(1 - len(parsed) / len(ok), 3) if ok else None,
+        "repairRate": round(sum(1 for o in parsed if o["repaired"]) / len(parsed), 3) if parsed else None,
+        "fallbackRate": round(sum(1 for o in parsed if o["fallbacks"]) / len(parsed), 3) if parsed else None,
+        "fallbackFields": mean([len(o["fallbacks"]) for o in parsed]),
+    }
+
+
+def print_table(rows: list) -> None:
+    columns = ["variant", "textTokens", "imageTokens", "promptTokens", "completionTokens",
+               "p50_ms", "p95_ms", "parseFailureRate", "repairRate", "fallbackRate", "errors"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", default=default_variants(),
+                        help="comma-separated VERSION@DETAIL (default: every version at high and low)")
+    parser.add_argument("-n", "--requests", type=int, default=20, help="analyses per variant")
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("--sizes", default="1920x1080,4032x3024")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.sizes, "jpeg", 1, args.seed)
+    print(f"Backend: {server.vision_router.tag}, corpus: {len(corpus)} images", file=sys.stderr)
+
+    rows = [run_variant(tag, corpus, args.requests, args.concurrency) for tag in args.variants.split(",")]
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
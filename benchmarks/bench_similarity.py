@@ -0,0 +1,90 @@
+"""Lookup latency of the near-duplicate index at scale.
+
+Fills a similarity.HashIndex with random 64-bit hashes, plants near
+duplicates of a sample of them, then times nearest() for queries that should
+hit (a stored hash with a few bits flipped) and ones that should miss
+(fresh random hashes). Recall is checked against the planted answers, and
+the index's candidate count shows how much verification each probe costs.
+
+Example:
+    python -m benchmarks.bench_similarity -n 1000000 --distance 6
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from benchmarks.bench_analyze import percentile
+from similarity import HASH_BITS, HashIndex
+
+
+def flip_bits(value: int, count: int, rng: random.Random) -> int:
+    for position in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << position
+    return value
+
+
+def time_queries(index: HashIndex, queries: list) -> tuple:
+    latencies = []
+    results = []
+    for phash_value, dhash_value in queries:
+        start = time.perf_counter()
+        results.append(index.nearest(phash_value, dhash_value))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, results
+
+
+def summarize(latencies: list) -> dict:
+    return {
+        "p50_ms": round(percentile(latencies, 50), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+        "max_ms": round(max(latencies), 4),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--entries", type=int, default=1_000_000)
+    parser.add_argument("-q", "--queries", type=int, default=2000)
+    parser.add_argument("--distance", type=int, default=6, help="pHash match radius")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    index = HashIndex(max_distance=args.distance, max_entries=args.entries)
+
+    start = time.perf_counter()
+    stored = []
+    for i in range(args.entries):
+        phash_value, dhash_value = rng.getrandbits(HASH_BITS), rng.getrandbits(HASH_BITS)
+        index.add(phash_value, dhash_value, i)
+        if i % max(1, args.entries // args.queries) == 0:
+            stored.append((phash_value, dhash_value, i))
+    build_s = time.perf_counter() - start
+    print(f"built {args.entries} entries in {build_s:.1f}s", file=sys.stderr)
+
+    near = [(flip_bits(p, rng.randint(0, args.distance), rng), flip_bits(d, rng.randint(0, 4), rng))
+            for p, d, _ in stored[:args.queries]]
+    far = [(rng.getrandbits(HASH_BITS), rng.getrandbits(HASH_BITS)) for _ in range(args.queries)]
+
+    hit_latencies, hit_results = time_queries(index, near)
+    miss_latencies, miss_results = time_queries(index, far)
+
+    expected = [value for _, _, value in stored[:args.queries]]
+    found = sum(1 for result, value in zip(hit_results, expected) if result and result[0] == value)
+
+    print(json.dumps({
+        "entries": args.entries,
+        "maxDistance": args.distance,
+        "build_s": round(build_s, 1),
+        "near": {**summarize(hit_latencies), "recall": round(found / len(expected), 4)},
+        "random": {**summarize(miss_latencies),
+                   "falseMatches": sum(1 for r in miss_results if r is not None)},
+        "index": index.stats(),
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
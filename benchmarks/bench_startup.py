@@ -0,0 +1,109 @@
+"""Cold-start profile of the Flask app.
+
+Each run starts a fresh interpreter and times, from interpreter start:
+
+* import      - ``import server``
+* health      - import plus the first /health response
+* warm        - until the worker has everything an analysis needs
+                (server.start_warm_up() finished; checkouts without it
+                import everything eagerly, so this equals import)
+
+and ``--importtime`` adds a ``python -X importtime`` breakdown of the
+modules server.py pulls in, largest first. Point ``--root`` at another
+checkout to compare before/after.
+
+Example:
+    python -m benchmarks.bench_startup -n 5 --importtime 15
+    git worktree add /tmp/before HEAD~1 && python -m benchmarks.bench_startup --root /tmp/before
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+PROBE = r"""
+import json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.app.test_client().get('/health')
+health = time.perf_counter()
+if hasattr(server, 'start_warm_up'):
+    server.start_warm_up()
+    while server.readiness()['state'] == 'warming':
+        time.sleep(0.005)
+warm = time.perf_counter()
+print(json.dumps({'import': imported - start, 'health': health - start, 'warm': warm - start}))
+"""
+
+
+def probe_env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "stub")
+    # Keep probes from creating history files in the checkout
+    env["HISTORY_DB"] = ""
+    env["USAGE_DB"] = ""
+    env["LOG_LEVEL"] = "WARNING"
+    return env
+
+
+def run_probe(root: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=root, env=probe_env(),
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_breakdown(root: str, top: int) -> list:
+    """(module, cumulative ms, self ms) for server.py's direct imports, largest first."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"], cwd=root,
+                         env=probe_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        row = (name.strip(), round(int(cumulative_us) / 1000, 1), round(int(self_us) / 1000, 1))
+        # Children are printed before their parent, indented one more level
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1:
+            rows.append(row)
+        elif depth == 0:
+            if row[0] == "server":
+                rows.append(row)
+                break
+            rows = []
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows[:top]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="checkout to profile (default: this one)")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N",
+                        help="also list the N slowest imports")
+    args = parser.parse_args(argv)
+
+    runs = [run_probe(args.root) for _ in range(args.runs)]
+    report = {
+        "root": args.root,
+        "runs": args.runs,
+        **{phase: {"median_ms": round(statistics.median(r[phase] for r in runs) * 1000, 1),
+                   "max_ms": round(max(r[phase] for r in runs) * 1000, 1)}
+           for phase in ("import", "health", "warm")},
+    }
+    if args.importtime:
+        report["imports"] = [{"module": m, "cumulative_ms": c, "self_ms": s}
+                             for m, c, s in import_breakdown(args.root, args.importtime)]
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
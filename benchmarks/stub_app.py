@@ -0,0 +1,31 @@
+"""server.app wired to the stub vision backend.
+
+Flask dev server:   python -m benchmarks.stub_app
+gunicorn:           gunicorn -w 4 --threads 4 benchmarks.stub_app:app
+
+The result cache is disabled by default so every request exercises the
+full pipeline; set ANALYSIS_CACHE_ENTRIES to turn it back on. Per-client
+admission limits are off too (ADMISSION_RATE_PER_MINUTE=0), since a load
+test is a single client.
+"""
+import logging
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("ANALYSIS_CACHE_ENTRIES", "0")
+# Load tests come from one address; per-client limits would turn them into 429s
+os.environ.setdefault("ADMISSION_RATE_PER_MINUTE", "0")
+os.environ.setdefault("ADMISSION_MAX_QUEUED_PER_CLIENT", "100000")
+
+import server
+from benchmarks.stub_openai import StubOpenAI
+
+
+server.openai_client = StubOpenAI()
+app = server.app
+
+
+if __name__ == '__main__':
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    port = int(os.environ.get('PORT', 5000))
+    app.run(debug=False, host='127.0.0.1', port=port, threaded=True)
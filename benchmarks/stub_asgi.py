@@ -0,0 +1,29 @@
+"""asgi.app wired to the stub vision backend.
+
+uvicorn:   python -m uvicorn benchmarks.stub_asgi:app --port 5000 [--workers N]
+
+Like benchmarks/stub_app.py, the result cache and per-client limits are off by default.
+"""
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+os.environ.setdefault("ANALYSIS_CACHE_ENTRIES", "0")
+# Load tests come from one address; per-client limits would turn them into 429s
+os.environ.setdefault("ADMISSION_RATE_PER_MINUTE", "0")
+os.environ.setdefault("ADMISSION_MAX_QUEUED_PER_CLIENT", "100000")
+
+import asgi
+import server
+from benchmarks.stub_openai import AsyncStubOpenAI, StubOpenAI
+
+
+server.openai_client = StubOpenAI()
+server.async_openai_client = AsyncStubOpenAI()
+app = asgi.app
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('PORT', 5000))
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level="warning")
@@ -0,0 +1,184 @@
+"""Local stand-in for the OpenAI client used by the benchmarks.
+
+Mimics the slice of the SDK that server.py touches
+(``client.chat.completions.create``, with and without ``stream=True``) and
+returns canned analyses after a configurable delay, so throughput can be
+measured without paying for real API calls. ``AsyncStubOpenAI`` is the
+``openai.AsyncOpenAI`` equivalent used by the ASGI app.
+
+Environment knobs (all optional):
+    STUB_LATENCY_MS     mean simulated model latency (default 1500)
+    STUB_JITTER_MS      +/- uniform jitter around the mean (default 500)
+    STUB_FENCED_RATE    fraction of replies wrapped in ```json fences (default 0.1)
+    STUB_MALFORMED_RATE fraction of replies truncated mid-JSON (default 0.0)
+    STUB_SEED           random seed for reproducible runs
+"""
+import asyncio
+import copy
+import json
+import os
+import random
+import threading
+import time
+import types
+
+
+CANNED_ANALYSIS = {
+    "scores": {"overall": 78, "saliency": 72, "biophilia": 34, "warmth": 81, "social": 66, "clutter": 42},
+    "neuroMetrics": [
+        {
+            "id": i,
+            "title": title,
+            "score": round(6.0 + (i % 4) * 0.7, 1),
+            "drivers": [
+                "Brass pendant lights at 2700K over walnut tables",
+                "Terracotta banquette upholstery in boucle",
+                "Fluted oak wall panels behind the bar",
+            ],
+            "neuralImpact": "Activation of the ventral striatum via warm saturated hues. Reward anticipation rises.",
+            "businessEffect": "Increases appetizer attach rate by 8%. Estimated +$4.20 per table.",
+            "tag": "High upsell potential" if i in (1, 8) else None,
+        }
+        for i, title in enumerate([
+            "Dopamine & Appetite Stimulation",
+            "Stress Reduction & Emotional Safety",
+            "Perceived Food Quality Enhancement",
+            "Dwell Time & Seating Comfort",
+            "Cognitive Load & Decision Ease",
+            "Brand Memory Encoding",
+            "Social Bonding & Emotional Warmth",
+            "Premium Perception & Willingness to Pay",
+            "Instagrammability & Share Trigger",
+        ], start=1)
+    ],
+    "metrics": [
+        {"subject": "Biophilia", "A": 34, "B": 85, "fullMark": 100},
+        {"subject": "Warmth", "A": 81, "B": 90, "fullMark": 100},
+        {"subject": "Social Layout", "A": 66, "B": 80, "fullMark": 100},
+        {"subject": "Lighting", "A": 77, "B": 95, "fullMark": 100},
+        {"subject": "Cleanliness", "A": 84, "B": 90, "fullMark": 100},
+        {"subject": "Acoustics", "A": 52, "B": 75, "fullMark": 100},
+    ],
+    "insights": [
+        {"type": "critical", "title": "Hard ceiling reflects conversation noise",
+         "desc": "Exposed concrete ceiling with no baffles. Recommend: felt acoustic panels above the bar.",
+         "impact": "-6 min Dwell Time"},
+        {"type": "warning", "title": "Service station visible from entrance",
+         "desc": "Stacked trays in the sightline. Quick fix: a slatted oak screen.",
+         "impact": "-3% satisfaction"},
+        {"type": "success", "title": "Layered warm lighting",
+         "desc": "Pendants plus cove lighting keep faces lit. This is top-quartile for casual dining.",
+         "impact": "+$2.80 revenue driver"},
+    ],
+    "financials": {"currentDwell": 52, "predictedDwell": 63, "currentSpend": 38,
+                   "predictedSpend": 44, "monthlyRevenueUplift": 21600},
+    "objects": [
+        {"label": "Brass pendant lights", "x": 30, "y": 12, "width": 25, "height": 15, "type": "positive"},
+        {"label": "Cluttered service station", "x": 72, "y": 55, "width": 18, "height": 22, "type": "negative"},
+    ],
+}
+
+
+def _namespace(**kwargs):
+    return types.SimpleNamespace(**kwargs)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, stream=False, **kwargs):
+        return self._owner._respond(stream=stream, **kwargs)
+
+
+class StubOpenAI:
+    """Drop-in replacement for ``openai.OpenAI`` with simulated latency."""
+
+    def __init__(self, latency_ms=None, jitter_ms=None, fenced_rate=None,
+                 malformed_rate=None, seed=None):
+        env = os.environ
+        self.latency_ms = float(latency_ms if latency_ms is not None else env.get("STUB_LATENCY_MS", 1500))
+        self.jitter_ms = float(jitter_ms if jitter_ms is not None else env.get("STUB_JITTER_MS", 500))
+        self.fenced_rate = float(fenced_rate if fenced_rate is not None else env.get("STUB_FENCED_RATE", 0.1))
+        self.malformed_rate = float(
+            malformed_rate if malformed_rate is not None else env.get("STUB_MALFORMED_RATE", 0.0))
+        seed = seed if seed is not None else env.get("STUB_SEED")
+
+        self._random = random.Random(int(seed) if seed is not None else None)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = _namespace(completions=_Completions(self))
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            roll = self._random.random()
+        return max(0.0, delay) / 1000, roll
+
+    def _body(self, roll, kwargs=None) -> str:
+        analysis = copy.deepcopy(CANNED_ANALYSIS)
+        # Answer only the sections a structured-output schema asks for (targeted re-asks)
+        schema = ((kwargs or {}).get("response_format") or {}).get("json_schema")
+        if schema:
+            analysis = {k: v for k, v in analysis.items() if k in schema["schema"]["properties"]}
+        text = json.dumps(analysis, indent=2)
+        if roll < self.malformed_rate:
+            return text[: len(text) // 2]
+        if roll < self.malformed_rate + self.fenced_rate:
+            return f"```json\n{text}\n```"
+        return text
+
+    def _usage(self, kwargs, text):
+        # Rough token estimates: ~4 chars per text token, OpenAI's image rates by detail
+        prompt = 0
+        for message in kwargs.get("messages", []):
+            content = message.get("content", "")
+            parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+            for part in parts:
+                if part.get("type") == "image_url":
+                    prompt += 85 if part["image_url"].get("detail") == "low" else 765
+                else:
+                    prompt += len(part.get("text", "")) // 4
+        schema = (kwargs.get("response_format") or {}).get("json_schema")
+        if schema:
+            prompt += len(json.dumps(schema)) // 4
+        completion = len(text) // 4
+        return _namespace(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion)
+
+    def _respond(self, stream=False, **kwargs):
+        delay, roll = self._draw()
+        text = self._body(roll, kwargs)
+        usage = self._usage(kwargs, text)
+
+        if not stream:
+            time.sleep(delay)
+            message = _namespace(content=text)
+            return _namespace(choices=[_namespace(message=message)], usage=usage)
+
+        def chunks():
+            # Spend a quarter of the delay before the first token
+            time.sleep(delay / 4)
+            pieces = [text[i:i + 24] for i in range(0, len(text), 24)]
+            per_piece = (delay * 3 / 4) / max(1, len(pieces))
+            for piece in pieces:
+                time.sleep(per_piece)
+                yield _namespace(choices=[_namespace(delta=_namespace(content=piece))], usage=None)
+            yield _namespace(choices=[], usage=usage)
+
+        return chunks()
+
+
+class AsyncStubOpenAI(StubOpenAI):
+    """Drop-in replacement for ``openai.AsyncOpenAI`` (non-streaming calls only)."""
+
+    async def _respond(self, stream=False, **kwargs):
+        if stream:
+            raise NotImplementedError("AsyncStubOpenAI does not stream")
+        delay, roll = self._draw()
+        text = self._body(roll, kwargs)
+        usage = self._usage(kwargs, text)
+
+        await asyncio.sleep(delay)
+        message = _namespace(content=text)
+        return _namespace(choices=[_namespace(message=message)], usage=usage)
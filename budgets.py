@@ -0,0 +1,382 @@
+"""Per-tenant token and cost accounting, and spend budgets.
+
+Every model call's reported usage is priced (MODEL_PRICES, USD per million
+prompt/completion tokens) and charged to the tenant that made the request:
+admission's client id, i.e. a hashed API key or the caller's IP. Charges are
+summed in memory and flushed every USAGE_FLUSH_SECONDS into one SQLite row
+per tenant, UTC day, model and mode, so the ledger grows with tenants and
+days rather than requests, and a budget check sums at most a month of rows
+on an index. Like history, several gunicorn workers share the file (WAL).
+
+Budgets (USD) come from BUDGET_DAILY_USD and BUDGET_MONTHLY_USD for every
+tenant, with per-tenant overrides in BUDGETS_JSON, e.g.
+``{"key:3f2a9c01d4e5": {"daily": 5, "monthly": 60}}``. As a tenant's spend
+nears the tighter of its limits, requests degrade before they fail:
+
+    full      below BUDGET_ECONOMY_AT (default 0.8) of the budget
+    economy   low image detail, max_tokens capped at BUDGET_ECONOMY_MAX_TOKENS,
+              no re-asks for missing sections
+    local     budget spent: a cached analysis if there is one, else scores
+              from local pixel metrics only, with no model call
+    rejected  budget spent and local scoring unavailable (LOCAL_METRICS=0 or
+              BUDGET_LOCAL_FALLBACK=0): 429 until the day or month rolls over
+"""
+import atexit
+import calendar
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from admission import Rejected
+from metrics import REGISTRY, log_event
+
+
+# List prices per million tokens (prompt, completion); MODEL_PRICES overrides or adds
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+}
+
+MODES = ("full", "economy", "local")
+
+MODEL_COST = REGISTRY.counter(
+    "neurospace_model_cost_usd_total", "Estimated model spend in USD", ("model",))
+BUDGET_MODES = REGISTRY.counter(
+    "neurospace_budget_mode_total", "Requests by budget mode", ("mode",))
+
+
+# (tenant, mode) of the analysis running in this thread or task, for charging usage
+_attribution = ContextVar("neurospace_budget_tenant", default=None)
+
+
+@contextmanager
+def attribute(tenant: str, mode: str = "full"):
+    """Charge model usage inside the block to tenant."""
+    token = _attribution.set((tenant, mode))
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+class BudgetExceeded(Rejected):
+    """Tenant is over budget and no cheaper mode can serve the request."""
+
+    def __init__(self, period: str, retry_after: float):
+        super().__init__("budget", retry_after)
+        self.args = (f"{period.capitalize()} spend budget exhausted; retry in {retry_after:.0f}s",)
+        self.period = period
+
+
+def load_prices() -> dict:
+    prices = dict(DEFAULT_PRICES)
+    for model, pair in json.loads(os.getenv("MODEL_PRICES") or "{}").items():
+        prices[model] = tuple(pair)
+    return prices
+
+
+def _day(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+def seconds_until(period: str, now: float = None) -> float:
+    """Seconds until the current UTC day or month ends."""
+    now = time.time() if now is None else now
+    t = time.gmtime(now)
+    if period == "daily":
+        end = calendar.timegm((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0)) + 86400
+    else:
+        year, month = (t.tm_year + 1, 1) if t.tm_mon == 12 else (t.tm_year, t.tm_mon + 1)
+        end = calendar.timegm((year, month, 1, 0, 0, 0))
+    return end - now
+
+
+class UsageLedger:
+    def __init__(self, db_path: str, prices: dict = None, flush_seconds: float = 2.0):
+        self.db_path = db_path
+        self.prices = prices if prices is not None else dict(DEFAULT_PRICES)
+        # Longest first, so "gpt-4o-mini-2024-07-18" prices as gpt-4o-mini, not gpt-4o
+        self._price_prefixes = sorted(self.prices, key=len, reverse=True)
+        self.flush_seconds = flush_seconds
+
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._pending = {}
+        self._conn = None
+        self._conn_pid = None
+        self._flusher_pid = None
+        self._unpriced = set()
+
+    @classmethod
+    def from_env(cls):
+        """Ledger at USAGE_DB (default usage.db); USAGE_DB="" disables accounting and budgets."""
+        path = os.getenv("USAGE_DB", "usage.db")
+        if not path:
+            return None
+        return cls(path, prices=load_prices(), flush_seconds=float(os.getenv("USAGE_FLUSH_SECONDS", 2.0)))
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """This process's connection, opened (and the schema created) on first use."""
+        if self._conn_pid == os.getpid():
+            return self._conn
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        self._conn_pid = os.getpid()
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            " tenant TEXT NOT NULL,"
+            " day TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " calls INTEGER NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " completion_tokens INTEGER NOT NULL,"
+            " cost_usd REAL NOT NULL,"
+            " latency_ms_sum REAL NOT NULL,"
+            " latency_ms_max REAL NOT NULL,"
+            " PRIMARY KEY (tenant, day, model, mode)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS idx_usage_day ON usage (day);"
+        )
+        self._conn.commit()
+        return self._conn
+
+    def price(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """Estimated USD cost of a call; 0 (logged once) for models without a price."""
+        for name in self._price_prefixes:
+            if model == name or model.startswith(name + "-"):
+                prompt_price, completion_price = self.prices[name]
+                return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+        if model not in self._unpriced:
+            self._unpriced.add(model)
+            log_event(logging.WARNING, "no price for model; its usage is counted at $0", model=model)
+        return 0.0
+
+    # --- Writes ---
+
+    def charge(self, tenant: str, model: str, mode: str, prompt_tokens: int, completion_tokens: int,
+               latency_ms: float = 0.0) -> float:
+        """Add one call's usage to tenant's totals; returns its estimated cost."""
+        cost = self.price(model, prompt_tokens, completion_tokens)
+        key = (tenant, _day(time.time()), model, mode)
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = [0, 0, 0, 0.0, 0.0, 0.0]
+            row[0] += 1
+            row[1] += prompt_tokens
+            row[2] += completion_tokens
+            row[3] += cost
+            row[4] += latency_ms
+            row[5] = max(row[5], latency_ms)
+        MODEL_COST.inc(cost, model=model)
+        self._start_flusher()
+        return cost
+
+    def _start_flusher(self) -> None:
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                log_event(logging.ERROR, "usage flush failed", error=str(e), type=type(e).__name__)
+
+    def flush(self) -> None:
+        """Write pending charges to SQLite."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (tenant, day, model, mode) DO UPDATE SET"
+                    " calls = calls + excluded.calls,"
+                    " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                    " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                    " cost_usd = cost_usd + excluded.cost_usd,"
+                    " latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum,"
+                    " latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)",
+                    [(*key, *row) for key, row in pending.items()],
+                )
+                self._db.commit()
+        except Exception:
+            # Put the charges back so the next flush retries them
+            with self._lock:
+                for key, row in pending.items():
+                    current = self._pending.setdefault(key, [0, 0, 0, 0.0, 0.0, 0.0])
+                    for i in range(5):
+                        current[i] += row[i]
+                    current[5] = max(current[5], row[5])
+            raise
+
+    # --- Reads ---
+
+    def spend(self, tenant: str, now: float = None) -> dict:
+        """{"daily": USD today, "monthly": USD this month} for tenant, including unflushed charges."""
+        now = time.time() if now is None else now
+        today = _day(now)
+        month_start = today[:8] + "01"
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(CASE WHEN day = ? THEN cost_usd END), 0),"
+                " COALESCE(SUM(cost_usd), 0) FROM usage WHERE tenant = ? AND day >= ?",
+                (today, tenant, month_start),
+            ).fetchone()
+        daily, monthly = row[0], row[1]
+        with self._lock:
+            for (pending_tenant, day, _, _), values in self._pending.items():
+                if pending_tenant == tenant and day >= month_start:
+                    monthly += values[3]
+                    if day == today:
+                        daily += values[3]
+        return {"daily": daily, "monthly": monthly}
+
+    def report(self, since_day: str, tenant: str = None) -> dict:
+        """Aggregates since a UTC day: per tenant, per model and mode, and per day."""
+        self.flush()
+        where, params = "WHERE day >= ?", [since_day]
+        if tenant:
+            where += " AND tenant = ?"
+            params.append(tenant)
+
+        def totals(row) -> dict:
+            calls = row["calls"]
+            return {
+                "calls": calls,
+                "promptTokens": row["prompt_tokens"],
+                "completionTokens": row["completion_tokens"],
+                "costUsd": round(row["cost_usd"], 4),
+                "costPerCallUsd": round(row["cost_usd"] / calls, 5) if calls else None,
+                "meanLatencyMs": round(row["latency_ms_sum"] / calls, 1) if calls else None,
+                "maxLatencyMs": round(row["latency_ms_max"], 1),
+            }
+
+        sums = ("SUM(calls) AS calls, SUM(prompt_tokens) AS prompt_tokens,"
+                " SUM(completion_tokens) AS completion_tokens, SUM(cost_usd) AS cost_usd,"
+                " SUM(latency_ms_sum) AS latency_ms_sum, MAX(latency_ms_max) AS latency_ms_max")
+        with self._db_lock:
+            tenants = self._db.execute(
+                f"SELECT tenant, {sums} FROM usage {where} GROUP BY tenant ORDER BY cost_usd DESC", params
+            ).fetchall()
+            models = self._db.execute(
+                f"SELECT model, mode, {sums} FROM usage {where} GROUP BY model, mode ORDER BY cost_usd DESC", params
+            ).fetchall()
+            days = self._db.execute(
+                f"SELECT day, {sums} FROM usage {where} GROUP BY day ORDER BY day", params
+            ).fetchall()
+        return {
+            "since": since_day,
+            "tenants": [{"tenant": r["tenant"], **totals(r)} for r in tenants],
+            "models": [{"model": r["model"], "mode": r["mode"], **totals(r)} for r in models],
+            "days": [{"day": r["day"], **totals(r)} for r in days],
+        }
+
+
+class Budgets:
+    def __init__(self, ledger: UsageLedger, daily: float = None, monthly: float = None, overrides: dict = None,
+                 economy_at: float = 0.8, economy_max_tokens: int = 1800, local_fallback: bool = True):
+        self.ledger = ledger
+        self.daily = daily
+        self.monthly = monthly
+        self.overrides = overrides or {}
+        self.economy_at = economy_at
+        self.economy_max_tokens = economy_max_tokens
+        self.local_fallback = local_fallback
+
+    @classmethod
+    def from_env(cls, ledger: UsageLedger, local_metrics: bool = True) -> "Budgets":
+        def usd(name):
+            value = os.getenv(name)
+            return float(value) if value else None
+
+        return cls(
+            ledger,
+            daily=usd("BUDGET_DAILY_USD"),
+            monthly=usd("BUDGET_MONTHLY_USD"),
+            overrides=json.loads(os.getenv("BUDGETS_JSON") or "{}"),
+            economy_at=float(os.getenv("BUDGET_ECONOMY_AT", 0.8)),
+            economy_max_tokens=int(os.getenv("BUDGET_ECONOMY_MAX_TOKENS", 1800)),
+            local_fallback=local_metrics and os.getenv("BUDGET_LOCAL_FALLBACK", "1") == "1",
+        )
+
+    def limits(self, tenant: str) -> dict:
+        override = self.overrides.get(tenant, {})
+        return {"daily": override.get("daily", self.daily), "monthly": override.get("monthly", self.monthly)}
+
+    def status(self, tenant: str) -> dict:
+        """Spend, limits and the mode the tenant's next request runs in."""
+        limits = self.limits(tenant)
+        spend = self.ledger.spend(tenant) if any(v is not None for v in limits.values()) else None
+        mode, period = "full", None
+        if spend is not None:
+            for name, limit in limits.items():
+                if limit is None:
+                    continue
+                used = spend[name] / limit if limit > 0 else float("inf")
+                if used >= 1.0:
+                    mode, period = "local", name
+                    break
+                if used >= self.economy_at:
+                    mode = "economy"
+        return {"tenant": tenant, "mode": mode, "exhausted": period, "limits": limits,
+                "spendUsd": {k: round(v, 4) for k, v in spend.items()} if spend else None}
+
+    def mode(self, tenant: str) -> str:
+        """Mode for tenant's next request; raises BudgetExceeded when nothing cheaper can serve it."""
+        status = self.status(tenant)
+        if status["mode"] == "local" and not self.local_fallback:
+            BUDGET_MODES.inc(mode="rejected")
+            raise BudgetExceeded(status["exhausted"], seconds_until(status["exhausted"]))
+        BUDGET_MODES.inc(mode=status["mode"])
+        return status["mode"]
+
+    def degrade(self, prompt, mode: str):
+        """The prompt to use in mode: economy lowers image detail and caps max_tokens."""
+        if mode != "economy":
+            return prompt
+        return prompt.with_detail("low").with_max_tokens(min(prompt.max_tokens, self.economy_max_tokens))
+
+    def charge(self, model: str, usage: dict, latency_ms: float = 0.0):
+        """Charge a call's usage to the attributed tenant (see attribute()); returns the cost."""
+        if not usage:
+            return None
+        # Calls outside attribute() still cost money; keep them visible
+        tenant, mode = _attribution.get() or ("unattributed", "full")
+        return self.ledger.charge(tenant, model, mode, usage["prompt_tokens"], usage["completion_tokens"],
+                                  latency_ms)
+
+    def report(self, days: int = 30, tenant: str = None) -> dict:
+        since = _day(time.time() - (days - 1) * 86400)
+        report = self.ledger.report(since, tenant)
+        for entry in report["tenants"]:
+            entry["budget"] = self.status(entry["tenant"])
+        report["defaults"] = self.stats()
+        return report
+
+    def stats(self) -> dict:
+        return {"daily": self.daily, "monthly": self.monthly, "overrides": len(self.overrides),
+                "economyAt": self.economy_at, "economyMaxTokens": self.economy_max_tokens,
+                "localFallback": self.local_fallback}
@@ -0,0 +1,175 @@
+"""Content-addressed cache for finished analyses.
+
+Results are keyed on a SHA-256 of the compressed image bytes plus the prompt
+version and model name, so a re-upload of the same photo skips the vision
+call entirely. Lookups go through an in-memory LRU first and fall back to an
+optional SQLite file with TTL and size-based eviction.
+"""
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_key(image_bytes: bytes, prompt_version: str, model: str) -> str:
+    """Build the cache key for an image under a given prompt/model pair."""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"{model}:{prompt_version}:{digest}"
+
+
+class AnalysisCache:
+    """Two-tier (memory LRU + optional SQLite) store for analysis results."""
+
+    def __init__(self, max_entries: int = 256, db_path: str = None,
+                 ttl_seconds: int = 7 * 24 * 3600, max_disk_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_bytes = max_disk_bytes
+        self.db_path = db_path
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "evictions": 0}
+
+        self._conn = None
+        self._conn_pid = None
+
+    @classmethod
+    def from_env(cls) -> "AnalysisCache":
+        return cls(
+            max_entries=int(os.getenv("ANALYSIS_CACHE_ENTRIES", 256)),
+            db_path=os.getenv("ANALYSIS_CACHE_DB") or None,
+            ttl_seconds=int(os.getenv("ANALYSIS_CACHE_TTL", 7 * 24 * 3600)),
+            max_disk_bytes=int(os.getenv("ANALYSIS_CACHE_DISK_MAX_MB", 256)) * 1024 * 1024,
+        )
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """This process's connection, opened on first use.
+
+        SQLite connections must not cross fork(), and gunicorn --preload
+        builds the cache in the master, so each worker opens its own.
+        """
+        if self._conn_pid == os.getpid():
+            return self._conn
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn_pid = os.getpid()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analysis_cache_access"
+            " ON analysis_cache (last_access)"
+        )
+        self._conn.commit()
+        return self._conn
+
+    def get(self, key: str):
+        """Return a copy of the cached result, or None on a miss."""
+        return self._lookup(key, count=True)
+
+    def peek(self, key: str):
+        """get() that leaves the hit/miss stats alone, for lookups made on
+        another image's behalf (near-duplicate matching)."""
+        return self._lookup(key, count=False)
+
+    def _lookup(self, key: str, count: bool):
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    if count:
+                        self._stats["hits"] += 1
+                        self._stats["memory_hits"] += 1
+                    return copy.deepcopy(value)
+                del self._memory[key]
+
+            if self.db_path:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._db.execute(
+                        "UPDATE analysis_cache SET last_access = ? WHERE key = ?", (now, key)
+                    )
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value)
+                    if count:
+                        self._stats["hits"] += 1
+                        self._stats["disk_hits"] += 1
+                    return copy.deepcopy(value)
+
+            if count:
+                self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: dict) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        value = copy.deepcopy(value)
+
+        with self._lock:
+            self._remember(key, expires_at, value)
+
+            if self.db_path:
+                payload = json.dumps(value, separators=(",", ":"))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, size, expires_at, last_access)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, len(payload), expires_at, now),
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self.db_path:
+                count, size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache"
+                ).fetchone()
+                stats["disk_entries"] = count
+                stats["disk_bytes"] = size
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _remember(self, key: str, expires_at: float, value: dict) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _evict_disk(self, now: float) -> None:
+        self._db.execute("DELETE FROM analysis_cache WHERE expires_at <= ?", (now,))
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        # Drop least recently used rows until we are back under budget
+        for key, size in self._db.execute(
+            "SELECT key, size FROM analysis_cache ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self._db.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+            total -= size
+            self._stats["evictions"] += 1
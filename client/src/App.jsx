@@ -1,4 +1,4 @@
-import React, { useState, useRef } from 'react';
+import React, { useState, useRef, useEffect } from 'react';
 import { 
   LayoutDashboard, Upload, Eye, ScanLine, Sparkles, FileText, 
   ArrowUpRight, DollarSign, Clock, AlertTriangle, 
@@ -188,17 +188,19 @@ const ObjectBoxes = ({ active, objects }) => {
 
 
 // --- NEURO SCORECARD (DYNAMIC DATA) ---
-const NeuroScorecard = ({ data }) => {
+const NeuroScorecard = ({ data, meta }) => {
   const metrics = data?.neuroMetrics || FALLBACK_REPORT_DATA;
 
 
+  // Results carry no icon/color; they come from /meta (older servers inlined them)
   const getIcon = (item) => {
-    if (item.icon && ICON_MAP[item.icon]) return ICON_MAP[item.icon];
+    const name = item.icon || meta?.icons?.[item.id];
+    if (name && ICON_MAP[name]) return ICON_MAP[name];
     return DEFAULT_ICON_MAP[item.id] || Sparkles;
   };
 
 
-  const getColor = (item) => item.color || COLOR_MAP[item.id] || "bg-slate-500";
+  const getColor = (item) => item.color || meta?.colors?.[item.id] || COLOR_MAP[item.id] || meta?.defaultColor || "bg-slate-500";
 
 
   return (
@@ -300,6 +302,16 @@ export default function App() {
   const fileInputRef = useRef(null);
 
 
+  // Static presentation data shared by every analysis; the browser caches it
+  const [meta, setMeta] = useState(null);
+  useEffect(() => {
+    fetch(`${API_BASE}/meta`)
+      .then(response => (response.ok ? response.json() : null))
+      .then(setMeta)
+      .catch(() => setMeta(null));
+  }, []);
+
+
   const handleFileUpload = (event) => {
     const file = event.target.files[0];
     if (file) {
@@ -416,7 +428,7 @@ export default function App() {
 
 
     if (activeTab === 'reports') {
-      return <NeuroScorecard data={analysisData} />;
+      return <NeuroScorecard data={analysisData} meta={meta} />;
     }
 
 
@@ -449,7 +461,7 @@ export default function App() {
 
               <div className="relative rounded-lg overflow-hidden bg-slate-900 min-h-[400px] flex items-center justify-center">
                 {activeOverlays.compare ? (
-                  <ImageComparisonSlider beforeImage={uploadedImage} afterImage={analysisData.idealImage} />
+                  <ImageComparisonSlider beforeImage={uploadedImage} afterImage={analysisData.idealImage || meta?.idealImage} />
                 ) : (
                   <>
                     <img src={uploadedImage} alt="Restaurant Interior" className="w-full h-[400px] object-cover" />
@@ -0,0 +1,36 @@
+"""gunicorn settings for the Flask app.
+
+    gunicorn server:app            # picks this file up from the working directory
+
+With ``preload_app`` the master imports server.py once and also imports the
+heavy modules analyses need (openai, numpy), so forked workers share those
+pages instead of each re-importing them. Anything that must not cross a
+fork (HTTP clients, SQLite connections, pools, threads) is created lazily
+per process. Each worker then warms itself up in the background and reports
+on /ready when it is done.
+
+Environment: PORT, WEB_CONCURRENCY (workers), WEB_THREADS, GUNICORN_PRELOAD
+(default 1), GUNICORN_TIMEOUT.
+"""
+import os
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Keep in sync with server.HTTP_POOL_SIZE, which budgets a connection per thread
+threads = int(os.getenv("WEB_THREADS", 4))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+
+def when_ready(arbiter):
+    # Runs in the master after the app is loaded and before any worker forks
+    if preload_app:
+        import server
+        timings = server.import_heavy_modules()
+        arbiter.log.info("preloaded modules: %s", timings)
+
+
+def post_worker_init(worker):
+    import server
+    server.start_warm_up()
@@ -0,0 +1,310 @@
+"""Persistent history of finished analyses, for venue comparisons over time.
+
+Every result served by /analyze is recorded in SQLite with its headline
+numbers in real columns (scores, financials) and the nine neuroMetrics card
+scores in their own table, next to the full JSON for fetching. Listing,
+comparisons and per-venue aggregates are answered from the indexed columns
+with SQL, so they never re-parse stored JSON. Results served in a degraded
+budget mode (economy, local) are listed with that mode but left out of the
+venue aggregates, which describe full analyses only.
+
+Like the result cache, one connection per process is shared across threads
+under a lock; WAL mode lets several gunicorn workers write the same file.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+SCORE_FIELDS = ("overall", "saliency", "biophilia", "warmth", "social", "clutter")
+
+# financials key -> column
+FINANCIAL_COLUMNS = {
+    "currentDwell": "current_dwell",
+    "predictedDwell": "predicted_dwell",
+    "currentSpend": "current_spend",
+    "predictedSpend": "predicted_spend",
+    "monthlyRevenueUplift": "monthly_uplift",
+}
+
+_NUMERIC_COLUMNS = SCORE_FIELDS + tuple(FINANCIAL_COLUMNS.values())
+
+MAX_PAGE_SIZE = 100
+
+
+class HistoryError(ValueError):
+    """Bad query parameters (unknown id, malformed cursor, ...)."""
+
+
+def _iso(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+
+
+class HistoryStore:
+    def __init__(self, db_path: str, stats_ttl: float = 60.0):
+        self.db_path = db_path
+        self.stats_ttl = stats_ttl
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        # (analyses, venues, monotonic time counted); counting scans the whole table
+        self._counts = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """This process's connection, opened (and the schema created) on first use.
+
+        SQLite connections must not cross fork(); with gunicorn --preload the
+        store is built in the master and every worker opens its own.
+        """
+        if self._conn_pid == os.getpid():
+            return self._conn
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        self._conn_pid = os.getpid()
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        score_columns = ", ".join(f"{c} REAL" for c in _NUMERIC_COLUMNS)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " id INTEGER PRIMARY KEY,"
+            " venue TEXT,"
+            " label TEXT,"
+            " created_at REAL NOT NULL,"
+            " prompt_version TEXT,"
+            " budget_mode TEXT,"
+            f" {score_columns},"
+            " result TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_analyses_venue_created ON analyses (venue, created_at);"
+            "CREATE INDEX IF NOT EXISTS idx_analyses_created ON analyses (created_at);"
+            "CREATE INDEX IF NOT EXISTS idx_analyses_overall ON analyses (overall);"
+            "CREATE TABLE IF NOT EXISTS neuro_metrics ("
+            " analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,"
+            " metric_id INTEGER NOT NULL,"
+            " title TEXT,"
+            " score REAL,"
+            " PRIMARY KEY (analysis_id, metric_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS idx_neuro_metric_score ON neuro_metrics (metric_id, score);"
+        )
+        columns = {r["name"] for r in self._conn.execute("PRAGMA table_info(analyses)")}
+        if "budget_mode" not in columns:
+            # Files written before budget modes were recorded hold full analyses only
+            self._conn.execute("ALTER TABLE analyses ADD COLUMN budget_mode TEXT")
+        self._conn.commit()
+        return self._conn
+
+    @classmethod
+    def from_env(cls):
+        """Store at HISTORY_DB (default history.db); HISTORY_DB="" disables history.
+
+        HISTORY_STATS_TTL (default 60s) is how long stats() reuses its row counts.
+        """
+        path = os.getenv("HISTORY_DB", "history.db")
+        return cls(path, stats_ttl=float(os.getenv("HISTORY_STATS_TTL", 60))) if path else None
+
+    # --- Writes ---
+
+    def record(self, result: dict, venue: str = None, label: str = None) -> int:
+        """Store one frontend-shaped result; returns its id."""
+        scores = result.get("scores") or {}
+        financials = result.get("financials") or {}
+        values = [scores.get(f) for f in SCORE_FIELDS] + [financials.get(k) for k in FINANCIAL_COLUMNS]
+        meta = result.get("meta") or {}
+        budget_mode = (meta.get("validation") or {}).get("budgetMode")
+
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO analyses (venue, label, created_at, prompt_version, budget_mode,"
+                f" {', '.join(_NUMERIC_COLUMNS)}, result)"
+                f" VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(_NUMERIC_COLUMNS))}, ?)",
+                [venue, label, time.time(), meta.get("promptVersion"), budget_mode, *values,
+                 json.dumps(result, separators=(",", ":"))],
+            )
+            analysis_id = cursor.lastrowid
+            self._db.executemany(
+                "INSERT OR REPLACE INTO neuro_metrics (analysis_id, metric_id, title, score) VALUES (?, ?, ?, ?)",
+                [(analysis_id, m.get("id"), m.get("title"), m.get("score"))
+                 for m in result.get("neuroMetrics") or [] if isinstance(m.get("id"), int)],
+            )
+            self._db.commit()
+        return analysis_id
+
+    # --- Reads ---
+
+    def _summary(self, row) -> dict:
+        return {
+            "id": row["id"],
+            "venue": row["venue"],
+            "label": row["label"],
+            "createdAt": _iso(row["created_at"]),
+            "promptVersion": row["prompt_version"],
+            "budgetMode": row["budget_mode"],
+            "scores": {f: row[f] for f in SCORE_FIELDS},
+            "financials": {k: row[c] for k, c in FINANCIAL_COLUMNS.items()},
+        }
+
+    def list(self, venue: str = None, label: str = None, since: float = None, until: float = None,
+             min_overall: float = None, limit: int = 20, cursor: str = None) -> dict:
+        """Newest-first page of summaries. Pass the returned nextCursor to get the next page."""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where, params = [], []
+        for column, op, value in (("venue", "=", venue), ("label", "=", label), ("created_at", ">=", since),
+                                  ("created_at", "<", until), ("overall", ">=", min_overall)):
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                params.append(value)
+        if cursor:
+            try:
+                created_at, last_id = cursor.split(":")
+                params += [float(created_at), int(last_id)]
+            except ValueError:
+                raise HistoryError("Malformed cursor")
+            # Keyset pagination: stable under concurrent inserts, no OFFSET scans
+            where.append("(created_at, id) < (?, ?)")
+
+        sql = ("SELECT id, venue, label, created_at, prompt_version, budget_mode,"
+               f" {', '.join(_NUMERIC_COLUMNS)} FROM analyses")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit + 1]).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "items": [self._summary(r) for r in rows],
+            "nextCursor": f"{rows[-1]['created_at']!r}:{rows[-1]['id']}" if more else None,
+        }
+
+    def get(self, analysis_id: int):
+        """Full stored result plus history metadata, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, venue, label, created_at, result FROM analyses WHERE id = ?", (analysis_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"id": row["id"], "venue": row["venue"], "label": row["label"],
+                "createdAt": _iso(row["created_at"]), "result": json.loads(row["result"])}
+
+    # --- Comparisons and aggregates ---
+
+    @staticmethod
+    def _side(side: dict) -> tuple:
+        """(analyses WHERE clause, params) selecting one side of a comparison.
+
+        A venue side averages full analyses only; an id side is taken as asked.
+        """
+        if side.get("id") is not None:
+            try:
+                return "id = ?", [int(side["id"])]
+            except (TypeError, ValueError):
+                raise HistoryError(f"Bad analysis id: {side['id']}")
+        if side.get("venue"):
+            if side.get("label"):
+                return "venue = ? AND label = ? AND budget_mode IS NULL", [side["venue"], side["label"]]
+            return "venue = ? AND budget_mode IS NULL", [side["venue"]]
+        raise HistoryError("Each side needs an analysis id or a venue")
+
+    def compare(self, a: dict, b: dict) -> dict:
+        """Deltas (b - a) between two analyses, venues or labelled sets.
+
+        Each side is {"id": analysis_id} or {"venue": name, "label": optional};
+        a venue side averages every matching full analysis, so {"venue": v,
+        "label": "before"} vs {"venue": v, "label": "after"} tracks a remodel.
+        """
+        where_a, params_a = self._side(a)
+        where_b, params_b = self._side(b)
+
+        averages = ", ".join(f"AVG({c}) AS {c}" for c in _NUMERIC_COLUMNS)
+        deltas = ", ".join(f"ROUND(a.{c}, 2) AS a_{c}, ROUND(b.{c}, 2) AS b_{c}, ROUND(b.{c} - a.{c}, 2) AS d_{c}"
+                           for c in _NUMERIC_COLUMNS)
+        headline_sql = (
+            f"WITH a AS (SELECT COUNT(*) AS n, {averages} FROM analyses WHERE {where_a}),"
+            f" b AS (SELECT COUNT(*) AS n, {averages} FROM analyses WHERE {where_b})"
+            f" SELECT a.n AS a_n, b.n AS b_n, {deltas} FROM a, b"
+        )
+        neuro_sql = (
+            f"WITH a AS (SELECT metric_id, MAX(title) AS title, AVG(score) AS score FROM neuro_metrics"
+            f"   WHERE analysis_id IN (SELECT id FROM analyses WHERE {where_a}) GROUP BY metric_id),"
+            f" b AS (SELECT metric_id, MAX(title) AS title, AVG(score) AS score FROM neuro_metrics"
+            f"   WHERE analysis_id IN (SELECT id FROM analyses WHERE {where_b}) GROUP BY metric_id)"
+            " SELECT a.metric_id AS id, COALESCE(b.title, a.title) AS title,"
+            "   ROUND(a.score, 2) AS a, ROUND(b.score, 2) AS b, ROUND(b.score - a.score, 2) AS delta"
+            " FROM a JOIN b USING (metric_id) ORDER BY a.metric_id"
+        )
+
+        with self._lock:
+            row = self._db.execute(headline_sql, params_a + params_b).fetchone()
+            neuro = self._db.execute(neuro_sql, params_a + params_b).fetchall()
+
+        for name, side in (("a", a), ("b", b)):
+            if not row[f"{name}_n"]:
+                raise HistoryError(f"No analyses match side {name}: {side}")
+
+        def delta(column):
+            return {"a": row[f"a_{column}"], "b": row[f"b_{column}"], "delta": row[f"d_{column}"]}
+
+        return {
+            "a": dict(a, analyses=row["a_n"]),
+            "b": dict(b, analyses=row["b_n"]),
+            "scores": {f: delta(f) for f in SCORE_FIELDS},
+            "financials": {k: delta(c) for k, c in FINANCIAL_COLUMNS.items()},
+            "neuroMetrics": [dict(r) for r in neuro],
+        }
+
+    def venues(self, limit: int = 50) -> list:
+        """Per-venue aggregates over full analyses: counts, date range, mean scores
+        and latest overall."""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        averages = ", ".join(f"AVG({c}) AS {c}" for c in _NUMERIC_COLUMNS)
+        sql = (
+            "WITH latest AS (SELECT venue, overall, ROW_NUMBER() OVER"
+            "   (PARTITION BY venue ORDER BY created_at DESC, id DESC) AS rank"
+            "   FROM analyses WHERE venue IS NOT NULL AND budget_mode IS NULL),"
+            " totals AS (SELECT venue, COUNT(*) AS analyses, MIN(created_at) AS first_at,"
+            f"   MAX(created_at) AS last_at, {averages}"
+            "   FROM analyses WHERE venue IS NOT NULL AND budget_mode IS NULL GROUP BY venue)"
+            " SELECT totals.*, latest.overall AS latest_overall"
+            " FROM totals JOIN latest ON latest.venue = totals.venue AND latest.rank = 1"
+            " ORDER BY last_at DESC LIMIT ?"
+        )
+        with self._lock:
+            rows = self._db.execute(sql, (limit,)).fetchall()
+
+        return [
+            {
+                "venue": r["venue"],
+                "analyses": r["analyses"],
+                "firstAt": _iso(r["first_at"]),
+                "lastAt": _iso(r["last_at"]),
+                "latestOverall": r["latest_overall"],
+                "mean": {
+                    "scores": {f: _round(r[f]) for f in SCORE_FIELDS},
+                    "financials": {k: _round(r[c]) for k, c in FINANCIAL_COLUMNS.items()},
+                },
+            }
+            for r in rows
+        ]
+
+    def stats(self) -> dict:
+        """Row counts for /health, recounted at most every stats_ttl seconds
+        so a liveness probe doesn't scan a growing table each time."""
+        with self._lock:
+            now = time.monotonic()
+            if self._counts is None or now - self._counts[2] >= self.stats_ttl:
+                count, venues = self._db.execute(
+                    "SELECT COUNT(*), COUNT(DISTINCT venue) FROM analyses").fetchone()
+                self._counts = (count, venues, now)
+            count, venues, counted_at = self._counts
+        return {"analyses": count, "venues": venues, "countedSecondsAgo": round(now - counted_at, 1),
+                "path": self.db_path}
+
+
+def _round(value):
+    return round(value, 1) if isinstance(value, float) else value
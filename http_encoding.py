@@ -0,0 +1,87 @@
+"""Response compression and ETags.
+
+An analysis result is 5-10KB of JSON in which the same keys and phrasing
+repeat across nine neuroMetrics cards, so it compresses well: gzip takes it
+to about a quarter of its size, and brotli (used when the optional
+``brotli`` package is installed and the client accepts it) does a little
+better. ETags are a hash of the uncompressed body, weak because the bytes
+on the wire depend on the negotiated encoding. A client re-fetching a
+stored analysis with If-None-Match gets a bodiless 304.
+
+Environment: COMPRESS_MIN_BYTES (default 1024; 0 turns compression off),
+GZIP_LEVEL (default 6), BROTLI_QUALITY (default 5).
+"""
+import gzip
+import hashlib
+import os
+
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_TYPES = {"application/json", "text/plain", "text/html", "text/csv"}
+
+
+_brotli = None
+
+
+def _brotli_module():
+    """The brotli module, or False when it is not installed."""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+def available_encodings() -> tuple:
+    """Encodings this process can produce, most preferred first."""
+    return ("br", "gzip") if _brotli_module() else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> str:
+    """Best encoding for an Accept-Encoding header, or None for identity."""
+    if not accept_encoding or COMPRESS_MIN_BYTES <= 0:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        # Ties go to the earlier, better-compressing encoding
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return _brotli_module().compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        # mtime=0 keeps the output deterministic for identical bodies
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def compressible(mimetype: str, size: int) -> bool:
+    return COMPRESS_MIN_BYTES > 0 and size >= COMPRESS_MIN_BYTES and mimetype in COMPRESSIBLE_TYPES
+
+
+def content_etag(body: bytes) -> str:
+    """ETag value (without quotes or W/) for an uncompressed body."""
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
@@ -0,0 +1,129 @@
+"""Background job queue for asynchronous /analyze requests.
+
+A fixed pool of worker threads drains a bounded queue, so the number of
+in-flight model calls is set by JOB_WORKERS rather than by how many HTTP
+workers gunicorn runs. Job state lives in the process that accepted the
+upload; run the async mode with a single gunicorn worker (plus --threads)
+so that polling always lands on the same process.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity."""
+
+
+class JobQueue:
+    def __init__(self, handler, workers: int = 2, max_queue: int = 32,
+                 retention_seconds: int = 900):
+        self.handler = handler
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    @classmethod
+    def from_env(cls, handler) -> "JobQueue":
+        return cls(
+            handler,
+            workers=int(os.getenv("JOB_WORKERS", 2)),
+            max_queue=int(os.getenv("JOB_QUEUE_DEPTH", 32)),
+            retention_seconds=int(os.getenv("JOB_RETENTION_SECONDS", 900)),
+        )
+
+    def submit(self, payload) -> str:
+        """Queue a payload for the handler and return the new job id."""
+        self._ensure_workers()
+        self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "createdAt": time.time(),
+            "startedAt": None,
+            "finishedAt": None,
+            "result": None,
+            "error": None,
+        }
+
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise QueueFull(f"Job queue is full ({self._queue.maxsize} pending)")
+
+        return job_id
+
+    def get(self, job_id: str):
+        """Return a snapshot of the job, or None if unknown or expired."""
+        self._purge_expired()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "error": 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+        return {
+            "workers": self.workers,
+            "queueDepth": self._queue.qsize(),
+            "maxQueueDepth": self._queue.maxsize,
+            "retentionSeconds": self.retention_seconds,
+            "jobs": counts,
+        }
+
+    def _ensure_workers(self) -> None:
+        # Threads are started lazily so they are created after gunicorn forks
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"analysis-job-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _work(self) -> None:
+        while True:
+            job_id, payload = self._queue.get()
+            self._update(job_id, status="running", startedAt=time.time())
+            try:
+                result = self.handler(payload)
+                self._update(job_id, status="done", result=result, finishedAt=time.time())
+            except Exception as e:
+                self._update(
+                    job_id,
+                    status="error",
+                    error={"error": str(e), "type": type(e).__name__},
+                    finishedAt=time.time(),
+                )
+            finally:
+                self._queue.task_done()
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _purge_expired(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["finishedAt"] is not None and job["finishedAt"] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,112 @@
+"""Incremental parser that surfaces top-level JSON sections as they complete.
+
+The model streams the analysis one token at a time. Rather than waiting for
+the closing brace, ``SectionParser`` scans each chunk as it arrives and
+reports a top-level key as soon as its value is closed. Keys listed in
+``item_sections`` are arrays whose elements are reported one by one, so each
+neuroMetrics card can be pushed to the client on its own.
+"""
+import json
+
+
+class SectionParser:
+    def __init__(self, item_sections=()):
+        self.item_sections = set(item_sections)
+        self.buf = ""
+
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+        self._string_start = None
+        self._key = None
+        self._expect_key = False
+        self._value_start = None
+        self._item_start = None
+
+    def feed(self, chunk: str) -> list:
+        """Consume a chunk and return newly completed events.
+
+        Events are ``("section", key, value)`` for finished top-level values
+        and ``("item", key, element)`` for finished elements of item sections.
+        """
+        self.buf += chunk
+        events = []
+        buf = self.buf
+
+        while self._pos < len(buf):
+            i = self._pos
+            ch = buf[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        self._key = json.loads(buf[self._string_start:i + 1])
+                        self._expect_key = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+                if self._depth == 1 and not self._expect_key and self._value_start is None:
+                    self._value_start = i
+                continue
+
+            if ch in " \t\r\n":
+                continue
+
+            if ch == ":" and self._depth == 1:
+                continue
+
+            if ch in "{[":
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = i
+                elif self._depth == 2 and self._key in self.item_sections:
+                    self._item_start = i
+                self._depth += 1
+                if self._depth == 1:
+                    self._expect_key = True
+                continue
+
+            if ch in "}]":
+                self._depth -= 1
+                if self._depth == 2 and self._item_start is not None:
+                    events.append(("item", self._key, self._load(buf[self._item_start:i + 1])))
+                    self._item_start = None
+                elif self._depth == 1 and self._value_start is not None:
+                    events.append(("section", self._key, self._load(buf[self._value_start:i + 1])))
+                    self._value_start = None
+                elif self._depth == 0 and self._value_start is not None:
+                    # Scalar value closed by the final brace
+                    events.append(("section", self._key, self._load(buf[self._value_start:i])))
+                    self._value_start = None
+                continue
+
+            if ch == "," and self._depth == 1:
+                if self._value_start is not None:
+                    events.append(("section", self._key, self._load(buf[self._value_start:i])))
+                    self._value_start = None
+                self._expect_key = True
+                continue
+
+            if self._depth == 1 and self._value_start is None and not self._expect_key:
+                self._value_start = i
+
+        return [e for e in events if e[2] is not _INVALID]
+
+    @staticmethod
+    def _load(text: str):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return _INVALID
+
+
+_INVALID = object()
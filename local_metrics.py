@@ -0,0 +1,220 @@
+"""Deterministic visual metrics computed locally, without the vision model.
+
+A few of the headline scores have a measurable counterpart in the pixels:
+
+* warmth    - share of warm vs. cool hues (saturation weighted), blended
+              with a correlated colour temperature from a gray-world white
+              point (McCamy's approximation)
+* clutter   - edge density: fraction of pixels with a strong luminance gradient
+* biophilia - share of saturated, reasonably bright green pixels (plants)
+* saliency  - how concentrated a frequency-tuned saliency map is, i.e.
+              whether the room has a clear focal point
+
+plus brightness/contrast for lighting and a 12-bin hue histogram. Everything
+runs on a 256px thumbnail with NumPy, about 20ms per image on one core
+(``python -m benchmarks.bench_local_metrics``). The numbers back-fill
+scores the model leaves out, are quoted to the model as grounding hints,
+and are served on their own by /analyze/quick.
+
+Kept free of Flask/OpenAI imports so it can run in preprocessing workers.
+"""
+import io
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+
+MEASURE_SIDE = 256
+
+HUE_BINS = 12
+
+# Pillow's HSV mode stores hue, saturation and value as 0-255
+_CHROMATIC_SATURATION = 40
+_GREEN_HUES = (43, 120)          # ~60-170 degrees
+_WARM_HUES = (43, 234)           # warm is hue < 60 or > 330 degrees
+_COOL_HUES = (106, 191)          # ~150-270 degrees
+_GREEN_MIN_SATURATION = 51
+_GREEN_MIN_VALUE = 38
+
+# Gradient magnitude (0-255 luminance) that counts as an edge
+_EDGE_THRESHOLD = 24.0
+# Edge densities mapped to clutter 0 and 100
+_EDGE_DENSITY_RANGE = (0.02, 0.22)
+# Green pixel share that maps to biophilia 100
+_GREEN_SHARE_FULL = 0.2
+# Share of saliency mass in the top decile, for a flat and a single-subject image
+_SALIENCY_CONCENTRATION_RANGE = (0.15, 0.45)
+# Colour temperatures mapped to warmth 100 (candlelight/tungsten) and 0 (daylight)
+_WARM_KELVIN, _COOL_KELVIN = 2700.0, 6500.0
+
+# sRGB (D65) -> CIE XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124, 0.3576, 0.1805],
+    [0.2126, 0.7152, 0.0722],
+    [0.0193, 0.1192, 0.9505],
+], dtype=np.float32)
+
+# sRGB gamma decoding, as a lookup table indexed by 8-bit channel value
+_srgb = np.arange(256, dtype=np.float32) / 255.0
+_SRGB_TO_LINEAR = np.where(_srgb <= 0.04045, _srgb / 12.92, ((_srgb + 0.055) / 1.055) ** 2.4).astype(np.float32)
+# Saliency below this (YCbCr distance) everywhere means a flat image with no focal point
+_MIN_SALIENCY = 12.0
+
+
+def _scale(value: float, lo: float, hi: float) -> int:
+    """Map value linearly from [lo, hi] onto a 0-100 score."""
+    return int(round(float(np.clip((value - lo) / (hi - lo), 0.0, 1.0)) * 100))
+
+
+def _thumbnail(img: Image.Image) -> Image.Image:
+    img = img.convert('RGB')
+    if max(img.size) > MEASURE_SIDE:
+        img.thumbnail((MEASURE_SIDE, MEASURE_SIDE), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return img
+
+
+def color_temperature(rgb: np.ndarray) -> float:
+    """Correlated colour temperature (K) of the scene's gray-world white point."""
+    pixels = rgb.reshape(-1, 3)
+    # Clipped highlights and near-black pixels carry no illuminant information
+    peak = pixels.max(axis=1)
+    usable = pixels[(peak > 20) & (peak < 250)]
+    if len(usable) < 64:
+        usable = pixels
+
+    # Mean linear value per channel, from 256-bin histograms rather than per-pixel decoding
+    linear = np.array([np.bincount(usable[:, c], minlength=256) @ _SRGB_TO_LINEAR for c in range(3)])
+    x_, y_, z_ = _RGB_TO_XYZ @ (linear / len(usable))
+    total = x_ + y_ + z_
+    if total <= 0:
+        return _COOL_KELVIN
+    x, y = x_ / total, y_ / total
+    n = (x - 0.3320) / (0.1858 - y)
+    cct = 449.0 * n ** 3 + 3525.0 * n ** 2 + 6823.3 * n + 5520.33
+    return float(np.clip(cct, 1000.0, 20000.0))
+
+
+def _hue_metrics(hsv: np.ndarray) -> tuple:
+    """(warm share, cool share, green share, hue histogram) from an HSV array."""
+    hue = hsv[..., 0]
+    saturation = hsv[..., 1].astype(np.float32)
+    value = hsv[..., 2]
+
+    chromatic = saturation >= _CHROMATIC_SATURATION
+    weights = np.where(chromatic, saturation, 0.0)
+    total = float(weights.sum())
+
+    if total > 0:
+        warm = float(weights[(hue < _WARM_HUES[0]) | (hue > _WARM_HUES[1])].sum()) / total
+        cool = float(weights[(hue >= _COOL_HUES[0]) & (hue <= _COOL_HUES[1])].sum()) / total
+        histogram = np.bincount((hue.ravel().astype(np.int32) * HUE_BINS) // 256,
+                                weights=weights.ravel(), minlength=HUE_BINS) / total
+    else:
+        warm = cool = 0.0
+        histogram = np.zeros(HUE_BINS)
+
+    green = ((hue >= _GREEN_HUES[0]) & (hue <= _GREEN_HUES[1])
+             & (saturation >= _GREEN_MIN_SATURATION) & (value >= _GREEN_MIN_VALUE))
+    return warm, cool, float(green.mean()), [round(float(h), 3) for h in histogram]
+
+
+def _edge_density(luma: np.ndarray) -> float:
+    gx = np.diff(luma, axis=1)[:-1, :]
+    gy = np.diff(luma, axis=0)[:, :-1]
+    return float((np.hypot(gx, gy) > _EDGE_THRESHOLD).mean())
+
+
+def _saliency(img: Image.Image) -> tuple:
+    """(concentration, focal point) of a frequency-tuned saliency map.
+
+    Saliency is each blurred pixel's distance from the image's mean colour
+    (Achanta et al.); concentration is the share of total saliency held by
+    the most salient 10% of pixels.
+    """
+    ycc = np.asarray(img.filter(ImageFilter.BoxBlur(2)).convert('YCbCr'), dtype=np.float32)
+    offset = ycc - ycc.reshape(-1, 3).mean(axis=0)
+    saliency = np.sqrt(np.einsum('ijk,ijk->ij', offset, offset))
+
+    flat = saliency.ravel()
+    if float(flat.max()) < _MIN_SALIENCY:
+        return 0.0, {"x": 0.5, "y": 0.5}
+    total = float(flat.sum())
+    top = max(1, flat.size // 10)
+    cutoff = np.partition(flat, flat.size - top)[flat.size - top]
+    mask = saliency >= cutoff
+    concentration = float(saliency[mask].sum()) / total
+
+    ys, xs = np.nonzero(mask)
+    weights = saliency[mask]
+    height, width = saliency.shape
+    focal = {"x": round(float(np.average(xs, weights=weights)) / max(1, width - 1), 3),
+             "y": round(float(np.average(ys, weights=weights)) / max(1, height - 1), 3)}
+    return concentration, focal
+
+
+def measure(img: Image.Image) -> dict:
+    """Local metrics for a decoded image; scores are on the model's 0-100 scale."""
+    start = time.perf_counter()
+    img = _thumbnail(img)
+    rgb = np.asarray(img)
+    hsv = np.asarray(img.convert('HSV'))
+    luma = np.asarray(img.convert('L'), dtype=np.float32)
+
+    kelvin = color_temperature(rgb)
+    warm, cool, green, histogram = _hue_metrics(hsv)
+    density = _edge_density(luma)
+    concentration, focal = _saliency(img)
+
+    hue_warmth = 50 + 50 * (warm - cool)
+    kelvin_warmth = _scale(_COOL_KELVIN - kelvin, 0.0, _COOL_KELVIN - _WARM_KELVIN)
+
+    return {
+        "scores": {
+            "warmth": int(round((hue_warmth + kelvin_warmth) / 2)),
+            "clutter": _scale(density, *_EDGE_DENSITY_RANGE),
+            "biophilia": _scale(green, 0.0, _GREEN_SHARE_FULL),
+            "saliency": _scale(concentration, *_SALIENCY_CONCENTRATION_RANGE),
+        },
+        "lighting": {
+            "brightness": _scale(float(luma.mean()), 0.0, 255.0),
+            "contrast": _scale(float(luma.std()), 0.0, 80.0),
+            "colorTemperatureK": int(round(kelvin, -1)),
+        },
+        "hueHistogram": histogram,
+        "focalPoint": focal,
+        "measures": {
+            "warmHueShare": round(warm, 3),
+            "coolHueShare": round(cool, 3),
+            "greenShare": round(green, 3),
+            "edgeDensity": round(density, 3),
+            "saliencyConcentration": round(concentration, 3),
+        },
+        "ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def measure_image(source) -> dict:
+    """Local metrics of encoded image bytes or a seekable file; JPEGs are draft-decoded."""
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    fp.seek(0)
+    start = time.perf_counter()
+    img = Image.open(fp)
+    if img.format == 'JPEG':
+        img.draft('RGB', (MEASURE_SIDE, MEASURE_SIDE))
+    img = ImageOps.exif_transpose(img)
+    measured = measure(img)
+    measured["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return measured
+
+
+def prompt_hints(measured: dict) -> str:
+    """One sentence quoting the measurements, for grounding the model's scores."""
+    scores, lighting = measured["scores"], measured["lighting"]
+    return (
+        f"Pixel measurements of this photo (0-100 unless noted): warmth {scores['warmth']},"
+        f" clutter {scores['clutter']}, greenery/biophilia {scores['biophilia']},"
+        f" focal-point saliency {scores['saliency']}, brightness {lighting['brightness']},"
+        f" contrast {lighting['contrast']}, colour temperature ~{lighting['colorTemperatureK']}K."
+        " Use them to calibrate your scores; depart from them only where the scene clearly warrants it."
+    )
@@ -0,0 +1,264 @@
+"""Minimal Prometheus-style metrics and structured logging.
+
+Only counters and histograms are needed here, so rather than pull in
+prometheus_client we keep a small in-process registry and render the text
+exposition format ourselves. Values are per process; with several gunicorn
+workers each one reports its own series.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6, 64e6)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000)
+
+
+def _label_key(labelnames, labels) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None) -> str:
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.callback()}"]
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, ("le", f"{bound:g}"))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()) -> Histogram:
+        return self.register(Histogram(name, help, buckets, labelnames))
+
+    def gauge(self, name, help, callback) -> Gauge:
+        return self.register(Gauge(name, help, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    "neurospace_requests_total", "HTTP requests by endpoint and status", ("endpoint", "status"))
+ERRORS = REGISTRY.counter(
+    "neurospace_errors_total", "Pipeline errors by exception type", ("type",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "neurospace_stage_seconds", "Latency of each analysis pipeline stage", labelnames=("stage",))
+PAYLOAD_BYTES = REGISTRY.histogram(
+    "neurospace_payload_bytes", "Image payload size before/after preprocessing", BYTES_BUCKETS, ("kind",))
+TOKENS = REGISTRY.histogram(
+    "neurospace_tokens", "Model token usage per call", TOKEN_BUCKETS, ("kind",))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "neurospace_cache_lookups_total", "Analysis cache lookups by result", ("result",))
+REQUEST_PEAK_BYTES = REGISTRY.histogram(
+    "neurospace_request_peak_bytes", "Estimated peak buffer memory held by one request", BYTES_BUCKETS)
+
+
+# A ContextVar rather than a thread-local so one request's spans follow it
+# whether it runs on a Flask thread or as an asyncio task in the ASGI app
+_spans = ContextVar("neurospace_spans", default=None)
+_memory = ContextVar("neurospace_memory", default=None)
+
+
+def begin_spans() -> None:
+    """Start collecting stage timings recorded in this context (one request)."""
+    _spans.set({})
+    _memory.set({"peak": 0})
+
+
+def end_spans() -> dict:
+    """Stop collecting and return {stage: milliseconds} for this context."""
+    spans = _spans.get() or {}
+    _spans.set(None)
+    return spans
+
+
+def note_memory(nbytes: int) -> None:
+    """Report bytes currently held by this request; the maximum is kept."""
+    memory = _memory.get()
+    if memory is not None and nbytes > memory["peak"]:
+        memory["peak"] = nbytes
+
+
+def end_memory() -> int:
+    """Stop tracking and return this request's peak, recording it if non-zero."""
+    memory = _memory.get()
+    _memory.set(None)
+    peak = memory["peak"] if memory else 0
+    if peak:
+        REQUEST_PEAK_BYTES.observe(peak)
+    return peak
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    spans = _spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds * 1000
+
+
+def server_timing(spans: dict) -> str:
+    """Format spans as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={ms:.2f}" for name, ms in spans.items())
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block and record it under neurospace_stage_seconds{stage=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_stage(name, elapsed)
+        log.debug("stage", extra={"fields": {"stage": name, "ms": round(elapsed * 1000, 2)}})
+
+
+# --- Structured logging ---
+
+class StructuredFormatter(logging.Formatter):
+    """Render records as JSON lines, or logfmt-style text for local dev."""
+
+    def __init__(self, fmt_type: str = "text"):
+        super().__init__()
+        self.fmt_type = fmt_type
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        if self.fmt_type == "json":
+            entry = {
+                "ts": round(record.created, 3),
+                "level": record.levelname.lower(),
+                "logger": record.name,
+                "msg": record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry["exc"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        ts = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+        line = f"{ts} {record.levelname:<5} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging() -> None:
+    """Configure the 'neurospace' logger from LOG_LEVEL / LOG_FORMAT."""
+    logger = logging.getLogger("neurospace")
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(os.getenv("LOG_FORMAT", "text")))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def log_event(level: int, msg: str, **fields) -> None:
+    """Log a message with structured key/value fields."""
+    if log.isEnabledFor(level):
+        log.log(level, msg, extra={"fields": fields})
+
+
+log = logging.getLogger("neurospace")
@@ -0,0 +1,169 @@
+"""Single-pass image preprocessing for the vision model.
+
+Uploads are always downsampled to the resolution the model actually looks
+at (gpt-4o style "high" detail: fit within 2048px, then shortest side
+768px; "low" detail: fit within 512px). JPEGs are decoded at reduced size
+with ``Image.draft`` so a 12MP phone photo never gets fully decoded, and
+JPEG quality is picked with a binary search instead of a linear retry loop.
+
+The source can be bytes or a seekable binary file, so spooled uploads are
+decoded straight from their temp file without first being read into memory.
+
+Kept free of Flask/OpenAI imports so process-pool workers start quickly.
+"""
+import io
+import time
+
+from PIL import Image, ImageOps
+
+
+MODEL_MAX_LONG_SIDE = 2048
+MODEL_MAX_SHORT_SIDE = 768
+LOW_DETAIL_SIDE = 512
+
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 20
+
+# Accept a draft decode down to this fraction of the target size rather than
+# decoding at twice the resolution and paying for a full resample
+DRAFT_TOLERANCE = 0.9
+
+
+def target_size(width: int, height: int, detail: str = "high") -> tuple:
+    """Return the dimensions the vision model will downscale an image to."""
+    if detail == "low":
+        scale = min(1.0, LOW_DETAIL_SIDE / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    scale = min(1.0, MODEL_MAX_LONG_SIDE / max(width, height))
+    scale = min(scale, MODEL_MAX_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _bitmap_bytes(img: Image.Image) -> int:
+    """Approximate memory held by a decoded image (Pillow stores RGB as 4 bytes/pixel)."""
+    return img.width * img.height * (1 if img.mode in ('1', 'L', 'P') else 4)
+
+
+def _resident_bytes(source, size: int) -> int:
+    """Bytes of the source held in memory: 0 once a spooled upload has rolled to disk."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return size
+    inner = getattr(source, "_file", source)
+    return size if isinstance(inner, io.BytesIO) else 0
+
+
+def _encode(img: Image.Image, quality: int) -> bytes:
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def preprocess_image(source, max_size_mb: int = 4, detail: str = "high") -> tuple:
+    """Decode, downsample and JPEG-encode an upload for the model.
+
+    ``source`` is the raw upload as bytes or a seekable binary file and
+    ``detail`` the image detail level the model will be asked for. Returns
+    (jpeg_bytes, info) where info holds per-stage timings in milliseconds,
+    the source/output dimensions and sizes, and ``peakBytes``, an estimate of
+    the most memory held by image buffers at any one point.
+    """
+    max_size_bytes = max_size_mb * 1024 * 1024
+    timings = {}
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        input_bytes = len(source)
+        fp = io.BytesIO(source)
+    else:
+        fp = source
+        fp.seek(0, io.SEEK_END)
+        input_bytes = fp.tell()
+        fp.seek(0)
+    resident = _resident_bytes(source, input_bytes)
+
+    t0 = time.perf_counter()
+    img = Image.open(fp)
+    source_format = img.format
+    source_size = img.size
+    target = target_size(*img.size, detail)
+
+    # JPEG-only: let libjpeg decode at 1/2, 1/4 or 1/8 scale directly
+    if source_format == 'JPEG':
+        img.draft('RGB', (int(target[0] * DRAFT_TOLERANCE), int(target[1] * DRAFT_TOLERANCE)))
+    img.load()
+    decoded = _bitmap_bytes(img)
+    peak = resident + decoded
+    timings["decode_ms"] = (time.perf_counter() - t0) * 1000
+
+    t1 = time.perf_counter()
+    img = ImageOps.exif_transpose(img)
+    target = target_size(*img.size, detail)
+    passthrough = (
+        source_format == 'JPEG'
+        and img.size == source_size
+        and target == source_size
+        and input_bytes <= max_size_bytes
+    )
+    if not passthrough:
+        img = _to_rgb(img)
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        # Source bitmap is still alive while the resized copy is built
+        peak = max(peak, resident + decoded + _bitmap_bytes(img))
+    timings["resize_ms"] = (time.perf_counter() - t1) * 1000
+
+    t2 = time.perf_counter()
+    quality = None
+    if passthrough:
+        if isinstance(source, bytes):
+            output = source
+        else:
+            fp.seek(0)
+            output = fp.read()
+    else:
+        quality = DEFAULT_QUALITY
+        output = _encode(img, quality)
+
+        if len(output) > max_size_bytes:
+            # Binary search for the highest quality that fits the budget
+            lo, hi = MIN_QUALITY, DEFAULT_QUALITY - 1
+            best = None
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                candidate = _encode(img, mid)
+                if len(candidate) <= max_size_bytes:
+                    best, quality = candidate, mid
+                    lo = mid + 1
+                else:
+                    hi = mid - 1
+            if best is None:
+                quality = MIN_QUALITY
+                best = _encode(img, quality)
+            output = best
+    # Encoder buffer + its getvalue() copy alongside the bitmap
+    peak = max(peak, resident + _bitmap_bytes(img) + 2 * len(output))
+    timings["encode_ms"] = (time.perf_counter() - t2) * 1000
+    timings["total_ms"] = (time.perf_counter() - t0) * 1000
+
+    info = {
+        "timings": {k: round(v, 2) for k, v in timings.items()},
+        "sourceFormat": source_format,
+        "sourceSize": list(source_size),
+        "outputSize": list(img.size),
+        "inputBytes": input_bytes,
+        "outputBytes": len(output),
+        "quality": quality,
+        "peakBytes": peak,
+    }
+    return output, info
@@ -0,0 +1,419 @@
+"""Versioned analysis prompts and their token budgets.
+
+A ``Prompt`` bundles everything that shapes the model call: system and user
+text, response format, image ``detail`` level and ``max_tokens``. Its ``tag``
+(version plus detail) is part of the analysis cache key and of every
+response's ``meta``, so results from different prompts are never mixed.
+Registered prompts must never be edited in place; add a new version instead.
+
+Versions:
+    neuro-v1         the original prose prompt with an inline JSON template
+    neuro-v2-schema  short instructions plus a strict JSON schema, sent as
+                     OpenAI structured output instead of being spelled out
+
+PROMPT_VERSION and IMAGE_DETAIL (low, high or auto) pick the active prompt.
+Token counts use tiktoken when it is installed and ~4 chars/token otherwise.
+"""
+import json
+import math
+import os
+
+from preprocess import target_size
+
+
+DETAIL_LEVELS = ("low", "high", "auto")
+
+# OpenAI vision pricing: flat cost at low detail, per 512px tile at high
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIZE = 512
+
+
+NEURO_V1_SYSTEM = """
+You are Dr. Maya Chen, a neuro-aesthetic consultant who has worked with 200+ restaurants generating $50M+ in revenue optimization through design psychology.
+
+
+Analyze this restaurant interior with surgical precision. Focus on SPECIFIC visual elements you can see, not generic statements.
+
+
+CRITICAL INSTRUCTIONS:
+- BE BRUTALLY SPECIFIC about what you see in the image (exact colors, materials, layout)
+- QUANTIFY business impact with realistic dollar amounts and percentages
+- IDENTIFY 3-5 specific objects/areas in the image with their approximate positions
+- AVOID generic statements like "warm atmosphere" - instead say "2700K Edison bulbs creating amber glow reducing cortisol 18%"
+- Every score must be justified by something VISIBLE in the image
+
+
+Return ONLY valid JSON (no markdown, no explanations outside JSON):
+
+
+{
+  "scores": {
+    "overall": <number 60-95, be critical - few restaurants score above 85>,
+    "saliency": <number 50-100>,
+    "biophilia": <number 10-90>,
+    "warmth": <number 40-95>,
+    "social": <number 50-90>,
+    "clutter": <number 30-95 where higher = more cluttered>
+  },
+  "neuroMetrics": [
+    {
+      "id": 1,
+      "title": "Dopamine & Appetite Stimulation",
+      "score": <number 3.0-9.8 with one decimal - be honest, not all restaurants are 9+>,
+      "drivers": [
+        "<SPECIFIC element you see: 'Crimson velvet chairs' not 'red seating'>",
+        "<Another SPECIFIC element with color/material/pattern>",
+        "<Third SPECIFIC element>"
+      ],
+      "neuralImpact": "Activation of <specific brain region> via <specific mechanism>. <Scientific finding>.",
+      "businessEffect": "Increases <specific metric> by <realistic %>. Estimated <dollar amount> per table or <conversion rate>%.",
+      "tag": "<Only if exceptional: 'High upsell potential' / 'Critical revenue driver' or null>"
+    },
+    {
+      "id": 2,
+      "title": "Stress Reduction & Emotional Safety",
+      "score": <number 3.0-9.8>,
+      "drivers": ["<SPECIFIC color with Kelvin temp or Pantone>", "<SPECIFIC material texture>", "<SPECIFIC lighting detail>"],
+      "neuralImpact": "Parasympathetic nervous system activation through <specific visual cue>. Cortisol reduction via <mechanism>.",
+      "businessEffect": "Extends dwell time by <realistic minutes>. Customers order <number> more items/rounds. +$<amount> per visit.",
+      "tag": null
+    },
+    {
+      "id": 3,
+      "title": "Perceived Food Quality Enhancement",
+      "score": <number>,
+      "drivers": ["<SPECIFIC lighting type and placement>", "<SPECIFIC surface finish>", "<SPECIFIC reflectance property>"],
+      "neuralImpact": "Gustatory cortex priming through visual contrast. <Color temperature> light makes food appear <percentage>% fresher.",
+      "businessEffect": "Reduces food complaints by <percentage>%. Review scores increase by <rating points>. Repeat visits +<percentage>%.",
+      "tag": null
+    },
+    {
+      "id": 4,
+      "title": "Dwell Time & Seating Comfort",
+      "score": <number>,
+      "drivers": ["<SPECIFIC seating style and ergonomics>", "<SPECIFIC spacing measurement>", "<SPECIFIC back support detail>"],
+      "neuralImpact": "Proprioceptive comfort signals reduce unconscious exit cues. Booth depth of <measurement> optimizes stay duration.",
+      "businessEffect": "Average table time increases by <minutes>. Second round orders +<percentage>%. Revenue per seat hour: +$<amount>.",
+      "tag": "<if booth/premium seating: 'Strong per-table revenue'>"
+    },
+    {
+      "id": 5,
+      "title": "Cognitive Load & Decision Ease",
+      "score": <number>,
+      "drivers": ["<SPECIFIC wall treatment>", "<SPECIFIC visual hierarchy element>", "<SPECIFIC signage/menu visibility>"],
+      "neuralImpact": "Prefrontal cortex load reduced by <percentage>% through <specific design principle>. Decision time drops <seconds>.",
+      "businessEffect": "Ordering speed increases <percentage>%. Table turnover improves without rushed feeling. Capacity utilization +<percentage>%.",
+      "tag": null
+    },
+    {
+      "id": 6,
+      "title": "Brand Memory Encoding",
+      "score": <number>,
+      "drivers": ["<SPECIFIC unique design element>", "<SPECIFIC color scheme with hex/Pantone>", "<SPECIFIC architectural feature>"],
+      "neuralImpact": "Hippocampal encoding strength via <distinctive element>. Memory retention after <days> days: <percentage>% vs <percentage>% industry avg.",
+      "businessEffect": "Organic word-of-mouth increases <percentage>%. Return visit rate: <percentage>% vs <percentage>% benchmark. Social sharing +<percentage>%.",
+      "tag": null
+    },
+    {
+      "id": 7,
+      "title": "Social Bonding & Emotional Warmth",
+      "score": <number>,
+      "drivers": ["<SPECIFIC lighting Kelvin temp>", "<SPECIFIC table spacing in feet/cm>", "<SPECIFIC textile material>"],
+      "neuralImpact": "Oxytocin release triggered by <specific sensory input>. Interpersonal connection scores increase <percentage>%.",
+      "businessEffect": "Group dining bookings +<percentage>%. Date night preference rating: <score>/10. Celebration venue selection +<percentage>%.",
+      "tag": null
+    },
+    {
+      "id": 8,
+      "title": "Premium Perception & Willingness to Pay",
+      "score": <number>,
+      "drivers": ["<SPECIFIC material quality indicator>", "<SPECIFIC finish detail>", "<SPECIFIC architectural detail>"],
+      "neuralImpact": "Price justification circuits activated via perceived craftsmanship. Value perception shifts +<percentage>% above actual pricing.",
+      "businessEffect": "Menu prices can be <percentage>% higher without resistance. Premium item conversion: <percentage>%. Wine/cocktail upsells +<percentage>%.",
+      "tag": "<if score > 8.5: 'Premium pricing justified'>"
+    },
+    {
+      "id": 9,
+      "title": "Instagrammability & Share Trigger",
+      "score": <number 4.0-8.5 - be realistic, not everything is Instagram-perfect>,
+      "drivers": ["<SPECIFIC photogenic element>", "<SPECIFIC lighting quality for cameras>", "<SPECIFIC background aesthetic>"],
+      "neuralImpact": "Social validation dopamine loop activation. Identity signaling strength: <rating>. Shareability index: <percentage>%.",
+      "businessEffect": "Organic social posts: <number> per month. Marketing value: $<amount>/month. New customer acquisition via social: <percentage>%.",
+      "tag": null
+    }
+  ],
+  "metrics": [
+    {"subject": "Biophilia", "A": <realistic current 10-80>, "B": 85, "fullMark": 100},
+    {"subject": "Warmth", "A": <realistic current>, "B": 90, "fullMark": 100},
+    {"subject": "Social Layout", "A": <realistic current>, "B": 80, "fullMark": 100},
+    {"subject": "Lighting", "A": <realistic current>, "B": 95, "fullMark": 100},
+    {"subject": "Cleanliness", "A": <realistic current>, "B": 90, "fullMark": 100},
+    {"subject": "Acoustics", "A": <estimated from visual cues>, "B": 75, "fullMark": 100}
+  ],
+  "insights": [
+    {
+      "type": "critical",
+      "title": "<SPECIFIC critical issue you can see>",
+      "desc": "<Detailed explanation with visual evidence from image>. Recommend: <specific solution with material/color/placement>.",
+      "impact": "-$<realistic amount> per table OR -<minutes> Dwell Time"
+    },
+    {
+      "type": "warning",
+      "title": "<SPECIFIC moderate issue>",
+      "desc": "<What you see and why it matters>. Quick fix: <actionable suggestion>.",
+      "impact": "-<percentage>% satisfaction OR -$<amount> Avg Check"
+    },
+    {
+      "type": "success",
+      "title": "<SPECIFIC strong element you can see>",
+      "desc": "<What they're doing right and why it works>. This is <benchmark comparison>.",
+      "impact": "+$<amount> revenue driver OR +<percentage>% conversion"
+    }
+  ],
+  "financials": {
+    "currentDwell": <realistic 25-90 minutes based on restaurant type visible>,
+    "predictedDwell": <current + realistic improvement 5-20 min>,
+    "currentSpend": <realistic based on visible ambiance quality: $15-150>,
+    "predictedSpend": <current + realistic improvement 10-30%>,
+    "monthlyRevenueUplift": <realistic calculation: (predictedSpend - currentSpend) × avg daily covers × 30>
+  },
+  "objects": [
+    {
+      "label": "<SPECIFIC object you can see: 'Brass pendant lights' not 'lighting'>",
+      "x": <percentage 0-100 from left edge>,
+      "y": <percentage 0-100 from top edge>,
+      "width": <percentage width 5-40>,
+      "height": <percentage height 5-40>,
+      "type": "positive"
+    },
+    {
+      "label": "<SPECIFIC problem element: 'Cluttered service station' not 'clutter'>",
+      "x": <percentage>,
+      "y": <percentage>,
+      "width": <percentage>,
+      "height": <percentage>,
+      "type": "negative"
+    }
+  ]
+}
+
+
+ANALYSIS CHECKLIST - Mention in your analysis:
+✓ Exact color temperatures (e.g., 2700K vs 4000K)
+✓ Specific materials (velvet, brass, reclaimed wood, terrazzo, etc.)
+✓ Measurable spacing (table distance, ceiling height if visible)
+✓ Lighting layers (ambient, task, accent - be specific about sources)
+✓ Sight lines and privacy levels
+✓ Traffic flow observations
+✓ Surface textures and finishes
+✓ Biophilic elements count (plants, natural materials, natural light)
+✓ Color psychology with specific hues
+✓ Realistic financial projections based on visible quality tier
+
+
+Remember: Restaurant owners want ACTIONABLE INSIGHTS with MEASURABLE IMPACT, not academic theory.
+"""
+
+
+NEURO_V2_SYSTEM = """You are a neuro-aesthetic restaurant design consultant. Analyze the restaurant interior in the image.
+
+Rules:
+- Be specific about what is visible: exact colors (Kelvin, hex), materials, layout, spacing. No generic phrases.
+- Justify every score with something visible. Be critical: few venues deserve overall > 85.
+- Quantify business impact with realistic percentages, minutes and dollar amounts.
+
+Ranges: scores.overall 60-95, saliency 50-100, biophilia 10-90, warmth 40-95, social 50-90, clutter 30-95 (higher = more cluttered).
+neuroMetrics: exactly these 9, ids 1-9 in order, score 3.0-9.8 with one decimal (Instagrammability 4.0-8.5), 3 specific drivers each, tag null unless exceptional:
+Dopamine & Appetite Stimulation; Stress Reduction & Emotional Safety; Perceived Food Quality Enhancement; Dwell Time & Seating Comfort; Cognitive Load & Decision Ease; Brand Memory Encoding; Social Bonding & Emotional Warmth; Premium Perception & Willingness to Pay; Instagrammability & Share Trigger.
+neuralImpact names the brain mechanism; businessEffect gives the measurable outcome.
+metrics: Biophilia (B 85), Warmth (B 90), Social Layout (B 80), Lighting (B 95), Cleanliness (B 90), Acoustics (B 75); A is the current 10-100 score, fullMark 100.
+insights: one critical, one warning, one success, each with a concrete recommendation and an impact like "-$4 per table" or "+6 min Dwell Time".
+financials: dwell in minutes (25-90), spend per head in dollars, monthlyRevenueUplift = (predictedSpend - currentSpend) x daily covers x 30.
+objects: 3-5 visible objects with x, y, width, height as 0-100 percentages of the image, type positive or negative."""
+
+
+ANALYSIS_USER_TEXT = "Analyze this restaurant interior strictly using the schema."
+
+
+def _object(properties: dict) -> dict:
+    """Strict-mode object: every property required, nothing extra."""
+    return {"type": "object", "properties": properties, "required": list(properties),
+            "additionalProperties": False}
+
+
+_NUMBER = {"type": "number"}
+_STRING = {"type": "string"}
+
+ANALYSIS_SCHEMA = _object({
+    "scores": _object({k: _NUMBER for k in ("overall", "saliency", "biophilia", "warmth", "social", "clutter")}),
+    "neuroMetrics": {"type": "array", "items": _object({
+        "id": {"type": "integer"},
+        "title": _STRING,
+        "score": _NUMBER,
+        "drivers": {"type": "array", "items": _STRING},
+        "neuralImpact": _STRING,
+        "businessEffect": _STRING,
+        "tag": {"type": ["string", "null"]},
+    })},
+    "metrics": {"type": "array", "items": _object({
+        "subject": _STRING, "A": _NUMBER, "B": _NUMBER, "fullMark": _NUMBER,
+    })},
+    "insights": {"type": "array", "items": _object({
+        "type": {"type": "string", "enum": ["critical", "warning", "success"]},
+        "title": _STRING, "desc": _STRING, "impact": _STRING,
+    })},
+    "financials": _object({k: _NUMBER for k in (
+        "currentDwell", "predictedDwell", "currentSpend", "predictedSpend", "monthlyRevenueUplift")}),
+    "objects": {"type": "array", "items": _object({
+        "label": _STRING, "x": _NUMBER, "y": _NUMBER, "width": _NUMBER, "height": _NUMBER,
+        "type": {"type": "string", "enum": ["positive", "negative"]},
+    })},
+})
+
+
+def count_tokens(text: str) -> int:
+    """Token count for gpt-4o family models (estimated without tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text))
+
+
+_tiktoken_encoding = False
+
+
+def _encoding():
+    global _tiktoken_encoding
+    if _tiktoken_encoding is False:
+        try:
+            import tiktoken
+            _tiktoken_encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _tiktoken_encoding = None
+    return _tiktoken_encoding
+
+
+def image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Input tokens OpenAI bills for an image of this size at a detail level."""
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    w, h = target_size(width, height)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * math.ceil(w / TILE_SIZE) * math.ceil(h / TILE_SIZE)
+
+
+class Prompt:
+    def __init__(self, version: str, system: str, user_text: str = ANALYSIS_USER_TEXT,
+                 schema: dict = None, max_tokens: int = 3500, temperature: float = 0.6, detail: str = "high"):
+        if detail not in DETAIL_LEVELS:
+            raise ValueError(f"Unknown image detail level: {detail}")
+        self.version = version
+        self.system = system
+        self.user_text = user_text
+        self.schema = schema
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.detail = detail
+        self._token_counts = None
+
+    @property
+    def tag(self) -> str:
+        """Identifies prompt text and image detail, for cache keys and response metadata."""
+        return f"{self.version}@{self.detail}"
+
+    def with_detail(self, detail: str) -> "Prompt":
+        return Prompt(self.version, self.system, self.user_text, self.schema,
+                      self.max_tokens, self.temperature, detail)
+
+    def with_max_tokens(self, max_tokens: int) -> "Prompt":
+        return Prompt(self.version, self.system, self.user_text, self.schema,
+                      max_tokens, self.temperature, self.detail)
+
+    def with_reference(self, scores: dict) -> "Prompt":
+        """Copy whose user text quotes a near-identical photo's scores, to keep results consistent."""
+        reference = json.dumps(scores, separators=(',', ':'))
+        user_text = (f"{self.user_text} A near-identical photo of this room previously scored {reference};"
+                     " stay consistent unless this image clearly differs.")
+        return Prompt(self.version, self.system, user_text, self.schema,
+                      self.max_tokens, self.temperature, self.detail)
+
+    def with_hints(self, hints: str) -> "Prompt":
+        """Copy whose user text ends with grounding hints (e.g. local pixel measurements)."""
+        return Prompt(self.version, self.system, f"{self.user_text} {hints}", self.schema,
+                      self.max_tokens, self.temperature, self.detail)
+
+    @property
+    def response_format(self) -> dict:
+        """OpenAI response_format: strict structured output when a schema is attached."""
+        if self.schema is None:
+            return {"type": "json_object"}
+        return {"type": "json_schema",
+                "json_schema": {"name": "neuro_analysis", "strict": True, "schema": self.schema}}
+
+    def system_with_schema(self) -> str:
+        """System text for backends without structured output: the schema goes inline."""
+        if self.schema is None:
+            return self.system
+        return f"{self.system}\n\nReturn only JSON matching this schema:\n{json.dumps(self.schema, separators=(',', ':'))}"
+
+    def token_counts(self) -> dict:
+        """Input tokens spent on text per call (the image is counted separately).
+
+        Computed once per prompt; the first call may import tiktoken.
+        """
+        if self._token_counts is not None:
+            return self._token_counts
+        counts = {
+            "system": count_tokens(self.system),
+            "user": count_tokens(self.user_text),
+            "schema": count_tokens(json.dumps(self.schema, separators=(',', ':'))) if self.schema else 0,
+        }
+        counts["total"] = sum(counts.values())
+        self._token_counts = counts
+        return counts
+
+    def stats(self) -> dict:
+        return {"version": self.version, "detail": self.detail, "maxTokens": self.max_tokens,
+                "tokens": self.token_counts()}
+
+
+PROMPTS = {
+    "neuro-v1": Prompt("neuro-v1", NEURO_V1_SYSTEM),
+    "neuro-v2-schema": Prompt("neuro-v2-schema", NEURO_V2_SYSTEM, schema=ANALYSIS_SCHEMA, max_tokens=2500),
+}
+
+
+def get_prompt(version: str = None, detail: str = None) -> Prompt:
+    """Look up a registered prompt, defaulting to PROMPT_VERSION / IMAGE_DETAIL."""
+    version = version or os.getenv("PROMPT_VERSION", "neuro-v1")
+    if version not in PROMPTS:
+        raise ValueError(f"Unknown prompt version: {version} (known: {', '.join(PROMPTS)})")
+    return PROMPTS[version].with_detail(detail or os.getenv("IMAGE_DETAIL", "high"))
+
+
+# Completion tokens budgeted per section when re-asking for just that section
+REASK_SECTION_TOKENS = {
+    "scores": 80, "metrics": 250, "insights": 450, "financials": 100, "objects": 350,
+}
+REASK_CARD_TOKENS = 170
+
+
+def reask_prompt(base: Prompt, sections: list, card_ids: list = (), known: dict = None) -> Prompt:
+    """Prompt asking the model for only the listed sections of the analysis.
+
+    ``known`` holds sections already accepted from the first reply; they are
+    quoted so the regenerated parts stay consistent with them.
+    """
+    wanted = ", ".join(sections)
+    system = f"{NEURO_V2_SYSTEM}\n\nAn earlier answer for this image was incomplete. Return ONLY these keys: {wanted}."
+    if "neuroMetrics" in sections:
+        system += f" For neuroMetrics include only the cards with ids {', '.join(map(str, card_ids))}."
+
+    user_text = f"Complete the analysis of this restaurant interior with: {wanted}."
+    if known:
+        user_text += f" Already determined (stay consistent): {json.dumps(known, separators=(',', ':'))}"
+
+    schema = _object({key: ANALYSIS_SCHEMA["properties"][key] for key in sections})
+    max_tokens = sum(REASK_SECTION_TOKENS.get(key, 0) for key in sections) + REASK_CARD_TOKENS * len(card_ids)
+    return Prompt(f"{base.version}+reask", system, user_text, schema,
+                  max_tokens=max_tokens, temperature=base.temperature, detail=base.detail)
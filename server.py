@@ -1,19 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response
 from flask_cors import CORS, cross_origin
 from dotenv import load_dotenv
-from openai import OpenAI
 import os
 import json
-import base64
-import re
-from PIL import Image
+import logging
+import math
+from PIL import UnidentifiedImageError
+import hmac
+import importlib
 import io
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from admission import AdmissionController, Rejected, client_key
+from budgets import Budgets, UsageLedger, attribute
+from cache import AnalysisCache, content_key
+from history import HistoryError, HistoryStore
+from http_encoding import compress, compressible, content_etag, negotiate
+from jobs import JobQueue, QueueFull
+from preprocess import preprocess_image
+from prompts import get_prompt, reask_prompt
+from similarity import HashIndex, image_hashes
+from singleflight import SingleFlight
+from backends import BackendError, build_router, request_footprint
+from transport import CircuitOpenError, make_openai_http_client
+from json_stream import SectionParser
+from video import KeyframeSampler, VideoError, open_video, video_support
+from validation import (
+    SCORES, VALIDATION_OUTCOMES, find_gaps, merge_sections, repair_json, validate_analysis,
+    validate_card, validate_section,
+)
+from metrics import (
+    REGISTRY, REQUESTS, ERRORS, PAYLOAD_BYTES, TOKENS, CACHE_LOOKUPS,
+    begin_spans, end_spans, end_memory, note_memory, observe_stage, server_timing,
+    configure_logging, log, log_event, stage,
+)
 
 
 load_dotenv()
+configure_logging()
+
+
+# File parts larger than this are spooled to a temp file while the body is
+# parsed, and preprocessing decodes straight from it (Werkzeug's default is 500KB)
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+
+
+class SpoolingRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES, mode="rb+")
 
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
+# Compact, unsorted JSON: results keep the model's section order and skip a sort per dict
+app.json.compact = True
+app.json.sort_keys = False
 
 
 # 🔥 ENHANCED CORS Configuration
@@ -24,466 +69,954 @@ CORS(app,
      supports_credentials=False)
 
 
+@app.before_request
+def start_request_spans():
+    begin_spans()
+
+
 # Additional CORS headers for all responses
 @app.after_request
 def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-API-Key'
+    response.headers['Access-Control-Expose-Headers'] = 'Retry-After, X-Cache, ETag'
+    REQUESTS.inc(endpoint=request.endpoint or "unknown", status=response.status_code)
+
+    spans = end_spans()
+    if spans:
+        response.headers['Server-Timing'] = server_timing(spans)
+    peak = end_memory()
+    if peak:
+        response.headers['X-Peak-Memory'] = str(peak)
+    return response
+
+
+# Registered after add_cors_headers, so it runs first: the 304 is what gets counted
+@app.after_request
+def encode_response(response):
+    """ETag and conditional GET, then gzip/brotli per Accept-Encoding (http_encoding)."""
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+        return response
+
+    body = response.get_data()
+    if request.method == 'GET':
+        response.set_etag(content_etag(body), weak=True)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    if 'Content-Encoding' in response.headers or not compressible(response.mimetype, len(body)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        with stage("compress"):
+            response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
     return response
 
 
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB
 
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 50))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+PREPROCESS_PROCESSES = int(os.getenv("PREPROCESS_PROCESSES", os.cpu_count() or 2))
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+# One pooled connection per thread that can be waiting on the model at once:
+# batch pool + async job workers + request threads (gunicorn --threads)
+HTTP_POOL_SIZE = int(os.getenv(
+    "HTTP_POOL_SIZE",
+    BATCH_CONCURRENCY + int(os.getenv("JOB_WORKERS", 2)) + int(os.getenv("WEB_THREADS", 4)),
+))
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", 60))
 
 
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
-def allowed_file(filename: str) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Built on first use rather than at import: the openai package is the bulk of
+# import time, and under gunicorn --preload each worker must own its
+# connection pool. Benchmarks assign a stub here directly.
+openai_client = None
+_openai_client_lock = threading.Lock()
 
+# AsyncOpenAI client, created by asgi.py when serving under an event loop
+async_openai_client = None
 
 
-def compress_image(image_bytes: bytes, max_size_mb: int = 4) -> bytes:
-    """Compress image if it's too large for the API"""
-    max_size_bytes = max_size_mb * 1024 * 1024
+def get_openai_client():
+    global openai_client
+    with _openai_client_lock:
+        if openai_client is None:
+            from openai import OpenAI
+            openai_client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=make_openai_http_client(HTTP_POOL_SIZE, MODEL_TIMEOUT_SECONDS),
+                # Retries are handled by transport.Guard so they share one deadline
+                max_retries=0,
+            )
+    return openai_client
 
 
-    if len(image_bytes) <= max_size_bytes:
-        return image_bytes
+# Provider set comes from VISION_BACKENDS; the getters let benchmarks swap clients
+vision_router = build_router(get_openai_client, OPENAI_MODEL, lambda: async_openai_client)
 
 
-    print(f"⚠️ Image too large ({len(image_bytes)/1024/1024:.1f}MB), compressing...")
+# Active prompt (PROMPT_VERSION / IMAGE_DETAIL); its tag keys the cache
+ANALYSIS_PROMPT = get_prompt()
+PROMPT_VERSION = ANALYSIS_PROMPT.tag
 
+# Ask the model again for only the sections a truncated/invalid reply lacked
+ANALYSIS_REASK = os.getenv("ANALYSIS_REASK", "1") == "1"
 
-    img = Image.open(io.BytesIO(image_bytes))
 
+analysis_cache = AnalysisCache.from_env()
 
-    # Convert to RGB if image has alpha / palette
-    if img.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', img.size, (255, 255, 255))
-        background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-        img = background
 
+# Every served result is kept for listing and venue comparisons (HISTORY_DB)
+history = HistoryStore.from_env()
 
-    # Resize if very large
-    max_dimension = 1920
-    if max(img.size) > max_dimension:
-        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
 
+# Near-duplicate reuse: "seed" still calls the model but quotes a visually
+# similar photo's scores, "reuse" returns its cached analysis (minus what
+# depends on where things are in the frame), "off"
+NEAR_DUP_MODE = os.getenv("NEAR_DUP_MODE", "seed")
+similar_images = None if NEAR_DUP_MODE == "off" else HashIndex(
+    max_distance=int(os.getenv("NEAR_DUP_MAX_DISTANCE", 6)),
+    dhash_distance=int(os.getenv("NEAR_DUP_DHASH_DISTANCE", 12)),
+    max_entries=int(os.getenv("NEAR_DUP_MAX_ENTRIES", 100_000)),
+)
 
-    output = io.BytesIO()
-    quality = 85
 
+# Local pixel metrics: back-fill missing scores (LOCAL_METRICS) and quote
+# them to the model as grounding hints (LOCAL_METRICS_HINTS)
+LOCAL_METRICS = os.getenv("LOCAL_METRICS", "1") == "1"
+LOCAL_METRICS_HINTS = LOCAL_METRICS and os.getenv("LOCAL_METRICS_HINTS", "1") == "1"
 
-    while quality > 20:
-        output.seek(0)
-        output.truncate()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
 
+# Per-tenant token/cost accounting (USAGE_DB) and spend budgets (BUDGET_*);
+# /admin/usage reports them when ADMIN_TOKEN is set
+usage_ledger = UsageLedger.from_env()
+budgets = Budgets.from_env(usage_ledger, LOCAL_METRICS) if usage_ledger is not None else None
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-        if output.tell() <= max_size_bytes:
-            print(f"✅ Compressed to {output.tell()/1024/1024:.1f}MB (quality: {quality})")
-            return output.getvalue()
 
+# Per-client rate limits and the global model-call cap (ADMISSION_*)
+admission = AdmissionController.from_env(default_concurrency=HTTP_POOL_SIZE)
+REGISTRY.gauge("neurospace_admission_queued", "Requests waiting for a model slot in this process",
+               lambda: admission.stats()["queued"])
+ADMISSION_TRUST_PROXY = os.getenv("ADMISSION_TRUST_PROXY", "0") == "1"
 
-        quality -= 10
-
-
-    return output.getvalue()
-
-
-
-NEURO_ANALYSIS_PROMPT = """
-You are Dr. Maya Chen, a neuro-aesthetic consultant who has worked with 200+ restaurants generating $50M+ in revenue optimization through design psychology.
-
-
-Analyze this restaurant interior with surgical precision. Focus on SPECIFIC visual elements you can see, not generic statements.
-
-
-CRITICAL INSTRUCTIONS:
-- BE BRUTALLY SPECIFIC about what you see in the image (exact colors, materials, layout)
-- QUANTIFY business impact with realistic dollar amounts and percentages
-- IDENTIFY 3-5 specific objects/areas in the image with their approximate positions
-- AVOID generic statements like "warm atmosphere" - instead say "2700K Edison bulbs creating amber glow reducing cortisol 18%"
-- Every score must be justified by something VISIBLE in the image
-
-
-Return ONLY valid JSON (no markdown, no explanations outside JSON):
-
-
-{
-  "scores": {
-    "overall": <number 60-95, be critical - few restaurants score above 85>,
-    "saliency": <number 50-100>,
-    "biophilia": <number 10-90>,
-    "warmth": <number 40-95>,
-    "social": <number 50-90>,
-    "clutter": <number 30-95 where higher = more cluttered>
-  },
-  "neuroMetrics": [
-    {
-      "id": 1,
-      "title": "Dopamine & Appetite Stimulation",
-      "score": <number 3.0-9.8 with one decimal - be honest, not all restaurants are 9+>,
-      "drivers": [
-        "<SPECIFIC element you see: 'Crimson velvet chairs' not 'red seating'>",
-        "<Another SPECIFIC element with color/material/pattern>",
-        "<Third SPECIFIC element>"
-      ],
-      "neuralImpact": "Activation of <specific brain region> via <specific mechanism>. <Scientific finding>.",
-      "businessEffect": "Increases <specific metric> by <realistic %>. Estimated <dollar amount> per table or <conversion rate>%.",
-      "tag": "<Only if exceptional: 'High upsell potential' / 'Critical revenue driver' or null>"
-    },
-    {
-      "id": 2,
-      "title": "Stress Reduction & Emotional Safety",
-      "score": <number 3.0-9.8>,
-      "drivers": ["<SPECIFIC color with Kelvin temp or Pantone>", "<SPECIFIC material texture>", "<SPECIFIC lighting detail>"],
-      "neuralImpact": "Parasympathetic nervous system activation through <specific visual cue>. Cortisol reduction via <mechanism>.",
-      "businessEffect": "Extends dwell time by <realistic minutes>. Customers order <number> more items/rounds. +$<amount> per visit.",
-      "tag": null
-    },
-    {
-      "id": 3,
-      "title": "Perceived Food Quality Enhancement",
-      "score": <number>,
-      "drivers": ["<SPECIFIC lighting type and placement>", "<SPECIFIC surface finish>", "<SPECIFIC reflectance property>"],
-      "neuralImpact": "Gustatory cortex priming through visual contrast. <Color temperature> light makes food appear <percentage>% fresher.",
-      "businessEffect": "Reduces food complaints by <percentage>%. Review scores increase by <rating points>. Repeat visits +<percentage>%.",
-      "tag": null
-    },
-    {
-      "id": 4,
-      "title": "Dwell Time & Seating Comfort",
-      "score": <number>,
-      "drivers": ["<SPECIFIC seating style and ergonomics>", "<SPECIFIC spacing measurement>", "<SPECIFIC back support detail>"],
-      "neuralImpact": "Proprioceptive comfort signals reduce unconscious exit cues. Booth depth of <measurement> optimizes stay duration.",
-      "businessEffect": "Average table time increases by <minutes>. Second round orders +<percentage>%. Revenue per seat hour: +$<amount>.",
-      "tag": "<if booth/premium seating: 'Strong per-table revenue'>"
-    },
-    {
-      "id": 5,
-      "title": "Cognitive Load & Decision Ease",
-      "score": <number>,
-      "drivers": ["<SPECIFIC wall treatment>", "<SPECIFIC visual hierarchy element>", "<SPECIFIC signage/menu visibility>"],
-      "neuralImpact": "Prefrontal cortex load reduced by <percentage>% through <specific design principle>. Decision time drops <seconds>.",
-      "businessEffect": "Ordering speed increases <percentage>%. Table turnover improves without rushed feeling. Capacity utilization +<percentage>%.",
-      "tag": null
-    },
-    {
-      "id": 6,
-      "title": "Brand Memory Encoding",
-      "score": <number>,
-      "drivers": ["<SPECIFIC unique design element>", "<SPECIFIC color scheme with hex/Pantone>", "<SPECIFIC architectural feature>"],
-      "neuralImpact": "Hippocampal encoding strength via <distinctive element>. Memory retention after <days> days: <percentage>% vs <percentage>% industry avg.",
-      "businessEffect": "Organic word-of-mouth increases <percentage>%. Return visit rate: <percentage>% vs <percentage>% benchmark. Social sharing +<percentage>%.",
-      "tag": null
-    },
-    {
-      "id": 7,
-      "title": "Social Bonding & Emotional Warmth",
-      "score": <number>,
-      "drivers": ["<SPECIFIC lighting Kelvin temp>", "<SPECIFIC table spacing in feet/cm>", "<SPECIFIC textile material>"],
-      "neuralImpact": "Oxytocin release triggered by <specific sensory input>. Interpersonal connection scores increase <percentage>%.",
-      "businessEffect": "Group dining bookings +<percentage>%. Date night preference rating: <score>/10. Celebration venue selection +<percentage>%.",
-      "tag": null
-    },
-    {
-      "id": 8,
-      "title": "Premium Perception & Willingness to Pay",
-      "score": <number>,
-      "drivers": ["<SPECIFIC material quality indicator>", "<SPECIFIC finish detail>", "<SPECIFIC architectural detail>"],
-      "neuralImpact": "Price justification circuits activated via perceived craftsmanship. Value perception shifts +<percentage>% above actual pricing.",
-      "businessEffect": "Menu prices can be <percentage>% higher without resistance. Premium item conversion: <percentage>%. Wine/cocktail upsells +<percentage>%.",
-      "tag": "<if score > 8.5: 'Premium pricing justified'>"
-    },
-    {
-      "id": 9,
-      "title": "Instagrammability & Share Trigger",
-      "score": <number 4.0-8.5 - be realistic, not everything is Instagram-perfect>,
-      "drivers": ["<SPECIFIC photogenic element>", "<SPECIFIC lighting quality for cameras>", "<SPECIFIC background aesthetic>"],
-      "neuralImpact": "Social validation dopamine loop activation. Identity signaling strength: <rating>. Shareability index: <percentage>%.",
-      "businessEffect": "Organic social posts: <number> per month. Marketing value: $<amount>/month. New customer acquisition via social: <percentage>%.",
-      "tag": null
-    }
-  ],
-  "metrics": [
-    {"subject": "Biophilia", "A": <realistic current 10-80>, "B": 85, "fullMark": 100},
-    {"subject": "Warmth", "A": <realistic current>, "B": 90, "fullMark": 100},
-    {"subject": "Social Layout", "A": <realistic current>, "B": 80, "fullMark": 100},
-    {"subject": "Lighting", "A": <realistic current>, "B": 95, "fullMark": 100},
-    {"subject": "Cleanliness", "A": <realistic current>, "B": 90, "fullMark": 100},
-    {"subject": "Acoustics", "A": <estimated from visual cues>, "B": 75, "fullMark": 100}
-  ],
-  "insights": [
-    {
-      "type": "critical",
-      "title": "<SPECIFIC critical issue you can see>",
-      "desc": "<Detailed explanation with visual evidence from image>. Recommend: <specific solution with material/color/placement>.",
-      "impact": "-$<realistic amount> per table OR -<minutes> Dwell Time"
-    },
-    {
-      "type": "warning",
-      "title": "<SPECIFIC moderate issue>",
-      "desc": "<What you see and why it matters>. Quick fix: <actionable suggestion>.",
-      "impact": "-<percentage>% satisfaction OR -$<amount> Avg Check"
-    },
-    {
-      "type": "success",
-      "title": "<SPECIFIC strong element you can see>",
-      "desc": "<What they're doing right and why it works>. This is <benchmark comparison>.",
-      "impact": "+$<amount> revenue driver OR +<percentage>% conversion"
-    }
-  ],
-  "financials": {
-    "currentDwell": <realistic 25-90 minutes based on restaurant type visible>,
-    "predictedDwell": <current + realistic improvement 5-20 min>,
-    "currentSpend": <realistic based on visible ambiance quality: $15-150>,
-    "predictedSpend": <current + realistic improvement 10-30%>,
-    "monthlyRevenueUplift": <realistic calculation: (predictedSpend - currentSpend) × avg daily covers × 30>
-  },
-  "objects": [
-    {
-      "label": "<SPECIFIC object you can see: 'Brass pendant lights' not 'lighting'>",
-      "x": <percentage 0-100 from left edge>,
-      "y": <percentage 0-100 from top edge>,
-      "width": <percentage width 5-40>,
-      "height": <percentage height 5-40>,
-      "type": "positive"
-    },
-    {
-      "label": "<SPECIFIC problem element: 'Cluttered service station' not 'clutter'>",
-      "x": <percentage>,
-      "y": <percentage>,
-      "width": <percentage>,
-      "height": <percentage>,
-      "type": "negative"
-    }
-  ]
-}
+
+# Concurrent uploads of the same image share one model call (COALESCE_*);
+# followers wait at most about as long as the leader's call can take
+analysis_flights = SingleFlight.from_env(default_wait=MODEL_TIMEOUT_SECONDS * 3) \
+    if os.getenv("COALESCE", "1") == "1" else None
+REGISTRY.gauge("neurospace_analyses_in_flight", "Distinct analyses in progress in this process",
+               lambda: analysis_flights.stats()["inFlight"] if analysis_flights is not None else 0)
 
 
-ANALYSIS CHECKLIST - Mention in your analysis:
-✓ Exact color temperatures (e.g., 2700K vs 4000K)
-✓ Specific materials (velvet, brass, reclaimed wood, terrazzo, etc.)
-✓ Measurable spacing (table distance, ceiling height if visible)
-✓ Lighting layers (ambient, task, accent - be specific about sources)
-✓ Sight lines and privacy levels
-✓ Traffic flow observations
-✓ Surface textures and finishes
-✓ Biophilic elements count (plants, natural materials, natural light)
-✓ Color psychology with specific hues
-✓ Realistic financial projections based on visible quality tier
-
-
-Remember: Restaurant owners want ACTIONABLE INSIGHTS with MEASURABLE IMPACT, not academic theory.
-"""
-
-
-
-def analyze_image_with_openai(image_bytes: bytes) -> dict:
-    """Call OpenAI vision model and return parsed JSON."""
-    image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-
-
-    response = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        response_format={"type": "json_object"},
-        messages=[
-            {
-                "role": "system",
-                "content": NEURO_ANALYSIS_PROMPT,
-            },
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Analyze this restaurant interior strictly using the schema.",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"},
-                    },
-                ],
-            },
-        ],
-        temperature=0.6,
-        max_tokens=3500,
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'm4v', 'webm', 'mkv'}
+
+
+# Walkthrough videos: keyframe sampling limits (VIDEO_*)
+video_sampler = KeyframeSampler.from_env()
+
+
+
+def allowed_file(filename: str, extensions: set = ALLOWED_EXTENSIONS) -> bool:
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+
+
+def compress_image(upload, max_size_mb: int = 4) -> bytes:
+    """Downsample and re-encode an upload (bytes or spooled file) to what the vision model needs"""
+    output, info = preprocess_image(upload, max_size_mb=max_size_mb, detail=ANALYSIS_PROMPT.detail)
+    record_preprocess(info)
+    return output
+
+
+
+def record_preprocess(info: dict) -> None:
+    """Feed preprocess_image() stage timings and payload sizes into metrics."""
+    t = info["timings"]
+    observe_stage("preprocess", t["total_ms"] / 1000)
+    for name in ("decode", "resize", "encode"):
+        observe_stage(f"preprocess_{name}", t[f"{name}_ms"] / 1000)
+    PAYLOAD_BYTES.observe(info["inputBytes"], kind="original")
+    PAYLOAD_BYTES.observe(info["outputBytes"], kind="compressed")
+    note_memory(info["peakBytes"])
+    log_event(
+        logging.INFO, "image preprocessed",
+        source=info["sourceSize"], output=info["outputSize"],
+        input_bytes=info["inputBytes"], output_bytes=info["outputBytes"], peak_bytes=info["peakBytes"], **t,
     )
 
 
-    raw = response.choices[0].message.content
-    print("🔍 RAW OPENAI OUTPUT (truncated):\n", raw[:1200])
 
+def record_usage(usage: dict, backend: str = "openai", latency: float = 0.0, estimated: bool = False) -> None:
+    """Record prompt/completion token counts reported by a backend, and charge
+    them to the tenant the call is attributed to (budgets.attribute).
+
+    estimated usage (a cancelled hedge loser's) is charged but kept out of
+    the token histograms, which describe what backends actually report.
+    """
+    if not usage:
+        return
+    if not estimated:
+        TOKENS.observe(usage["prompt_tokens"], kind="prompt")
+        TOKENS.observe(usage["completion_tokens"], kind="completion")
+    cost = None
+    if budgets is not None:
+        model = next((b.model for b in vision_router.backends if b.name == backend), backend)
+        cost = budgets.charge(model, usage, latency * 1000)
+    log_event(logging.INFO, "model usage", backend=backend, cost_usd=cost, estimated=estimated, **usage)
+
+
+
+def record_discarded(reply, estimated: bool) -> None:
+    """Charge a losing hedged call: the provider bills it even though its reply is unused."""
+    record_usage(reply.usage, reply.backend, reply.latency, estimated)
+
+
+vision_router.on_discarded = record_discarded
+
+
+
+def parse_reply(reply) -> tuple:
+    """Record usage for a BackendReply and parse its text. Returns (analysis, repaired)."""
+    record_usage(reply.usage, reply.backend, reply.latency)
+
+    raw = reply.text
+    if log.isEnabledFor(logging.DEBUG):
+        log_event(logging.DEBUG, "raw model output", raw=raw[:1200])
+
+    with stage("json_parse"):
+        analysis, repaired = repair_json(raw)
+    if repaired:
+        VALIDATION_OUTCOMES.inc(outcome="repaired")
+        log_event(logging.WARNING, "repaired malformed model output", backend=reply.backend, chars=len(raw))
+    return analysis, repaired
+
+
+
+def plan_reask(analysis) -> tuple:
+    """(gaps, prompt) for re-asking only what the reply lacked, or (None, None)."""
+    if not ANALYSIS_REASK:
+        return None, None
+    gaps = find_gaps(analysis)
+    if not gaps["sections"]:
+        return None, None
+
+    known = None
+    if "scores" not in gaps["sections"]:
+        known = {"scores": validate_section("scores", analysis["scores"])}
+    return gaps, reask_prompt(ANALYSIS_PROMPT, gaps["sections"], gaps["cardIds"], known)
+
+
+
+def apply_reask(analysis: dict, gaps: dict, reply, notes: dict) -> dict:
+    """Merge a re-ask reply's sections into analysis."""
+    extra, _ = parse_reply(reply)
+    VALIDATION_OUTCOMES.inc(outcome="reasked")
+    log_event(logging.INFO, "re-asked for missing sections", sections=gaps["sections"],
+              card_ids=gaps["cardIds"])
+    notes["reasked"] = gaps["sections"]
+    return merge_sections(analysis, extra, gaps)
+
+
+
+def fill_gaps(image_bytes: bytes, analysis, notes: dict):
+    """Targeted re-ask for missing sections; on failure the validator's defaults stand."""
+    gaps, prompt = plan_reask(analysis)
+    if gaps is None:
+        return analysis
 
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
-        cleaned = raw.strip()
-        if cleaned.startswith("```"):
-            cleaned = re.sub(r"^```(?:json)?", "", cleaned)
-            cleaned = re.sub(r"```$", "", cleaned)
-        return json.loads(cleaned)
+        with stage("model_reask"):
+            reply = vision_router.complete(image_bytes, prompt)
+        return apply_reask(analysis, gaps, reply, notes)
+    except Exception as e:
+        log.exception("re-ask for missing sections failed",
+                      extra={"fields": {"sections": gaps["sections"], "error": type(e).__name__}})
+        return analysis
 
 
 
-def transform_for_frontend(analysis_data: dict) -> dict:
-    """Transform OpenAI response to match frontend expectations"""
-    icon_map = {
-        1: "Utensils", 2: "Heart", 3: "Sparkles", 4: "Armchair",
-        5: "Zap", 6: "Target", 7: "Users", 8: "Award", 9: "Share2"
-    }
+def analyze_image(image_bytes: bytes, prompt=None, reask: bool = True) -> tuple:
+    """Run the vision model (via the backend router). Returns (parsed JSON, notes)."""
+    note_memory(request_footprint(image_bytes))
+    with stage("model_call"):
+        reply = vision_router.complete(image_bytes, prompt or ANALYSIS_PROMPT)
+
+    analysis, repaired = parse_reply(reply)
+    notes = {"repaired": repaired}
+    if not reask:
+        return analysis, notes
+    return fill_gaps(image_bytes, analysis, notes), notes
+
+
+
+def stream_image(image_bytes: bytes, prompt=None):
+    """Stream the vision model's reply (via the backend router) and yield content deltas."""
+    note_memory(request_footprint(image_bytes))
+    prompt = prompt or ANALYSIS_PROMPT
+    start = time.perf_counter()
+
+    first = True
+    for delta in vision_router.stream(image_bytes, prompt, on_usage=record_usage):
+        if first:
+            observe_stage("model_first_token", time.perf_counter() - start)
+            first = False
+        yield delta
+
+    observe_stage("model_call", time.perf_counter() - start)
+
+
+
+ICON_MAP = {
+    1: "Utensils", 2: "Heart", 3: "Sparkles", 4: "Armchair",
+    5: "Zap", 6: "Target", 7: "Users", 8: "Award", 9: "Share2"
+}
+
+
+COLOR_MAP = {
+    1: "bg-orange-500", 2: "bg-teal-500", 3: "bg-amber-500",
+    4: "bg-indigo-500", 5: "bg-blue-500", 6: "bg-purple-500",
+    7: "bg-rose-500", 8: "bg-emerald-500", 9: "bg-pink-500"
+}
+
+
+# Static ideal image for now (frontend expects this)
+IDEAL_IMAGE_URL = (
+    "https://images.unsplash.com/photo-1559339352-11d035aa65de"
+    "?q=80&w=1000&auto=format&fit=crop"
+)
+
+
+DEFAULT_ICON = "Sparkles"
+DEFAULT_COLOR = "bg-slate-500"
+
+
+# Icons, colors and idealImage are the same for every analysis, so they are
+# served once by /meta; INLINE_DECORATIONS=1 also repeats them in each result
+# for clients that predate /meta
+INLINE_DECORATIONS = os.getenv("INLINE_DECORATIONS", "0") == "1"
+META_MAX_AGE = int(os.getenv("META_MAX_AGE", 3600))
 
 
-    color_map = {
-        1: "bg-orange-500", 2: "bg-teal-500", 3: "bg-amber-500",
-        4: "bg-indigo-500", 5: "bg-blue-500", 6: "bg-purple-500",
-        7: "bg-rose-500", 8: "bg-emerald-500", 9: "bg-pink-500"
+
+def decorate_neuro_metric(metric: dict) -> dict:
+    """Attach the frontend icon and color for a neuroMetrics card."""
+    mid = metric.get('id')
+    metric['icon'] = ICON_MAP.get(mid, DEFAULT_ICON)
+    metric['color'] = COLOR_MAP.get(mid, DEFAULT_COLOR)
+    return metric
+
+
+
+def frontend_meta() -> dict:
+    """Static presentation data for every analysis, served by /meta."""
+    return {
+        "promptVersion": PROMPT_VERSION,
+        "icons": {str(mid): icon for mid, icon in ICON_MAP.items()},
+        "colors": {str(mid): color for mid, color in COLOR_MAP.items()},
+        "defaultIcon": DEFAULT_ICON,
+        "defaultColor": DEFAULT_COLOR,
+        "idealImage": IDEAL_IMAGE_URL,
     }
 
 
-    if 'neuroMetrics' in analysis_data:
-        for metric in analysis_data['neuroMetrics']:
-            mid = metric.get('id')
-            metric['icon'] = icon_map.get(mid, "Sparkles")
-            metric['color'] = color_map.get(mid, "bg-slate-500")
 
+def transform_for_frontend(analysis_data: dict, validation: dict = None, measured: dict = None) -> dict:
+    """Transform OpenAI response to match frontend expectations"""
+    if INLINE_DECORATIONS:
+        for metric in analysis_data.get('neuroMetrics') or []:
+            decorate_neuro_metric(metric)
+        analysis_data['idealImage'] = IDEAL_IMAGE_URL
 
-    # Static ideal image for now (frontend expects this)
-    analysis_data['idealImage'] = (
-        "https://images.unsplash.com/photo-1559339352-11d035aa65de"
-        "?q=80&w=1000&auto=format&fit=crop"
-    )
+    analysis_data['meta'] = {"promptVersion": PROMPT_VERSION}
+    if validation:
+        analysis_data['meta']['validation'] = validation
+    if measured:
+        analysis_data['localMetrics'] = measured
 
 
     return analysis_data
 
 
 
-def normalize_analysis(analysis: dict) -> dict:
-    """Ensure the JSON has all fields the frontend expects."""
-    if analysis is None:
-        analysis = {}
+def normalize_scores(scores: dict) -> dict:
+    return validate_section("scores", scores)
 
 
-    # --- Scores ---
-    scores = analysis.get("scores") or {}
-    analysis["scores"] = {
-        "overall": scores.get("overall", 75),
-        "saliency": scores.get("saliency", 65),
-        "biophilia": scores.get("biophilia", 40),
-        "warmth": scores.get("warmth", 60),
-        "social": scores.get("social", 55),
-        "clutter": scores.get("clutter", 50),
-    }
 
+def normalize_financials(fin: dict) -> dict:
+    return validate_section("financials", fin)
+
+
+
+def normalize_neuro_metric(m: dict, next_id: int, overall: float) -> dict:
+    return validate_card(m, next_id, overall)
+
+
+
+def fallback_fields(analysis: dict) -> list:
+    """Fields normalize_analysis would have to fill with defaults for this output."""
+    return validate_analysis(analysis)[1].defaulted
+
+
+
+def normalize_analysis(analysis: dict, notes: dict = None, measured: dict = None) -> tuple:
+    """Validate against the response schema. Returns (analysis, validation meta).
+
+    The meta lists every field that was defaulted, clamped or dropped (and
+    which defaults came from local measurements), plus whether the JSON
+    itself needed repair or a re-ask; it is empty for a clean reply.
+    """
+    analysis, report = validate_analysis(analysis, measured["scores"] if measured else None)
+    validation = {k: v for k, v in report.as_meta().items() if v}
+    validation.update({k: v for k, v in (notes or {}).items() if v})
+    if validation:
+        log_event(logging.INFO, "analysis validated with fixes", **{k: len(v) if isinstance(v, list) else v
+                                                                    for k, v in validation.items()})
+    return analysis, validation
+
+
+
+def aggregate_venue(results: list) -> dict:
+    """Combine per-image analyses into one venue-level summary."""
+    if not results:
+        return {"images": 0}
+
+    def mean(values):
+        values = [v for v in values if isinstance(v, (int, float))]
+        return round(sum(values) / len(values), 1) if values else None
+
+    score_keys = ["overall", "saliency", "biophilia", "warmth", "social", "clutter"]
+    scores = {k: mean([r["scores"].get(k) for r in results]) for k in score_keys}
+
+    fin_keys = ["currentDwell", "predictedDwell", "currentSpend", "predictedSpend", "monthlyRevenueUplift"]
+    financials = {k: mean([r["financials"].get(k) for r in results]) for k in fin_keys}
+
+    by_metric = {}
+    for r in results:
+        for m in r.get("neuroMetrics", []):
+            entry = by_metric.setdefault(m["id"], {"id": m["id"], "title": m["title"], "scores": []})
+            entry["scores"].append(m["score"])
 
-    # --- Financials ---
-    fin = analysis.get("financials") or {}
-    analysis["financials"] = {
-        "currentDwell": fin.get("currentDwell", 45),
-        "predictedDwell": fin.get("predictedDwell", 60),
-        "currentSpend": fin.get("currentSpend", 30),
-        "predictedSpend": fin.get("predictedSpend", 36),
-        "monthlyRevenueUplift": fin.get("monthlyRevenueUplift", 5000),
+    neuro = [
+        {"id": e["id"], "title": e["title"], "score": mean(e["scores"]), "images": len(e["scores"])}
+        for e in sorted(by_metric.values(), key=lambda e: e["id"])
+    ]
+
+    overall = [r["scores"].get("overall") for r in results]
+    return {
+        "images": len(results),
+        "scores": scores,
+        "overallRange": {"min": min(overall), "max": max(overall)},
+        "financials": financials,
+        "neuroMetrics": neuro,
     }
 
 
-    # --- Metrics for radar chart ---
-    if not analysis.get("metrics"):
-        s = analysis["scores"]
-        analysis["metrics"] = [
-            {"subject": "Biophilia", "A": s["biophilia"], "B": 85, "fullMark": 100},
-            {"subject": "Warmth", "A": s["warmth"], "B": 90, "fullMark": 100},
-            {"subject": "Social Layout", "A": s["social"], "B": 80, "fullMark": 100},
-            {"subject": "Lighting", "A": 75, "B": 95, "fullMark": 100},
-            {"subject": "Cleanliness", "A": 70, "B": 90, "fullMark": 100},
-            {"subject": "Acoustics", "A": 65, "B": 75, "fullMark": 100},
-        ]
+
+def analysis_key(image_bytes: bytes, mode: str = "full") -> str:
+    """Cache and coalescing key: the compressed bytes, prompt version and model,
+    plus the budget mode for degraded (economy) analyses."""
+    prompt_version = PROMPT_VERSION if mode == "full" else f"{PROMPT_VERSION}+{mode}"
+    return content_key(image_bytes, prompt_version, vision_router.tag)
+
+
+
+def cache_lookup(image_bytes: bytes, key: str = None) -> tuple:
+    """Return (cache_key, cached_result_or_None) for compressed bytes."""
+    key = key or analysis_key(image_bytes)
+    cached = analysis_cache.get(key)
+    CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    if cached is not None:
+        log_event(logging.INFO, "cache hit, skipping model call", key=key)
+    return key, cached
+
+
+
+def perceptual_hashes(image_bytes: bytes):
+    """(phash, dhash) for the near-duplicate index, or None when it is off."""
+    if similar_images is None:
+        return None
+    with stage("phash"):
+        return image_hashes(image_bytes)
 
 
-    # --- Neuro Metrics (cards) ---
-    neuro = analysis.get("neuroMetrics") or []
-    cleaned = []
-    next_id = 1
 
+def near_duplicate(hashes):
+    """(cached result, distance) for a visually similar analyzed image, or None."""
+    if hashes is None:
+        return None
+    found = similar_images.nearest(*hashes)
+    if found is None:
+        return None
 
-    for m in neuro:
-        cleaned.append({
-            "id": m.get("id", next_id),
-            "title": m.get("title", f"Metric {next_id}"),
-            "score": m.get("score", round(analysis["scores"]["overall"] / 10, 1)),
-            "drivers": m.get("drivers", []),
-            "neuralImpact": m.get("neuralImpact", ""),
-            "businessEffect": m.get("businessEffect", ""),
-            "tag": m.get("tag"),
-        })
-        next_id += 1
+    key, distance = found
+    # Not a lookup for this image, so it stays out of the hit/miss stats
+    prior = analysis_cache.peek(key)
+    if prior is None:
+        # The analysis was evicted from the cache; stop matching against it
+        similar_images.discard(key)
+        return None
+    log_event(logging.INFO, "near-duplicate of an analyzed image", key=key, distance=distance,
+              mode=NEAR_DUP_MODE)
+    return prior, distance
 
 
-    # If model gave nothing at all, make at least 2 cards
-    if not cleaned:
-        overall_10 = round(analysis["scores"]["overall"] / 10, 1)
-        cleaned = [
-            {
-                "id": 1,
-                "title": "Dopamine & Appetite Stimulation",
-                "score": overall_10,
-                "drivers": ["High color contrast", "Strong focal points", "Food-centric visuals"],
-                "neuralImpact": "Increased activation of reward pathways via saturated colors and appetitive cues.",
-                "businessEffect": "Higher appetizer and dessert conversion and impulse ordering.",
-                "tag": "High upsell potential",
-            },
-            {
-                "id": 2,
-                "title": "Stress Reduction & Emotional Safety",
-                "score": 7.0,
-                "drivers": ["Soft seating", "Indirect lighting", "Enclosed booth areas"],
-                "neuralImpact": "Parasympathetic activation via soft textures and reduced visual threat.",
-                "businessEffect": "Longer dwell time and higher likelihood of second rounds.",
-                "tag": None,
-            },
-        ]
 
+NEAR_DUP_POSITIONAL = ("objects", "localMetrics")
 
-    analysis["neuroMetrics"] = cleaned
 
+def reuse_near_duplicate(key: str, hashes: tuple, prior: dict, distance: int) -> dict:
+    """Serve a near-duplicate's analysis for this image and cache it under key.
+
+    Object boxes and pixel measurements describe the other photo's framing,
+    so they are dropped rather than passed off as this image's.
+    """
+    CACHE_LOOKUPS.inc(result="near")
+    prior['objects'] = []
+    prior.pop('localMetrics', None)
+    prior['meta'] = dict(prior.get('meta') or {},
+                         nearDuplicate={"distance": distance, "dropped": list(NEAR_DUP_POSITIONAL)})
+    analysis_cache.set(key, prior)
+    similar_images.add(*hashes, key)
+    return prior
+
+
+
+def measure_locally(image_bytes: bytes):
+    """Local pixel metrics (local_metrics.measure_image), or None when off or undecodable."""
+    if not LOCAL_METRICS:
+        return None
+    from local_metrics import measure_image
+
+    try:
+        with stage("local_metrics"):
+            return measure_image(image_bytes)
+    except Exception as e:
+        log_event(logging.WARNING, "local metrics failed", error=str(e), type=type(e).__name__)
+        return None
+
+
+
+def seeded_prompt(match, measured: dict = None):
+    """The analysis prompt, quoting a near-duplicate's scores in seed mode and
+    the local measurements when LOCAL_METRICS_HINTS is on."""
+    prompt = ANALYSIS_PROMPT
+    if match is not None and NEAR_DUP_MODE == "seed":
+        prompt = prompt.with_reference(match[0]["scores"])
+    if measured is not None and LOCAL_METRICS_HINTS:
+        from local_metrics import prompt_hints
+        prompt = prompt.with_hints(prompt_hints(measured))
+    return prompt
 
-    # Ensure insights & objects exist
-    if "insights" not in analysis or not isinstance(analysis["insights"], list):
-        analysis["insights"] = []
 
 
-    if "objects" not in analysis or not isinstance(analysis["objects"], list):
-        analysis["objects"] = []
+def finish_analysis(key: str, analysis: dict, notes: dict = None, hashes: tuple = None,
+                    measured: dict = None) -> dict:
+    """Normalize and transform a parsed model reply, then cache it under key."""
+    with stage("normalize"):
+        analysis, validation = normalize_analysis(analysis, notes, measured)
 
+    with stage("transform"):
+        result = transform_for_frontend(analysis, validation, measured)
 
-    return analysis
+    analysis_cache.set(key, result)
+    if hashes is not None:
+        similar_images.add(*hashes, key)
+    return result
+
+
+
+def budget_mode(client: str) -> str:
+    """Budget mode ("full", "economy" or "local") for client's next analysis.
+
+    Raises BudgetExceeded when the client is over budget and local scoring
+    is off. Without budgets, or for internal calls without a client, "full".
+    """
+    if budgets is None or client is None:
+        return "full"
+    return budgets.mode(client)
+
+
+
+def analyze_compressed(image_bytes: bytes, client: str = None, background: bool = False) -> tuple:
+    """Analyze already-compressed bytes. Returns (result, cache_hit).
+
+    Cache misses take one of admission's model slots for the client. An upload
+    identical to one already being analyzed waits for that analysis instead
+    (without a slot) and counts as a hit. Clients near or over their spend
+    budget get a cheaper analysis (budget_mode).
+    """
+    mode = budget_mode(client)
+    if mode == "local":
+        return analyze_locally(image_bytes)
+    if analysis_flights is None:
+        return analyze_uncoalesced(image_bytes, analysis_key(image_bytes, mode), client, background, mode)
+
+    key = analysis_key(image_bytes, mode)
+    (result, cache_hit), coalesced = analysis_flights.do(
+        key, lambda: analyze_uncoalesced(image_bytes, key, client, background, mode))
+    if coalesced:
+        log_event(logging.INFO, "joined an in-flight analysis of the same image", key=key)
+    return result, cache_hit or coalesced
+
+
+
+def analyze_uncoalesced(image_bytes: bytes, key: str = None, client: str = None,
+                        background: bool = False, mode: str = "full") -> tuple:
+    """analyze_compressed without the in-flight check."""
+    key, cached = cache_lookup(image_bytes, key)
+    if cached is None and mode != "full":
+        # A full analysis of the same image is better and free
+        cached = analysis_cache.get(analysis_key(image_bytes))
+    if cached is not None:
+        return cached, True
+
+    hashes = perceptual_hashes(image_bytes)
+    match = near_duplicate(hashes)
+    if match is not None and NEAR_DUP_MODE == "reuse":
+        return reuse_near_duplicate(key, hashes, *match), True
+
+    measured = measure_locally(image_bytes)
+    prompt = seeded_prompt(match, measured)
+    if mode != "full":
+        prompt = budgets.degrade(prompt, mode)
+    with admission.slot(client, background), attribute(client or "internal", mode):
+        # Economy skips re-asks: the validator's defaults fill any gaps instead
+        analysis, notes = analyze_image(image_bytes, prompt, reask=mode == "full")
+    if mode != "full":
+        notes["budgetMode"] = mode
+        # Keep degraded results out of the near-duplicate index that full analyses reuse
+        hashes = None
+    return finish_analysis(key, analysis, notes, hashes, measured), False
+
+
+
+def analyze_locally(image_bytes: bytes) -> tuple:
+    """Budget "local" mode: a cached full analysis if there is one, else an
+    analysis scored from local pixel metrics alone. Never calls the model."""
+    _, cached = cache_lookup(image_bytes)
+    if cached is not None:
+        return cached, True
+
+    measured = measure_locally(image_bytes)
+    if measured is None:
+        raise UnidentifiedImageError("Could not measure image for local-only scoring")
+    with stage("normalize"):
+        analysis, validation = normalize_analysis({}, {"budgetMode": "local"}, measured)
+    log_event(logging.INFO, "served local-only analysis (over budget)")
+    return transform_for_frontend(analysis, validation, measured), False
+
+
+
+def run_analysis(upload, client: str = None, background: bool = False) -> tuple:
+    """Compress, analyze and normalize an upload. Returns (result, cache_hit)."""
+    image_bytes = compress_image(upload, max_size_mb=4)
+    return analyze_compressed(image_bytes, client, background)
+
+
+
+STREAM_ITEM_SECTIONS = ("neuroMetrics", "insights", "objects")
+
+
+def stream_analysis(image_bytes: bytes, client: str = None, mode: str = "full"):
+    """Yield (event, data) pairs as each section of the analysis completes.
+
+    Takes already-compressed bytes. Local metrics, when on, go out first as a
+    'localMetrics' quick score; sections are normalized the same way
+    normalize_analysis would, and a final 'complete' event carries the full
+    result that gets cached. If the same image is already being analyzed
+    elsewhere in this process, its result is waited for and replayed. mode
+    is the client's budget_mode(), decided before the response started.
+    """
+    if mode == "local":
+        cached, _ = analyze_locally(image_bytes)
+        key = None
+    else:
+        key, cached = cache_lookup(image_bytes, analysis_key(image_bytes, mode))
+        if cached is None and mode != "full":
+            cached = analysis_cache.get(analysis_key(image_bytes))
+    if cached is None and analysis_flights is not None:
+        # Replay an identical upload's analysis rather than calling the model twice;
+        # the flight carries analyze_uncoalesced's (result, cache_hit)
+        joined = analysis_flights.wait_for(key)
+        if joined is not None:
+            cached = joined[0]
+    hashes = None
+    if cached is None:
+        hashes = perceptual_hashes(image_bytes)
+        match = near_duplicate(hashes)
+        if match is not None and NEAR_DUP_MODE == "reuse":
+            cached = reuse_near_duplicate(key, hashes, *match)
+    if cached is not None:
+        yield "scores", cached["scores"]
+        for metric in cached["neuroMetrics"]:
+            yield "neuroMetric", metric
+        yield "metrics", cached["metrics"]
+        for insight in cached["insights"]:
+            yield "insight", insight
+        yield "financials", cached["financials"]
+        for obj in cached["objects"]:
+            yield "object", obj
+        yield "complete", cached
+        return
+
+    measured = measure_locally(image_bytes)
+    if measured is not None:
+        yield "localMetrics", measured
+
+    parser = SectionParser(item_sections=STREAM_ITEM_SECTIONS)
+    overall = SCORES.make_default(None, None)["overall"]
+    card_count = 0
+
+    prompt = seeded_prompt(match, measured)
+    if mode != "full":
+        prompt = budgets.degrade(prompt, mode)
+        hashes = None
+
+    with attribute(client or "internal", mode):
+        for delta in stream_image(image_bytes, prompt):
+            for kind, section, value in parser.feed(delta):
+                if kind == "section" and section == "scores" and isinstance(value, dict):
+                    scores = normalize_scores(value)
+                    overall = scores["overall"]
+                    yield "scores", scores
+                elif kind == "item" and section == "neuroMetrics" and isinstance(value, dict):
+                    card_count += 1
+                    metric = normalize_neuro_metric(value, card_count, overall)
+                    yield "neuroMetric", decorate_neuro_metric(metric) if INLINE_DECORATIONS else metric
+                elif kind == "section" and section == "metrics" and isinstance(value, list) and value:
+                    yield "metrics", validate_section("metrics", value)
+                elif kind == "item" and section == "insights" and isinstance(value, dict):
+                    yield "insight", validate_section("insights", [value])[0]
+                elif kind == "section" and section == "financials" and isinstance(value, dict):
+                    yield "financials", normalize_financials(value)
+                elif kind == "item" and section == "objects" and isinstance(value, dict):
+                    yield "object", validate_section("objects", [value])[0]
+
+    with stage("json_parse"):
+        analysis, repaired = repair_json(parser.buf)
+    # Sections are already on the wire, so there is no re-ask here
+    with stage("normalize"):
+        notes = {"repaired": repaired, "budgetMode": mode if mode != "full" else None}
+        analysis, validation = normalize_analysis(analysis, notes, measured)
+    with stage("transform"):
+        result = transform_for_frontend(analysis, validation, measured)
+    analysis_cache.set(key, result)
+    if hashes is not None:
+        similar_images.add(*hashes, key)
+
+    yield "complete", result
+
+
+
+_preprocess_pool = None
+_model_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_batch_pools() -> tuple:
+    """Create the shared preprocessing/model pools on first use (post-fork)."""
+    global _preprocess_pool, _model_pool
+    with _pool_lock:
+        if _preprocess_pool is None:
+            _preprocess_pool = ProcessPoolExecutor(max_workers=PREPROCESS_PROCESSES)
+            _model_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-model")
+    return _preprocess_pool, _model_pool
+
+
+
+def run_batch(uploads, client: str = None):
+    """Yield per-image outcomes in completion order for (filename, bytes) uploads.
+
+    Decoding/compression runs on the process pool and each finished image is
+    handed straight to the model pool, so slow model calls overlap instead of
+    queuing behind each other. uploads may be a lazy iterable (video frames):
+    outcomes are yielded as they finish while it is still being consumed.
+    """
+    preprocess_pool, model_pool = get_batch_pools()
+    done = queue.Queue()
+
+    def on_analyzed(index, filename, future):
+        try:
+            result, cache_hit = future.result()
+            done.put({"type": "result", "index": index, "filename": filename,
+                      "cached": cache_hit, "result": result})
+        except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
+            done.put({"type": "error", "index": index, "filename": filename,
+                      "error": str(e), "errorType": type(e).__name__})
+
+    def on_compressed(index, filename, future):
+        try:
+            compressed, info = future.result()
+            record_preprocess(info)
+        except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
+            done.put({"type": "error", "index": index, "filename": filename,
+                      "error": str(e), "errorType": type(e).__name__})
+            return
+        model_pool.submit(analyze_compressed, compressed, client, True).add_done_callback(
+            lambda f: on_analyzed(index, filename, f)
+        )
+
+    pending = 0
+    for index, (filename, image_bytes) in enumerate(uploads):
+        preprocess_pool.submit(preprocess_image, image_bytes, 4, ANALYSIS_PROMPT.detail).add_done_callback(
+            lambda f, index=index, filename=filename: on_compressed(index, filename, f)
+        )
+        pending += 1
+        while not done.empty():
+            pending -= 1
+            yield done.get()
+
+    for _ in range(pending):
+        yield done.get()
+
+
+
+def record_history(result: dict, venue: str = None, label: str = None) -> dict:
+    """Store a served result in history; returns it with meta.historyId set.
+
+    Cached results are shared, so the id goes on a copy. A failed write is
+    logged and the result served anyway.
+    """
+    if history is None:
+        return result
+    try:
+        with stage("history"):
+            history_id = history.record(result, venue, label)
+    except Exception as e:
+        ERRORS.inc(type=type(e).__name__)
+        log.exception("history write failed", extra={"fields": {"type": type(e).__name__}})
+        return result
+    return {**result, "meta": {**result.get("meta", {}), "historyId": history_id}}
+
+
+
+def run_job(payload: tuple) -> dict:
+    image_bytes, client, venue, label = payload
+    result, _ = run_analysis(image_bytes, client, background=True)
+    return record_history(result, venue, label)
+
+
+job_queue = JobQueue.from_env(run_job)
+REGISTRY.gauge("neurospace_job_queue_depth", "Async analysis jobs waiting for a worker",
+               lambda: job_queue.stats()["queueDepth"])
 
 
 
 # 🔥 ERROR HANDLERS FOR BETTER DEBUGGING
 @app.errorhandler(500)
 def internal_error(error):
-    print(f"❌ 500 Error: {str(error)}")
+    log_event(logging.ERROR, "500 error", error=str(error))
     return jsonify({"error": "Internal server error", "details": str(error)}), 500
 
 
 @app.errorhandler(Exception)
 def handle_exception(e):
-    print(f"❌ Unhandled Exception: {str(e)}")
-    import traceback
-    traceback.print_exc()
+    ERRORS.inc(type=type(e).__name__)
+    log.exception("unhandled exception", extra={"fields": {"type": type(e).__name__}})
     return jsonify({"error": str(e)}), 500
 
 
 
+def analysis_error(e: Exception) -> tuple:
+    """Record a failed analysis and map it to (body, status, headers)."""
+    if isinstance(e, Rejected):
+        log_event(logging.WARNING, "request rejected by admission control", reason=e.reason,
+                  retry_after=round(e.retry_after, 1))
+        return {"error": str(e), "reason": e.reason}, 429, {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+    if isinstance(e, VideoError):
+        ERRORS.inc(type=type(e).__name__)
+        log_event(logging.WARNING, "could not decode video", error=str(e))
+        return {"error": str(e)}, 400, {}
+    if isinstance(e, UnidentifiedImageError):
+        ERRORS.inc(type=type(e).__name__)
+        log_event(logging.WARNING, "could not decode image", error=str(e))
+        return {"error": "Could not decode image"}, 400, {}
+    if isinstance(e, BackendError):
+        ERRORS.inc(type=type(e.__cause__ or e).__name__)
+        log_event(logging.ERROR, "vision backends unavailable", error=str(e))
+        headers = {}
+        if isinstance(e.__cause__, CircuitOpenError):
+            headers['Retry-After'] = str(max(1, round(e.__cause__.retry_after)))
+        return {"error": "Vision model unavailable", "details": str(e)}, 503, headers
+    if isinstance(e, json.JSONDecodeError):
+        ERRORS.inc(type=type(e).__name__)
+        log_event(logging.ERROR, "failed to parse model response", error=str(e))
+        return {"error": "Failed to parse AI response", "details": str(e)}, 500, {}
+
+    ERRORS.inc(type=type(e).__name__)
+    log.exception("analysis failed", extra={"fields": {"type": type(e).__name__}})
+    return {"error": str(e), "type": type(e).__name__}, 500, {}
+
+
+
+def request_client() -> str:
+    """Admission client id: the API key if one was sent, else the caller's IP."""
+    auth = request.headers.get('Authorization', '')
+    api_key = request.headers.get('X-API-Key') or (auth[7:] if auth.startswith('Bearer ') else None)
+    address = request.access_route[0] if ADMISSION_TRUST_PROXY else request.remote_addr
+    return client_key(api_key, address)
+
+
+
+def history_tags() -> tuple:
+    """(venue, label) form fields an upload is filed under in history."""
+    venue = request.form.get('venue', '').strip() or None
+    label = request.form.get('label', '').strip() or None
+    return venue, label
+
+
+
+def read_upload(extensions: set = ALLOWED_EXTENSIONS) -> tuple:
+    """Validate the single 'file' upload. Returns (stream, error_response).
+
+    The stream is the spooled upload rewound to the start; it is only valid
+    for the duration of the request.
+    """
+    with stage("upload_read"):
+        files = request.files
+
+    if 'file' not in files:
+        log_event(logging.WARNING, "no file part in request")
+        return None, (jsonify({"error": "No file part"}), 400)
+
+    file = files['file']
+
+    if file.filename == '':
+        log_event(logging.WARNING, "no file selected")
+        return None, (jsonify({"error": "No selected file"}), 400)
+
+    if not allowed_file(file.filename, extensions):
+        log_event(logging.WARNING, "invalid file type", filename=file.filename)
+        return None, (jsonify({"error": "Invalid file type"}), 400)
+
+    stream = file.stream
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    log_event(logging.INFO, "upload received", filename=file.filename, bytes=size,
+              spooled=size > UPLOAD_SPOOL_BYTES)
+
+    if size == 0:
+        return None, (jsonify({"error": "Empty file uploaded"}), 400)
+
+    return stream, None
+
+
+
 @app.route('/analyze', methods=['POST', 'OPTIONS'])
 @cross_origin()
 def analyze():
@@ -491,63 +1024,503 @@ def analyze():
     if request.method == 'OPTIONS':
         return '', 204
     
-    print("🧠 NeuroSpace: Received image for analysis...")
+    start = time.perf_counter()
+    client = request_client()
+    try:
+        admission.check_rate(client)
+    except Rejected as e:
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
+
+    upload, error = read_upload()
+    if error is not None:
+        return error
+    venue, label = history_tags()
 
-    if 'file' not in request.files:
-        print("❌ No file part in request")
-        return jsonify({"error": "No file part"}), 400
+    try:
+        if request.args.get('async') in ('1', 'true'):
+            try:
+                # Jobs outlive the request and its temp file, so they get the bytes
+                image_bytes = upload.read()
+                job_id = job_queue.submit((image_bytes, client, venue, label))
+            except QueueFull as e:
+                log_event(logging.WARNING, "job queue full", error=str(e))
+                return jsonify({"error": str(e)}), 503, {'Retry-After': '5'}
+
+            log_event(logging.INFO, "queued analysis job", job_id=job_id)
+            status_url = f"/jobs/{job_id}"
+            body = {"jobId": job_id, "status": "queued", "statusUrl": status_url}
+            # Instant quick score while the job waits for the model
+            measured = measure_locally(image_bytes)
+            if measured is not None:
+                body["localMetrics"] = measured
+            return jsonify(body), 202, {'Location': status_url}
+
+        result, cache_hit = run_analysis(upload, client)
+        result = record_history(result, venue, label)
+
+        observe_stage("total", time.perf_counter() - start)
+        log_event(logging.INFO, "analysis complete", cache_hit=cache_hit,
+                  ms=round((time.perf_counter() - start) * 1000, 1))
+        response = jsonify(result)
+        response.headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+        return response, 200
+
+    except Exception as e:
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
 
-    file = request.files['file']
 
-    if file.filename == '':
-        print("❌ No file selected")
-        return jsonify({"error": "No selected file"}), 400
 
-    if not allowed_file(file.filename):
-        print(f"❌ Invalid file type: {file.filename}")
-        return jsonify({"error": "Invalid file type"}), 400
+@app.route('/analyze/quick', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def analyze_quick():
+    """Local pixel metrics only: no model call, answered in milliseconds."""
+    if request.method == 'OPTIONS':
+        return '', 204
+    if not LOCAL_METRICS:
+        return jsonify({"error": "Local metrics are disabled"}), 404
+
+    upload, error = read_upload()
+    if error is not None:
+        return error
 
+    from local_metrics import measure_image
     try:
-        image_bytes = file.read()
-        print(f"📊 Original image size: {len(image_bytes)/1024/1024:.2f}MB")
+        with stage("local_metrics"):
+            measured = measure_image(upload)
+    except Exception as e:
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
+    return jsonify(measured), 200
+
+
 
+@app.route('/analyze/stream', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def analyze_stream():
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    client = request_client()
+    try:
+        admission.check_rate(client)
+    except Rejected as e:
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
+
+    upload, error = read_upload()
+    if error is not None:
+        return error
+    venue, label = history_tags()
+
+    # Compress now: the upload's temp file is closed before the generator runs.
+    # The model slot and budget mode are settled up front too, so a busy server
+    # or an exhausted budget can still answer 429.
+    try:
+        image_bytes = compress_image(upload, max_size_mb=4)
+        mode = budget_mode(client)
+        lease = admission.acquire(client)
+    except Exception as e:
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
+    slot_start = time.monotonic()
+
+    def generate():
+        try:
+            for event, data in stream_analysis(image_bytes, client, mode):
+                if event == "complete":
+                    data = record_history(data, venue, label)
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            log_event(logging.INFO, "streaming analysis complete")
+        except Exception as e:
+            ERRORS.inc(type=type(e).__name__)
+            log.exception("streaming analysis failed", extra={"fields": {"type": type(e).__name__}})
+            yield f"event: error\ndata: {json.dumps({'error': str(e), 'type': type(e).__name__})}\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: admission.release(lease, time.monotonic() - slot_start))
+    return response
+
+
+
+@app.route('/analyze/batch', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def analyze_batch():
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    files = request.files.getlist('files')
+    log_event(logging.INFO, "batch received", files=len(files))
+
+    if not files:
+        return jsonify({"error": "No files part"}), 400
+
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"Too many files (max {BATCH_MAX_FILES})"}), 400
+
+    client = request_client()
+    try:
+        admission.check_rate(client, cost=len(files))
+    except Rejected as e:
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
+
+    venue, label = history_tags()
+    uploads = []
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            return jsonify({"error": "Invalid file type", "filename": file.filename}), 400
+        image_bytes = file.read()
         if len(image_bytes) == 0:
-            return jsonify({"error": "Empty file uploaded"}), 400
-
-        image_bytes = compress_image(image_bytes, max_size_mb=4)
-
-        print("🔬 Analyzing with OpenAI Vision...")
-        
-        analysis = analyze_image_with_openai(image_bytes)
-        print(f"📋 Analysis received, normalizing...")
-        
-        analysis = normalize_analysis(analysis)
-        print(f"🎨 Transforming for frontend...")
-        
-        result = transform_for_frontend(analysis)
-
-        print("✅ Analysis complete!")
-        return jsonify(result), 200
-
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON parsing error: {e}")
-        return jsonify({"error": "Failed to parse AI response", "details": str(e)}), 500
+            return jsonify({"error": "Empty file uploaded", "filename": file.filename}), 400
+        uploads.append((file.filename, image_bytes))
+
+    def generate():
+        results = []
+        for outcome in run_batch(uploads, client):
+            if outcome["type"] == "result":
+                outcome["result"] = record_history(outcome["result"], venue, label)
+                results.append(outcome["result"])
+            yield json.dumps(outcome) + "\n"
+
+        summary = aggregate_venue(results)
+        summary["failed"] = len(uploads) - len(results)
+        log_event(logging.INFO, "batch complete", analyzed=len(results), total=len(uploads))
+        yield json.dumps({"type": "summary", "venue": summary}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+
+@app.route('/analyze/video', methods=['POST', 'OPTIONS'])
+@cross_origin()
+def analyze_video():
+    """Analyze the distinct views of a walkthrough video as one venue.
+
+    Distinct views are sampled while the upload is decoded (video.KeyframeSampler)
+    and fed through the batch pipeline as they come. The response is NDJSON
+    like /analyze/batch: a 'result' or 'error' line per frame, with its time
+    in the video, then a 'summary' carrying the venue report, a per-frame
+    timeline and the sampling counts.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+    if not video_support():
+        return jsonify({"error": "Video analysis is not available (install av)"}), 501
+
+    upload, error = read_upload(ALLOWED_VIDEO_EXTENSIONS)
+    if error is not None:
+        return error
+
+    # The video is decoded while the response streams, after Flask has closed the
+    # request's files, so take the spooled upload out of the request; closed below
+    request.files['file'].stream = io.BytesIO()
+
+    client = request_client()
+    container = None
+    try:
+        container = open_video(upload)
+        # Charged once, like a batch of as many images as the clip can yield,
+        # so a walkthrough the limiter admits is never cut short by it
+        admission.check_rate(client, cost=video_sampler.frame_budget(container))
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": str(e), "type": type(e).__name__}), 500
+        if container is not None:
+            container.close()
+        upload.close()
+        body, status, headers = analysis_error(e)
+        return jsonify(body), status, headers
+    venue, label = history_tags()
+    counts, times = {}, {}
+
+    def sampled():
+        frames = video_sampler.frames(container, counts)
+        try:
+            for index, (seconds, image_bytes) in enumerate(frames):
+                filename = f"frame-{index:03d}.jpg"
+                times[filename] = seconds
+                yield filename, image_bytes
+        except VideoError as e:
+            # Keep what was sampled so far; the summary says why sampling stopped
+            counts["stopped"] = str(e)
+            log_event(logging.WARNING, "video sampling stopped early", error=str(e), frames=len(times))
+        finally:
+            frames.close()
+            upload.close()
+
+    def generate():
+        results, timeline = [], []
+        for outcome in run_batch(sampled(), client):
+            outcome["time"] = times.get(outcome["filename"])
+            if outcome["type"] == "result":
+                outcome["result"] = record_history(outcome["result"], venue, label)
+                results.append(outcome["result"])
+                timeline.append({"time": outcome["time"], "overall": outcome["result"]["scores"].get("overall")})
+            yield json.dumps(outcome) + "\n"
+
+        summary = aggregate_venue(results)
+        summary["failed"] = len(times) - len(results)
+        summary["timeline"] = sorted(timeline, key=lambda point: point["time"])
+        summary["frames"] = dict(counts, analyzed=len(results))
+        log_event(logging.INFO, "video walkthrough complete", analyzed=len(results), sampled=len(times),
+                  decoded=counts.get("decoded"), seconds=counts.get("seconds"))
+        yield json.dumps({"type": "summary", "venue": summary}) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@cross_origin()
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+
+    body = {"jobId": job["id"], "status": job["status"]}
+    if job["status"] == "done":
+        body["result"] = job["result"]
+    elif job["status"] == "error":
+        body.update(job["error"])
+
+    return jsonify(body), 200
+
+
+
+def query_number(name: str, cast=float):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        raise HistoryError(f"{name} must be a number")
+
+
+
+def history_response(query):
+    """Run a history query, mapping bad parameters to 400."""
+    if history is None:
+        return jsonify({"error": "History is disabled"}), 404
+    try:
+        return jsonify(query()), 200
+    except HistoryError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+
+@app.route('/analyses', methods=['GET'])
+@cross_origin()
+def list_analyses():
+    return history_response(lambda: history.list(
+        venue=request.args.get('venue') or None,
+        label=request.args.get('label') or None,
+        since=query_number('since'),
+        until=query_number('until'),
+        min_overall=query_number('minOverall'),
+        limit=query_number('limit', int) or 20,
+        cursor=request.args.get('cursor') or None,
+    ))
+
+
+
+@app.route('/analyses/<int:analysis_id>', methods=['GET'])
+@cross_origin()
+def get_analysis(analysis_id):
+    if history is None:
+        return jsonify({"error": "History is disabled"}), 404
+    stored = history.get(analysis_id)
+    if stored is None:
+        return jsonify({"error": "Unknown analysis"}), 404
+    # Stored analyses never change: clients revalidate with the ETag and get a 304
+    return jsonify(stored), 200, {'Cache-Control': 'private, no-cache'}
+
+
+
+def compare_side(prefix: str) -> dict:
+    """?a=<id> or ?venueA=<name>[&labelA=<label>] (likewise for b)."""
+    suffix = prefix.upper()
+    side = {"id": request.args.get(prefix), "venue": request.args.get(f"venue{suffix}"),
+            "label": request.args.get(f"label{suffix}")}
+    return {k: v for k, v in side.items() if v}
+
+
+
+@app.route('/analyses/compare', methods=['GET'])
+@cross_origin()
+def compare_analyses():
+    return history_response(lambda: history.compare(compare_side('a'), compare_side('b')))
+
+
+
+@app.route('/venues', methods=['GET'])
+@cross_origin()
+def list_venues():
+    return history_response(lambda: {"venues": history.venues(query_number('limit', int) or 50)})
+
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+
+# Backends answer a cheap API call during warm-up, opening a keep-alive connection
+WARMUP_PING = os.getenv("WARMUP_PING", "0") == "1"
+
+_startup = {"pid": None, "state": "cold", "warmupMs": None, "steps": {}, "backends": {}, "error": None}
+_startup_lock = threading.Lock()
+
+
+def import_heavy_modules() -> dict:
+    """Import what analyses need but /health does not. Returns ms per module.
+
+    gunicorn.conf.py calls this in the master under --preload so workers
+    share the pages; otherwise each worker's warm-up pays for it.
+    """
+    modules = []
+    if any(b.name == "openai" for b in vision_router.backends):
+        modules.append("openai")
+    if LOCAL_METRICS:
+        modules.append("local_metrics")
+
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    if "openai" in modules:
+        # A throwaway client pulls in the HTTP transport's lazy imports and the shared TLS context
+        start = time.perf_counter()
+        make_openai_http_client(1, MODEL_TIMEOUT_SECONDS).close()
+        timings["http_client"] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+def warm_up() -> None:
+    """Load modules, build clients and open stores so the first request does not pay for it."""
+    start = time.perf_counter()
+    try:
+        steps = {"imports": import_heavy_modules()}
+        t = time.perf_counter()
+        ANALYSIS_PROMPT.token_counts()
+        if history is not None:
+            history.stats()
+        analysis_cache.stats()
+        steps["state_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        backends = vision_router.warm(ping=WARMUP_PING)
+    except Exception as e:
+        log.exception("warm-up failed", extra={"fields": {"type": type(e).__name__}})
+        with _startup_lock:
+            _startup.update(state="failed", error=f"{type(e).__name__}: {e}")
+        return
+
+    warmup_ms = round((time.perf_counter() - start) * 1000, 1)
+    with _startup_lock:
+        _startup.update(state="ready", warmupMs=warmup_ms, steps=steps, backends=backends)
+    log_event(logging.INFO, "worker warmed up", ms=warmup_ms, **steps["imports"],
+              backends={name: r.get("ms", r.get("error")) for name, r in backends.items()})
+
+
+def start_warm_up() -> None:
+    """Warm this process up in the background, once (called post-fork)."""
+    with _startup_lock:
+        if _startup["pid"] == os.getpid():
+            return
+        _startup.update(pid=os.getpid(), state="warming", warmupMs=None, steps={}, backends={}, error=None)
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def readiness() -> dict:
+    with _startup_lock:
+        status = dict(_startup)
+    status["ready"] = status["state"] == "ready" and status["pid"] == os.getpid()
+    return status
+
+
+
+def health_status() -> dict:
+    vision = vision_router.stats()
+    all_open = all(b["circuit"]["state"] == "open" for b in vision["backends"])
+
+    return {
+        "status": "degraded" if all_open else "ok",
+        "model": OPENAI_MODEL,
+        "vision": vision,
+        "promptVersion": PROMPT_VERSION,
+        "prompt": ANALYSIS_PROMPT.stats(),
+        "cache": analysis_cache.stats(),
+        "nearDuplicates": similar_images.stats() if similar_images is not None else None,
+        "jobs": job_queue.stats(),
+        "admission": admission.stats(),
+        "coalescing": analysis_flights.stats() if analysis_flights is not None else None,
+        "budgets": budgets.stats() if budgets is not None else None,
+        "history": history.stats() if history is not None else None,
+        "startup": readiness(),
+    }
 
 
 
 @app.route('/health', methods=['GET'])
 @cross_origin()
 def health():
-    return jsonify({"status": "ok", "model": "gpt-4o-mini"})
+    return jsonify(health_status())
+
+
+
+@app.route('/admin/usage', methods=['GET'])
+@cross_origin()
+def admin_usage():
+    """Token and cost aggregates per tenant, model/mode (with latency) and day.
+
+    ?days=N (default 30) and ?tenant=<client id>. Requires ADMIN_TOKEN, sent
+    as a Bearer token or X-Admin-Token; the endpoint is off without one.
+    """
+    if ADMIN_TOKEN is None or budgets is None:
+        return jsonify({"error": "Usage reporting is disabled"}), 404
+    auth = request.headers.get('Authorization', '')
+    token = request.headers.get('X-Admin-Token') or (auth[7:] if auth.startswith('Bearer ') else '')
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        days = query_number('days', int)
+    except HistoryError as e:
+        return jsonify({"error": str(e)}), 400
+    if days is None:
+        days = 30
+    elif not 1 <= days <= 366:
+        return jsonify({"error": "days must be between 1 and 366"}), 400
+    report = budgets.report(days, request.args.get('tenant') or None)
+    return jsonify(report), 200, {'Cache-Control': 'no-store'}
+
+
+
+@app.route('/meta', methods=['GET'])
+@cross_origin()
+def meta():
+    """Icons, colors and the ideal image that analysis results no longer repeat."""
+    return jsonify(frontend_meta()), 200, {'Cache-Control': f'public, max-age={META_MAX_AGE}'}
+
+
+
+@app.route('/ready', methods=['GET'])
+@cross_origin()
+def ready():
+    """Readiness probe: 503 until this worker's clients and modules are warmed up.
+
+    Unlike /health (is the process alive), this gates traffic to a worker.
+    """
+    start_warm_up()
+    status = readiness()
+    return jsonify(status), 200 if status["ready"] else 503
 
 
 
 if __name__ == '__main__':
-    print("🚀 NeuroSpace AI Server running...")
+    log_event(logging.INFO, "NeuroSpace AI Server running")
+    start_warm_up()
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
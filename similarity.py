@@ -0,0 +1,183 @@
+"""Perceptual hashes and a Hamming-distance index for near-duplicate uploads.
+
+Two 64-bit hashes are taken from every analyzed image: a pHash (sign of the
+low-frequency DCT coefficients of a 32x32 grayscale thumbnail, robust to
+re-encoding, small crops and exposure changes) and a dHash (horizontal
+gradient signs of a 9x8 thumbnail), which is used to confirm pHash matches.
+
+``HashIndex`` is a multi-index hashing structure: the pHash is split into
+four 16-bit chunks, each with its own lookup table. Two hashes within
+distance r must agree to within r // 4 bits on at least one chunk
+(pigeonhole), so a query probes every chunk value in that radius and only
+verifies the candidates that share a bucket. With the default radius that is
+68 dictionary probes regardless of index size; buckets store the full hashes,
+so the ~1000 candidates at a million entries are filtered in one
+comprehension and lookups stay under a millisecond
+(``python -m benchmarks.bench_similarity``).
+"""
+import io
+import itertools
+import math
+import operator
+import threading
+
+from PIL import Image, ImageOps
+
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+# Rows of the DCT-II basis for the coefficients pHash keeps
+_DCT_BASIS = [[math.cos(math.pi * u * (2 * x + 1) / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+              for u in range(_DCT_KEEP)]
+
+
+def _grayscale(img: Image.Image, size: tuple) -> list:
+    return list(img.convert('L').resize(size, Image.Resampling.BILINEAR).getdata())
+
+
+def phash(img: Image.Image) -> int:
+    """64-bit DCT hash: bit set where a low-frequency coefficient exceeds the median."""
+    pixels = _grayscale(img, (_DCT_SIZE, _DCT_SIZE))
+    rows = [pixels[y * _DCT_SIZE:(y + 1) * _DCT_SIZE] for y in range(_DCT_SIZE)]
+
+    # Separable 2-D DCT, computing only the top-left 8x8 block
+    partial = [[sum(map(operator.mul, row, basis)) for row in rows] for basis in _DCT_BASIS]
+    coeffs = [sum(map(operator.mul, column, basis)) for basis in _DCT_BASIS for column in partial]
+
+    # The DC term only tracks overall brightness; leave it out of the median
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    return _pack(c > median for c in coeffs)
+
+
+def dhash(img: Image.Image) -> int:
+    """64-bit gradient hash: bit set where a pixel is brighter than its right neighbour."""
+    pixels = _grayscale(img, (9, 8))
+    return _pack(pixels[y * 9 + x] > pixels[y * 9 + x + 1] for y in range(8) for x in range(8))
+
+
+def _pack(bits) -> int:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bool(bit)
+    return value
+
+
+def image_hashes(image_bytes: bytes) -> tuple:
+    """(phash, dhash) of encoded image bytes; JPEGs are decoded at 1/8 scale."""
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == 'JPEG':
+        img.draft('L', (_DCT_SIZE * 2, _DCT_SIZE * 2))
+    img = ImageOps.exif_transpose(img)
+    return phash(img), dhash(img)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _chunks(value: int) -> list:
+    return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _flip_masks(radius: int) -> list:
+    """Every CHUNK_BITS-bit mask with at most radius bits set."""
+    masks = []
+    for bits in range(radius + 1):
+        for positions in itertools.combinations(range(CHUNK_BITS), bits):
+            masks.append(sum(1 << p for p in positions))
+    return masks
+
+
+class HashIndex:
+    """Bounded multi-index hash table of (phash, dhash) -> value, oldest evicted first."""
+
+    def __init__(self, max_distance: int = 6, dhash_distance: int = 12, max_entries: int = 100_000):
+        self.max_distance = max_distance
+        self.dhash_distance = dhash_distance
+        self.max_entries = max_entries
+        self._masks = _flip_masks(max_distance // CHUNKS)
+
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._entries = {}
+        self._by_value = {}
+        self._next_id = 0
+        self._oldest_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "candidates": 0}
+
+    def add(self, phash_value: int, dhash_value: int, value) -> None:
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (phash_value, dhash_value, value)
+            self._by_value.setdefault(value, []).append(entry_id)
+            for table, chunk in zip(self._tables, _chunks(phash_value)):
+                hashes, ids = table.setdefault(chunk, ([], []))
+                hashes.append(phash_value)
+                ids.append(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(self._oldest_id)
+                self._oldest_id += 1
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        ids = self._by_value[entry[2]]
+        ids.remove(entry_id)
+        if not ids:
+            del self._by_value[entry[2]]
+        for table, chunk in zip(self._tables, _chunks(entry[0])):
+            hashes, ids = table[chunk]
+            position = ids.index(entry_id)
+            del hashes[position], ids[position]
+            if not ids:
+                del table[chunk]
+
+    def nearest(self, phash_value: int, dhash_value: int):
+        """(value, distance) of the closest stored hash within max_distance, or None."""
+        best = None
+        scanned = 0
+        limit = self.max_distance
+        with self._lock:
+            self._stats["lookups"] += 1
+            for table, chunk in zip(self._tables, _chunks(phash_value)):
+                for mask in self._masks:
+                    bucket = table.get(chunk ^ mask)
+                    if bucket is None:
+                        continue
+                    hashes, ids = bucket
+                    scanned += len(hashes)
+                    # Buckets hold the full hashes so most candidates are rejected without a lookup
+                    for position in [i for i, h in enumerate(hashes) if (phash_value ^ h).bit_count() <= limit]:
+                        _, stored_dhash, value = self._entries[ids[position]]
+                        distance = (phash_value ^ hashes[position]).bit_count()
+                        if best is not None and distance >= best[1]:
+                            continue
+                        if (dhash_value ^ stored_dhash).bit_count() <= self.dhash_distance:
+                            best = (value, distance)
+            self._stats["candidates"] += scanned
+            if best is not None:
+                self._stats["matches"] += 1
+        return best
+
+    def discard(self, value) -> None:
+        """Forget every entry pointing at value (e.g. an evicted cache key)."""
+        with self._lock:
+            for entry_id in list(self._by_value.get(value, ())):
+                self._remove(entry_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["maxDistance"] = self.max_distance
+        lookups = stats["lookups"]
+        stats["avgCandidates"] = round(stats.pop("candidates") / lookups, 1) if lookups else 0.0
+        return stats
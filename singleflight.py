@@ -0,0 +1,299 @@
+"""Single-flight coalescing of identical in-flight analyses.
+
+When several requests for the same content key (image hash + prompt + model)
+arrive while the first is still waiting on the model, only that first one
+(the leader) runs; the others wait for it and get a copy of its result. A
+leader that fails wakes its followers, and they retry as if they had arrived
+first, so one client's rate limit or a transient error is never passed on.
+
+Within a process this is a dict of in-flight keys (threads wait on an
+Event, coroutines on a Future). With COALESCE_REDIS_URL (or
+ADMISSION_REDIS_URL) the leader also claims the key in Redis; a worker that
+finds it claimed polls for the published result instead of calling the
+model itself, and takes over if the claim disappears without one.
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from metrics import REGISTRY, log_event
+
+
+COALESCED = REGISTRY.counter(
+    "neurospace_coalesced_total", "Requests served by joining an identical in-flight analysis", ("scope",))
+
+
+# Compare-and-delete, so a leader whose claim expired cannot drop a newer one
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RedisFlights:
+    """Claims and published results shared by every worker through Redis."""
+
+    def __init__(self, url: str, prefix: str = "neurospace:flight"):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        return bool(self._redis.set(f"{self._prefix}:claim:{key}", owner, nx=True, px=int(ttl * 1000)))
+
+    def claimed(self, key: str) -> bool:
+        return bool(self._redis.exists(f"{self._prefix}:claim:{key}"))
+
+    def release(self, key: str, owner: str) -> None:
+        self._release(keys=[f"{self._prefix}:claim:{key}"], args=[owner])
+
+    def publish(self, key: str, owner: str, result, ttl: float) -> None:
+        payload = json.dumps(result, separators=(",", ":"))
+        self._redis.set(f"{self._prefix}:result:{key}", payload, px=int(ttl * 1000))
+        self.release(key, owner)
+
+    def result(self, key: str):
+        payload = self._redis.get(f"{self._prefix}:result:{key}")
+        return json.loads(payload) if payload is not None else None
+
+
+class _Flight:
+    __slots__ = ("done", "result", "failed", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+        self.followers = 0
+
+
+_FAILED = object()
+
+
+class SingleFlight:
+    def __init__(self, shared: RedisFlights = None, wait_seconds: float = 180.0,
+                 result_ttl: float = 60.0, poll_interval: float = 0.05):
+        self.shared = shared
+        self.wait_seconds = wait_seconds
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "sharedCoalesced": 0, "timeouts": 0, "sharedErrors": 0}
+
+    @classmethod
+    def from_env(cls, default_wait: float = 180.0) -> "SingleFlight":
+        """Configure from COALESCE_* env vars (COALESCE_REDIS_URL falls back to ADMISSION_REDIS_URL)."""
+        redis_url = os.getenv("COALESCE_REDIS_URL") or os.getenv("ADMISSION_REDIS_URL")
+        return cls(
+            shared=RedisFlights(redis_url) if redis_url else None,
+            wait_seconds=float(os.getenv("COALESCE_WAIT_SECONDS", default_wait)),
+            result_ttl=float(os.getenv("COALESCE_RESULT_TTL", 60)),
+        )
+
+    def _count(self, stat: str, scope: str = None) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+        if scope is not None:
+            COALESCED.inc(scope=scope)
+
+    # --- Threads ---
+
+    def do(self, key: str, fn) -> tuple:
+        """Run fn() once for concurrent callers with the same key. Returns (result, coalesced)."""
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    flight.followers += 1
+
+            if leader:
+                return self._lead(key, flight, fn)
+
+            if not flight.done.wait(self.wait_seconds):
+                # The leader is stuck; stop waiting on it but leave it registered
+                self._count("timeouts")
+                return fn(), False
+            if not flight.failed:
+                self._count("coalesced", "local")
+                return copy.deepcopy(flight.result), True
+            # Leader failed: retry, as leader unless another follower got there first
+
+    def _lead(self, key: str, flight: _Flight, fn) -> tuple:
+        self._count("leaders")
+        try:
+            result, coalesced = self._shared_do(key, fn)
+            # Followers get their own copy, taken before the caller can mutate it
+            flight.result = copy.deepcopy(result)
+            return result, coalesced
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _shared_do(self, key: str, fn) -> tuple:
+        if self.shared is None:
+            return fn(), False
+
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            try:
+                claimed = self.shared.claim(key, owner, self.wait_seconds)
+            except Exception as e:
+                return self._shared_unavailable(e, fn)
+            if claimed:
+                return self._run_claimed(key, owner, fn), False
+
+            # Another worker is analyzing this image; wait for what it publishes
+            while time.monotonic() < deadline:
+                try:
+                    result = self._poll_shared(key)
+                except Exception as e:
+                    return self._shared_unavailable(e, fn)
+                if result is _FAILED:
+                    break
+                if result is not None:
+                    self._count("sharedCoalesced", "shared")
+                    return result, True
+                time.sleep(self.poll_interval)
+            else:
+                self._count("timeouts")
+                return fn(), False
+
+    def _run_claimed(self, key: str, owner: str, fn):
+        try:
+            result = fn()
+        except BaseException:
+            self._quietly(self.shared.release, key, owner)
+            raise
+        self._quietly(self.shared.publish, key, owner, result, self.result_ttl)
+        return result
+
+    def _shared_unavailable(self, error: Exception, fn) -> tuple:
+        self._count("sharedErrors")
+        log_event(logging.WARNING, "shared coalescing store unavailable", error=str(error), type=type(error).__name__)
+        return fn(), False
+
+    def _quietly(self, op, *args) -> None:
+        try:
+            op(*args)
+        except Exception as e:
+            self._count("sharedErrors")
+            log_event(logging.WARNING, "shared coalescing store unavailable", error=str(e), type=type(e).__name__)
+
+    def wait_for(self, key: str):
+        """Result of an in-flight call for key (waiting for it), or None if there is none."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                return None
+            flight.followers += 1
+        if not flight.done.wait(self.wait_seconds) or flight.failed:
+            return None
+        self._count("coalesced", "local")
+        return copy.deepcopy(flight.result)
+
+    # --- Event loop ---
+
+    async def ado(self, key: str, factory) -> tuple:
+        """do() for coroutines: factory() returns an awaitable. Waiting never blocks the loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            future = self._async_flights.get(key)
+            if future is None:
+                future = self._async_flights[key] = loop.create_future()
+                self._count("leaders")
+                try:
+                    result, coalesced = await self._ashared_do(key, factory)
+                    future.set_result(copy.deepcopy(result))
+                    return result, coalesced
+                except BaseException:
+                    future.set_result(_FAILED)
+                    raise
+                finally:
+                    if self._async_flights.get(key) is future:
+                        del self._async_flights[key]
+
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), self.wait_seconds)
+            except asyncio.TimeoutError:
+                self._count("timeouts")
+                return await factory(), False
+            if result is not _FAILED:
+                self._count("coalesced", "local")
+                return copy.deepcopy(result), True
+
+    async def _ashared_do(self, key: str, factory) -> tuple:
+        if self.shared is None:
+            return await factory(), False
+
+        # Redis calls block, so each one runs in a thread rather than on the loop
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            try:
+                claimed = await asyncio.to_thread(self.shared.claim, key, owner, self.wait_seconds)
+            except Exception as e:
+                self._count("sharedErrors")
+                log_event(logging.WARNING, "shared coalescing store unavailable", error=str(e), type=type(e).__name__)
+                return await factory(), False
+            if claimed:
+                try:
+                    result = await factory()
+                except BaseException:
+                    await asyncio.to_thread(self._quietly, self.shared.release, key, owner)
+                    raise
+                await asyncio.to_thread(self._quietly, self.shared.publish, key, owner, result, self.result_ttl)
+                return result, False
+
+            while time.monotonic() < deadline:
+                try:
+                    result = await asyncio.to_thread(self._poll_shared, key)
+                except Exception as e:
+                    self._count("sharedErrors")
+                    log_event(logging.WARNING, "shared coalescing store unavailable", error=str(e),
+                              type=type(e).__name__)
+                    return await factory(), False
+                if result is _FAILED:
+                    break
+                if result is not None:
+                    self._count("sharedCoalesced", "shared")
+                    return result, True
+                await asyncio.sleep(self.poll_interval)
+            else:
+                self._count("timeouts")
+                return await factory(), False
+
+    def _poll_shared(self, key: str):
+        """The published result, None while the claim is held, or _FAILED once it is
+        released without one."""
+        result = self.shared.result(key)
+        if result is None and not self.shared.claimed(key):
+            # Released without a result (failed) or just published: check once more
+            result = self.shared.result(key)
+            if result is None:
+                return _FAILED
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["inFlight"] = len(self._flights) + len(self._async_flights)
+        stats["shared"] = self.shared is not None
+        return stats
@@ -0,0 +1,275 @@
+"""Connection pooling, retries and circuit breaking for model calls.
+
+The OpenAI SDK's own retries are switched off in favour of ``Guard``, which
+wraps every backend call with a per-call deadline, jittered exponential
+backoff on 429/5xx/connection errors, and a circuit breaker that fails fast
+once a provider keeps failing, so gunicorn workers are not tied up waiting
+on a provider that is down.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+from metrics import REGISTRY
+
+
+RETRIES = REGISTRY.counter(
+    "neurospace_backend_retries_total", "Retried backend calls by backend and reason", ("backend", "reason"))
+BREAKER_REJECTIONS = REGISTRY.counter(
+    "neurospace_circuit_rejections_total", "Calls rejected by an open circuit breaker", ("backend",))
+
+RETRYABLE_ERRORS = {
+    "APITimeoutError", "APIConnectionError", "TimeoutException", "ConnectError",
+    "ReadTimeout", "ConnectTimeout", "RemoteProtocolError", "TimeoutError", "ConnectionError",
+    "DeadlineExceeded", "ServiceUnavailable", "ResourceExhausted", "InternalServerError",
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def shared_ssl_context():
+    """One TLS context (CA bundle parsed once) for every HTTP client in the process.
+
+    Loading the CA bundle is most of the cost of building a client; the
+    context holds no connections, so one made in a preloading gunicorn
+    master is safe for the forked workers to use.
+    """
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            import ssl
+
+            import certifi
+            _ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return _ssl_context
+
+
+def make_openai_http_client(pool_size: int, timeout: float, connect_timeout: float = 5.0):
+    """Keep-alive HTTP client for the OpenAI SDK with an explicit pool size."""
+    import httpx
+    from openai import DefaultHttpxClient
+
+    return DefaultHttpxClient(
+        verify=shared_ssl_context(),
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=30,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout, pool=connect_timeout),
+    )
+
+
+def make_async_openai_http_client(pool_size: int, timeout: float, connect_timeout: float = 5.0):
+    """AsyncOpenAI counterpart of make_openai_http_client, for the ASGI app."""
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+
+    return DefaultAsyncHttpxClient(
+        verify=shared_ssl_context(),
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=30,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout, pool=connect_timeout),
+    )
+
+
+def error_status(exc: Exception):
+    """HTTP-ish status code carried by an SDK exception, if any."""
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = error_status(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(exc).__mro__)
+
+
+def retry_after_hint(exc: Exception):
+    """Seconds from a Retry-After response header, when the provider sent one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open probe after a cool-down."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if self.state == "open" and elapsed >= self.reset_timeout:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            BREAKER_REJECTIONS.inc(backend=self.name)
+            raise CircuitOpenError(self.name, max(0.0, self.reset_timeout - elapsed))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == "half-open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutiveFailures": self._failures}
+
+
+class Guard:
+    """Deadline + retry with full-jitter backoff + circuit breaker around a call."""
+
+    def __init__(self, name: str, max_attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 8.0, deadline: float = 90.0, breaker: CircuitBreaker = None):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker(name)
+
+    @classmethod
+    def from_env(cls, name: str) -> "Guard":
+        return cls(
+            name,
+            max_attempts=int(os.getenv("MODEL_MAX_ATTEMPTS", 3)),
+            base_delay=float(os.getenv("MODEL_BACKOFF_BASE_MS", 500)) / 1000,
+            max_delay=float(os.getenv("MODEL_BACKOFF_MAX_MS", 8000)) / 1000,
+            deadline=float(os.getenv("MODEL_DEADLINE_SECONDS", 90)),
+            breaker=CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", 30)),
+            ),
+        )
+
+    def _remaining(self, start: float) -> float:
+        remaining = self.deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise TimeoutError(f"{self.name} call exceeded its {self.deadline:.0f}s deadline")
+        return remaining
+
+    def _backoff(self, exc: Exception, attempt: int, start: float):
+        """Record a failed attempt; return seconds to wait before retrying, or None to give up."""
+        retryable = is_retryable(exc)
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            # Caller errors (400s, bad output) say nothing about provider health
+            self.breaker.record_success()
+
+        if not retryable or attempt >= self.max_attempts:
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        hint = retry_after_hint(exc)
+        if hint is not None:
+            delay = max(delay, min(hint, self.max_delay))
+        if time.monotonic() - start + delay >= self.deadline:
+            return None
+
+        RETRIES.inc(backend=self.name, reason=str(error_status(exc) or type(exc).__name__))
+        return delay
+
+    def call(self, fn, *args, **kwargs):
+        """Call fn(*args, timeout=<remaining seconds>, **kwargs) under the policy."""
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            remaining = self._remaining(start)
+
+            self.breaker.before_call()
+            try:
+                result = fn(*args, timeout=remaining, **kwargs)
+            except Exception as e:
+                delay = self._backoff(e, attempt, start)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """Coroutine version of call() for async backends; sleeps without blocking the loop."""
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            attempt += 1
+            remaining = self._remaining(start)
+
+            self.breaker.before_call()
+            try:
+                result = await fn(*args, timeout=remaining, **kwargs)
+            except asyncio.CancelledError:
+                # A hedged loser was cancelled: free the half-open probe slot
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                delay = self._backoff(e, attempt, start)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        return {"circuit": self.breaker.stats(), "maxAttempts": self.max_attempts,
+                "deadlineSeconds": self.deadline}
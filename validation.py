@@ -0,0 +1,481 @@
+"""Declarative schema for the analysis JSON, with repair and validation.
+
+``repair_json`` salvages model output that is fenced, wrapped in prose or
+truncated mid-generation by cutting back to the last complete value and
+closing whatever brackets are still open. ``validate_analysis`` then walks
+``ANALYSIS``: it coerces types, clamps numbers to their domain and fills
+defaults, recording every path it touched so a response can say which
+figures came from the model and which were filled in here.
+
+``find_gaps`` turns that report into the sections (and neuroMetrics card
+ids) worth asking the model for again, instead of re-running the whole
+analysis.
+"""
+import json
+import re
+
+from metrics import REGISTRY
+
+
+VALIDATION_OUTCOMES = REGISTRY.counter(
+    "neurospace_validation_total", "Model replies by repair/validation outcome", ("outcome",))
+
+NEURO_TITLES = {
+    1: "Dopamine & Appetite Stimulation",
+    2: "Stress Reduction & Emotional Safety",
+    3: "Perceived Food Quality Enhancement",
+    4: "Dwell Time & Seating Comfort",
+    5: "Cognitive Load & Decision Ease",
+    6: "Brand Memory Encoding",
+    7: "Social Bonding & Emotional Warmth",
+    8: "Premium Perception & Willingness to Pay",
+    9: "Instagrammability & Share Trigger",
+}
+
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```\s*$")
+
+# Bounds the number of re-parse attempts when repairing a truncated reply
+MAX_REPAIR_ATTEMPTS = 64
+
+
+# --- Repair ---
+
+def repair_json(raw: str) -> tuple:
+    """Parse model output, repairing it if needed. Returns (value, repaired).
+
+    Raises json.JSONDecodeError when nothing object-shaped can be salvaged.
+    """
+    try:
+        return json.loads(raw), False
+    except json.JSONDecodeError as e:
+        error = e
+
+    text = _FENCE_RE.sub("", raw.strip())
+    start = text.find("{")
+    if start < 0:
+        raise error
+    text = text[start:]
+
+    end = text.rfind("}")
+    if end >= 0:
+        try:
+            return json.loads(text[:end + 1]), True
+        except json.JSONDecodeError:
+            pass
+
+    for cut, closers in reversed(_cut_points(text)[-MAX_REPAIR_ATTEMPTS:]):
+        try:
+            return json.loads(text[:cut] + closers), True
+        except json.JSONDecodeError:
+            continue
+    raise error
+
+
+def _cut_points(text: str) -> list:
+    """(index, closing brackets) pairs where text[:index] ends on a complete value."""
+    points = []
+    stack = []
+    in_string = escape = False
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            points.append((i + 1, "".join(reversed(stack))))
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                break
+            points.append((i + 1, "".join(reversed(stack))))
+        elif ch == ",":
+            points.append((i, "".join(reversed(stack))))
+
+    return points
+
+
+# --- Schema ---
+
+class Report:
+    """Paths the validator had to change, in JSON-path-ish notation."""
+
+    def __init__(self):
+        self.defaulted = []
+        self.clamped = []
+        self.dropped = []
+        self.measured = []
+
+    def as_meta(self) -> dict:
+        return {"defaulted": self.defaulted, "clamped": self.clamped, "dropped": self.dropped,
+                "measured": self.measured}
+
+
+class Field:
+    """Base field. ``default`` may be a value or a callable(root, record)."""
+
+    def __init__(self, default=None, optional: bool = False):
+        self.default = default
+        self.optional = optional
+
+    def make_default(self, root: dict, record: dict):
+        return self.default(root, record) if callable(self.default) else self.default
+
+    def missing(self, path: str, report: Report, root: dict, record: dict):
+        if not self.optional:
+            # "$" is the whole document, when the reply was not an object at all
+            report.defaulted.append(path or "$")
+        return self.make_default(root, record)
+
+    def validate(self, value, path: str, report: Report, root: dict, record: dict):
+        raise NotImplementedError
+
+
+class Number(Field):
+    def __init__(self, lo=None, hi=None, default=0, decimals: int = None, integer: bool = False, **kwargs):
+        super().__init__(default, **kwargs)
+        self.lo = lo
+        self.hi = hi
+        self.decimals = decimals
+        self.integer = integer
+
+    def validate(self, value, path, report, root, record):
+        if isinstance(value, str):
+            # "$45", "63 min" and the like
+            match = _NUMBER_RE.search(value.replace(",", ""))
+            value = float(match.group()) if match else None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return self.missing(path, report, root, record)
+
+        if self.lo is not None and value < self.lo:
+            value = self.lo
+            report.clamped.append(path)
+        elif self.hi is not None and value > self.hi:
+            value = self.hi
+            report.clamped.append(path)
+
+        if self.integer:
+            return int(round(value))
+        if self.decimals is not None:
+            return round(value, self.decimals)
+        return value
+
+
+class Text(Field):
+    def __init__(self, default="", choices=None, **kwargs):
+        super().__init__(default, **kwargs)
+        self.choices = choices
+
+    def validate(self, value, path, report, root, record):
+        if value is None and self.optional:
+            return None
+        if not isinstance(value, str) or (self.choices and value not in self.choices):
+            return self.missing(path, report, root, record)
+        return value
+
+
+class TextList(Field):
+    def __init__(self, default=(), **kwargs):
+        super().__init__(lambda root, record: list(default), **kwargs)
+
+    def validate(self, value, path, report, root, record):
+        if isinstance(value, str):
+            return [value]
+        if not isinstance(value, list):
+            return self.missing(path, report, root, record)
+        return [str(v) for v in value if v is not None]
+
+
+class Record(Field):
+    def __init__(self, fields: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.fields = fields
+
+    def make_default(self, root, record):
+        if self.default is not None:
+            return super().make_default(root, record)
+        # Build from field defaults without flagging each one separately
+        built = {}
+        root = built if root is None else root
+        for key, field in self.fields.items():
+            built[key] = field.make_default(root, built)
+        return built
+
+    def validate(self, value, path, report, root, record):
+        if not isinstance(value, dict):
+            return self.missing(path, report, root, record)
+
+        out = {}
+        # The root record is its own root, so later defaults can read earlier sections
+        root = out if root is None else root
+        for key, field in self.fields.items():
+            child = f"{path}.{key}" if path else key
+            if key in value:
+                out[key] = field.validate(value[key], child, report, root, out)
+            else:
+                out[key] = field.missing(child, report, root, out)
+        return out
+
+
+class Items(Field):
+    """List of records. ``index_field`` is filled with the 1-based position when absent."""
+
+    def __init__(self, item: Record, min_items: int = 0, max_items: int = None,
+                 index_field: str = None, **kwargs):
+        super().__init__(**kwargs)
+        self.item = item
+        self.min_items = min_items
+        self.max_items = max_items
+        self.index_field = index_field
+
+    def make_default(self, root, record):
+        value = super().make_default(root, record)
+        return list(value) if value is not None else []
+
+    def validate(self, value, path, report, root, record):
+        if not isinstance(value, list) or len(value) < self.min_items:
+            return self.missing(path, report, root, record)
+
+        if self.max_items is not None and len(value) > self.max_items:
+            report.dropped.extend(f"{path}[{i}]" for i in range(self.max_items, len(value)))
+            value = value[:self.max_items]
+
+        out = []
+        for i, element in enumerate(value):
+            if not isinstance(element, dict):
+                report.dropped.append(f"{path}[{i}]")
+                continue
+            if self.index_field and self.index_field not in element:
+                element = dict(element, **{self.index_field: len(out) + 1})
+            out.append(self.item.validate(element, f"{path}[{i}]", report, root, None))
+        if len(out) < self.min_items:
+            return self.missing(path, report, root, record)
+        return out
+
+
+def default_metrics(root: dict, record: dict = None) -> list:
+    """Radar chart fallback derived from the headline scores."""
+    scores = root["scores"]
+    return [
+        {"subject": "Biophilia", "A": scores["biophilia"], "B": 85, "fullMark": 100},
+        {"subject": "Warmth", "A": scores["warmth"], "B": 90, "fullMark": 100},
+        {"subject": "Social Layout", "A": scores["social"], "B": 80, "fullMark": 100},
+        {"subject": "Lighting", "A": 75, "B": 95, "fullMark": 100},
+        {"subject": "Cleanliness", "A": 70, "B": 90, "fullMark": 100},
+        {"subject": "Acoustics", "A": 65, "B": 75, "fullMark": 100},
+    ]
+
+
+def default_neuro_metrics(root: dict, record: dict = None) -> list:
+    """Two generic cards for when the model gave none at all."""
+    return [
+        {
+            "id": 1,
+            "title": NEURO_TITLES[1],
+            "score": round(root["scores"]["overall"] / 10, 1),
+            "drivers": ["High color contrast", "Strong focal points", "Food-centric visuals"],
+            "neuralImpact": "Increased activation of reward pathways via saturated colors and appetitive cues.",
+            "businessEffect": "Higher appetizer and dessert conversion and impulse ordering.",
+            "tag": "High upsell potential",
+        },
+        {
+            "id": 2,
+            "title": NEURO_TITLES[2],
+            "score": 7.0,
+            "drivers": ["Soft seating", "Indirect lighting", "Enclosed booth areas"],
+            "neuralImpact": "Parasympathetic activation via soft textures and reduced visual threat.",
+            "businessEffect": "Longer dwell time and higher likelihood of second rounds.",
+            "tag": None,
+        },
+    ]
+
+
+def _card_score(root: dict, record: dict) -> float:
+    return round(root["scores"]["overall"] / 10, 1)
+
+
+def _card_title(root: dict, record: dict) -> str:
+    return NEURO_TITLES.get(record.get("id"), f"Metric {record.get('id')}")
+
+
+SCORES = Record({
+    "overall": Number(0, 100, 75),
+    "saliency": Number(0, 100, 65),
+    "biophilia": Number(0, 100, 40),
+    "warmth": Number(0, 100, 60),
+    "social": Number(0, 100, 55),
+    "clutter": Number(0, 100, 50),
+})
+
+NEURO_METRIC = Record({
+    "id": Number(1, None, 1, integer=True),
+    "title": Text(_card_title),
+    "score": Number(0, 10, _card_score, decimals=1),
+    "drivers": TextList(),
+    "neuralImpact": Text(""),
+    "businessEffect": Text(""),
+    "tag": Text(None, optional=True),
+})
+
+RADAR_METRIC = Record({
+    "subject": Text(""),
+    "A": Number(0, 100, 50),
+    "B": Number(0, 100, 85),
+    "fullMark": Number(0, None, 100),
+})
+
+INSIGHT = Record({
+    "type": Text("warning", choices=("critical", "warning", "success")),
+    "title": Text(""),
+    "desc": Text(""),
+    "impact": Text(""),
+})
+
+FINANCIALS = Record({
+    "currentDwell": Number(0, None, 45),
+    "predictedDwell": Number(0, None, 60),
+    "currentSpend": Number(0, None, 30),
+    "predictedSpend": Number(0, None, 36),
+    "monthlyRevenueUplift": Number(None, None, 5000),
+})
+
+OBJECT = Record({
+    "label": Text(""),
+    "x": Number(0, 100, 0),
+    "y": Number(0, 100, 0),
+    "width": Number(0, 100, 10),
+    "height": Number(0, 100, 10),
+    "type": Text("positive", choices=("positive", "negative")),
+})
+
+ANALYSIS = Record({
+    "scores": SCORES,
+    "neuroMetrics": Items(NEURO_METRIC, min_items=1, max_items=len(NEURO_TITLES), index_field="id",
+                          default=default_neuro_metrics),
+    "metrics": Items(RADAR_METRIC, min_items=1, default=default_metrics),
+    "insights": Items(INSIGHT),
+    "financials": FINANCIALS,
+    "objects": Items(OBJECT),
+})
+
+
+# --- Entry points ---
+
+def validate_analysis(analysis, measured: dict = None) -> tuple:
+    """Validate/repair a parsed reply against ANALYSIS. Returns (clean, report).
+
+    ``measured`` maps score fields to locally measured values; they replace
+    the constant defaults for scores the reply lacked (listed in
+    report.measured), and a defaulted radar chart is rebuilt from them.
+    """
+    report = Report()
+    clean = ANALYSIS.validate(analysis, "", report, None, None)
+    if measured:
+        whole = {"$", "scores"} & set(report.defaulted)
+        for key, value in measured.items():
+            path = f"scores.{key}"
+            if key in SCORES.fields and (whole or path in report.defaulted):
+                clean["scores"][key] = value
+                report.measured.append(path)
+        if report.measured and "metrics" in report.defaulted:
+            clean["metrics"] = default_metrics(clean)
+    if report.defaulted:
+        VALIDATION_OUTCOMES.inc(outcome="defaulted")
+    if report.clamped:
+        VALIDATION_OUTCOMES.inc(outcome="clamped")
+    if report.measured:
+        VALIDATION_OUTCOMES.inc(outcome="measured")
+    return clean, report
+
+
+def validate_section(key: str, value, root: dict = None):
+    """Validate one top-level section on its own (used while streaming)."""
+    root = root or {"scores": SCORES.make_default(None, None)}
+    return ANALYSIS.fields[key].validate(value, key, Report(), root, root)
+
+
+def validate_card(card: dict, index: int, overall: float) -> dict:
+    """Validate one neuroMetrics card, numbering it ``index`` if it has no id."""
+    if "id" not in card:
+        card = dict(card, id=index)
+    return NEURO_METRIC.validate(card, "neuroMetrics", Report(), {"scores": {"overall": overall}}, None)
+
+
+def find_gaps(analysis) -> dict:
+    """Sections the model left missing or incomplete, and neuroMetrics ids to regenerate.
+
+    Returns {"sections": [...], "cardIds": [...]}; neuroMetrics is listed as a
+    section only when specific cards are missing.
+    """
+    report = Report()
+    clean = ANALYSIS.validate(analysis, "", report, None, None)
+
+    whole = "$" in report.defaulted
+    sections = []
+    for key in ANALYSIS.fields:
+        if key == "neuroMetrics":
+            continue
+        if whole or any(p == key or p.startswith((f"{key}.", f"{key}[")) for p in report.defaulted):
+            sections.append(key)
+
+    if whole or "neuroMetrics" in report.defaulted:
+        complete = set()
+    else:
+        broken = {p.split("]")[0] + "]" for p in report.defaulted if p.startswith("neuroMetrics[")}
+        complete = {card["id"] for i, card in enumerate(clean["neuroMetrics"])
+                    if f"neuroMetrics[{i}]" not in broken}
+    card_ids = [i for i in NEURO_TITLES if i not in complete]
+    if card_ids:
+        sections.append("neuroMetrics")
+
+    return {"sections": sections, "cardIds": card_ids}
+
+
+def merge_sections(analysis: dict, extra: dict, gaps: dict) -> dict:
+    """Fill the gaps in analysis with sections from a re-ask reply."""
+    merged = dict(analysis) if isinstance(analysis, dict) else {}
+    extra = extra if isinstance(extra, dict) else {}
+
+    for key in gaps["sections"]:
+        if key == "neuroMetrics" or key not in extra:
+            continue
+        merged[key] = extra[key]
+
+    cards = extra.get("neuroMetrics")
+    if "neuroMetrics" in gaps["sections"] and isinstance(cards, list):
+        wanted = set(gaps["cardIds"])
+        kept = [c for c in _numbered_cards(merged.get("neuroMetrics")) if c["id"] not in wanted]
+        added = [c for c in _numbered_cards(cards) if c["id"] in wanted]
+        merged["neuroMetrics"] = sorted(kept + added, key=lambda c: c["id"])
+
+    return merged
+
+
+def _numbered_cards(cards) -> list:
+    """The cards with their ids coerced the way NEURO_METRIC reads them.
+
+    A card without an id takes its position, as Items numbers it; one whose id
+    is unusable ("n/a", 0) is dropped rather than guessed at.
+    """
+    numbered = []
+    for card in cards if isinstance(cards, list) else ():
+        if not isinstance(card, dict):
+            continue
+        if "id" not in card:
+            card = dict(card, id=len(numbered) + 1)
+        report = Report()
+        card_id = NEURO_METRIC.fields["id"].validate(card.get("id"), "id", report, None, card)
+        if not report.defaulted and not report.clamped:
+            numbered.append(dict(card, id=card_id))
+    return numbered
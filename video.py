@@ -0,0 +1,161 @@
+"""Keyframe sampling for walkthrough videos.
+
+A walkthrough is a few hundred frames of mostly the same few views, so only
+distinct ones are worth a model call. Frames are demuxed and decoded one at a
+time with PyAV (the optional ``av`` package), so a clip is never held in
+memory. Candidates are taken on a fixed time grid, one every
+VIDEO_MIN_GAP_SECONDS of video, rather than at codec keyframes: encoders
+place those every few seconds to every few minutes (screen recordings), so
+sampling them would make coverage depend on encoder settings, not content.
+The decoder only skips non-reference frames, which nothing else depends on
+and which are never more than a frame or two from the grid. A candidate is
+kept when:
+
+* it differs from the last kept frame by more than VIDEO_SCENE_THRESHOLD
+  (mean absolute difference of 64x36 grayscale thumbnails, 0-255), and
+* its pHash is not within VIDEO_DEDUPE_DISTANCE bits of any kept frame, so a
+  view the camera pans back to is not analyzed twice.
+
+Sampling stops at VIDEO_MAX_FRAMES kept frames or VIDEO_MAX_SECONDS of video.
+Kept frames come out as JPEG bytes, ready for the per-image pipeline.
+"""
+import io
+import math
+import os
+
+from PIL import Image, ImageChops, ImageStat
+
+from similarity import hamming, phash
+
+
+class VideoError(ValueError):
+    """The upload could not be opened or decoded as a video."""
+
+
+_SCENE_SIZE = (64, 36)
+
+
+def video_support() -> bool:
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def open_video(source):
+    """Open a video file or seekable stream with PyAV, checking it has a video track."""
+    import av
+
+    try:
+        container = av.open(source, mode='r')
+    except (av.error.FFmpegError, ValueError) as e:
+        raise VideoError(f"Could not open video: {getattr(e, 'strerror', None) or e}") from e
+    if not container.streams.video:
+        container.close()
+        raise VideoError("Upload has no video track")
+    return container
+
+
+class KeyframeSampler:
+    def __init__(self, max_frames: int = 24, max_seconds: float = 300.0, min_gap_seconds: float = 1.0,
+                 scene_threshold: float = 12.0, dedupe_distance: int = 10, max_side: int = 2048,
+                 quality: int = 90):
+        self.max_frames = max_frames
+        self.max_seconds = max_seconds
+        self.min_gap_seconds = min_gap_seconds
+        self.scene_threshold = scene_threshold
+        self.dedupe_distance = dedupe_distance
+        self.max_side = max_side
+        self.quality = quality
+
+    @classmethod
+    def from_env(cls) -> "KeyframeSampler":
+        return cls(
+            max_frames=int(os.getenv("VIDEO_MAX_FRAMES", 24)),
+            max_seconds=float(os.getenv("VIDEO_MAX_SECONDS", 300)),
+            min_gap_seconds=float(os.getenv("VIDEO_MIN_GAP_SECONDS", 1.0)),
+            scene_threshold=float(os.getenv("VIDEO_SCENE_THRESHOLD", 12.0)),
+            dedupe_distance=int(os.getenv("VIDEO_DEDUPE_DISTANCE", 10)),
+        )
+
+    def frame_budget(self, container) -> int:
+        """Most frames frames() can yield for this clip: one per grid step of its
+        duration (or of max_seconds when the container doesn't say), capped at max_frames."""
+        if self.min_gap_seconds <= 0:
+            return self.max_frames
+        seconds = container.duration / 1_000_000 if container.duration else self.max_seconds
+        steps = math.ceil(min(seconds, self.max_seconds) / self.min_gap_seconds)
+        return max(1, min(self.max_frames, steps))
+
+    def _image(self, frame) -> Image.Image:
+        width, height = frame.width, frame.height
+        scale = min(1.0, self.max_side / max(width, height))
+        img = frame.to_image(width=max(1, round(width * scale)), height=max(1, round(height * scale)))
+        # Phones record portrait clips as rotated landscape frames plus a display matrix
+        rotation = getattr(frame, "rotation", 0) or 0
+        if rotation % 360:
+            img = img.rotate(rotation, expand=True)
+        return img
+
+    def frames(self, container, counts: dict = None):
+        """Yield (seconds, jpeg_bytes) for each distinct view; closes the container.
+
+        counts, if given, is updated with frames decoded, candidates sampled,
+        kept (taken by the consumer) and skipped as too similar or a
+        duplicate, plus the seconds covered.
+        """
+        import av
+
+        counts = counts if counts is not None else {}
+        for name in ("decoded", "sampled", "kept", "similar", "duplicate"):
+            counts.setdefault(name, 0)
+        counts["seconds"] = 0.0
+
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONREF"
+        stream.thread_type = "AUTO"
+
+        next_sample, last_scene, kept_hashes = None, None, []
+        try:
+            for frame in container.decode(stream):
+                seconds = float(frame.time or 0.0)
+                if seconds > self.max_seconds:
+                    break
+                counts["decoded"] += 1
+                counts["seconds"] = round(seconds, 2)
+                if next_sample is not None and seconds < next_sample:
+                    continue
+                # Step from the grid point, not the frame, so the grid doesn't drift;
+                # restart it after the first frame or a gap in the stream
+                if next_sample is None or seconds - next_sample >= self.min_gap_seconds:
+                    next_sample = seconds
+                next_sample += self.min_gap_seconds
+                counts["sampled"] += 1
+
+                img = self._image(frame)
+                scene = img.convert('L').resize(_SCENE_SIZE, Image.Resampling.BILINEAR)
+                if last_scene is not None:
+                    change = ImageStat.Stat(ImageChops.difference(scene, last_scene)).mean[0]
+                    if change < self.scene_threshold:
+                        counts["similar"] += 1
+                        continue
+                frame_hash = phash(img)
+                if any(hamming(frame_hash, h) <= self.dedupe_distance for h in kept_hashes):
+                    counts["duplicate"] += 1
+                    continue
+
+                last_scene = scene
+                kept_hashes.append(frame_hash)
+
+                output = io.BytesIO()
+                img.save(output, format='JPEG', quality=self.quality)
+                yield round(seconds, 2), output.getvalue()
+                # Counted once the consumer has taken it and asked for the next
+                counts["kept"] += 1
+                if counts["kept"] >= self.max_frames:
+                    break
+        except av.error.FFmpegError as e:
+            raise VideoError(f"Could not decode video: {getattr(e, 'strerror', None) or e}") from e
+        finally:
+            container.close()